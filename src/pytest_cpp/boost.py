@@ -1,16 +1,38 @@
 from __future__ import annotations
 
-import io
+import contextlib
 import os
+import re
 import subprocess
-import tempfile
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Container
+from typing import Iterator
 from typing import Sequence
+from typing import TypeVar
 from xml.etree import ElementTree
 
 from pytest_cpp.error import CppTestFailure
 from pytest_cpp.error import Markup
 from pytest_cpp.facade_abc import AbstractFacade
+from pytest_cpp.facade_abc import CppTestResult
+from pytest_cpp.helpers import can_use_report_pipes
+from pytest_cpp.helpers import describe_tests
+from pytest_cpp.helpers import get_timeout_message
+from pytest_cpp.helpers import iterparse_elements
 from pytest_cpp.helpers import make_cmdline
+from pytest_cpp.helpers import parse_duration
+from pytest_cpp.helpers import ReportSink
+from pytest_cpp.helpers import ReportSinks
+from pytest_cpp.helpers import run_process
+from pytest_cpp.helpers import split_filter
+
+T = TypeVar("T")
+
+# Characters which are part of the syntax of "--run_test" filters, besides the "/" between
+# the names of the test units of a path.
+_FILTER_SYNTAX_RE = re.compile("[,:*!@+]")
 
 
 class BoostTestFacade(AbstractFacade):
@@ -18,33 +40,60 @@ class BoostTestFacade(AbstractFacade):
     Facade for BoostTests.
     """
 
+    binary_markers = (
+        b"output_format",
+        b"log_sink",
+        b"list_content",
+        b"libboost_unit_test_framework",
+        b"_ZN5boost9unit_test",
+    )
+
+    supports_batch = True
+
+    def __init__(self, list_content: bool = True) -> None:
+        # if the executable supports "--list_content" (Boost 1.59 and later), otherwise
+        # the whole executable runs as a single test named after it
+        self.list_content = list_content
+
     @classmethod
-    def is_test_suite(
-        cls,
-        executable: str,
-        harness_collect: Sequence[str] = (),
-    ) -> bool:
-        args = make_cmdline(harness_collect, executable, ["--help"])
-        try:
-            output = subprocess.check_output(
-                args,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-            )
-        except (subprocess.CalledProcessError, OSError):
-            return False
-        else:
-            return "--output_format" in output and "log_format" in output
+    def from_help_output(cls, help_output: str) -> BoostTestFacade | None:
+        if "--output_format" in help_output and "log_format" in help_output:
+            return cls(list_content="list_content" in help_output)
+        return None
+
+    @classmethod
+    def from_binary_markers(cls, markers: set[bytes]) -> BoostTestFacade | None:
+        if {b"output_format", b"log_sink"} <= markers:
+            # the framework is linked statically, along with the names of its parameters
+            return cls(list_content=b"list_content" in markers)
+        # when linked dynamically, only "--help" tells if "--list_content" is supported
+        return None
+
+    @classmethod
+    def from_cache_state(cls, state: str | None) -> BoostTestFacade:
+        return cls(list_content=state != "no-list-content")
+
+    def get_cache_state(self) -> str | None:
+        return None if self.list_content else "no-list-content"
 
     def list_tests(
         self,
         executable: str,
         harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
     ) -> list[str]:
-        del harness_collect
-        # unfortunately boost doesn't provide us with a way to list the tests
-        # inside the executable, so the test_id is a dummy placeholder :(
-        return [os.path.basename(os.path.splitext(executable)[0])]
+        """
+        Executes boost with "--list_content" and gets the list of test cases, identified
+        by their path in the test tree, like "my_suite/my_test".
+        """
+        if not self.list_content:
+            # old versions of boost don't provide us with a way to list the tests
+            # inside the executable, so the test_id is a dummy placeholder :(
+            return [os.path.basename(os.path.splitext(executable)[0])]
+        args = make_cmdline(harness_collect, executable, ["--list_content"])
+        # the tests are listed in stderr, while global fixtures might write to stdout
+        process = run_process(args, timeout=timeout, check=True, stderr=subprocess.PIPE)
+        return parse_list_content(process.stderr)
 
     def run_test(
         self,
@@ -52,102 +101,430 @@ class BoostTestFacade(AbstractFacade):
         test_id: str,
         test_args: Sequence[str] = (),
         harness: Sequence[str] = (),
-    ) -> tuple[Sequence[BoostTestFailure] | None, str]:
-        def read_file(name: str) -> str:
-            try:
-                with io.open(name) as f:
-                    return f.read()
-            except IOError:
-                return ""
-
-        with tempfile.TemporaryDirectory(prefix="pytest-cpp") as temp_dir:
-            # On Windows, ValueError is raised when path and start are on different drives.
-            # In this case failing back to the absolute path.
-            try:
-                log_xml = os.path.join(os.path.relpath(temp_dir), "log.xml")
-                report_xml = os.path.join(os.path.relpath(temp_dir), "report.xml")
-            except ValueError:
-                log_xml = os.path.join(temp_dir, "log.xml")
-                report_xml = os.path.join(temp_dir, "report.xml")
-            args = list(
+        timeout: float | None = None,
+    ) -> tuple[Sequence[CppTestFailure] | None, str, float | None]:
+        if self.list_content and not is_exact_filter(test_id):
+            # other test cases might run, so the log must be split by test case
+            test_results, output, error = self._run_tests(
+                executable,
+                [test_id],
+                make_run_test_filters([test_id]),
+                test_args,
+                harness,
+                timeout,
+            )
+            if error is not None:
+                return [error], output, None
+            result = test_results.get(test_id, CppTestResult())
+            return result.failures, output, result.duration
+
+        filters = make_run_test_filters([test_id]) if self.list_content else []
+        try:
+            with self._run(
+                executable,
+                ["--log_level=test_suite", *filters],
+                test_args,
+                harness,
+                self._parse_log,
+                timeout,
+            ) as (
+                returncode,
+                stdout,
+                log_sink,
+                report_sink,
+            ):
+                if returncode not in (0, 200, 201):
+                    return (
+                        [
+                            self._make_internal_error(
+                                executable,
+                                [test_id],
+                                returncode,
+                                stdout,
+                                log_sink,
+                                report_sink,
+                            )
+                        ],
+                        stdout,
+                        None,
+                    )
+
+                try:
+                    results, duration = log_sink.get_result()
+                except FileNotFoundError:
+                    results, duration = [], None
+        except subprocess.TimeoutExpired as e:
+            return [self._make_timeout_error(executable, [test_id], e)], e.output, None
+
+        if results:
+            return results, stdout, duration
+
+        return None, stdout, duration
+
+    def run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+        all_tests: bool = False,
+    ) -> tuple[dict[str, CppTestResult], str, BoostTestFailure | None]:
+        """
+        Runs the given test cases in a single invocation of the executable (or a few, when
+        they are too many to select in a single command line), splitting the log by test case.
+
+        The output can't be split by test case, so it is given to the failed tests only.
+        """
+        if not self.list_content:
+            test_results = {}
+            for test_id in test_ids:
+                failures, output, duration = self.run_test(
+                    executable, test_id, test_args, harness, timeout
+                )
+                test_results[test_id] = CppTestResult(
+                    failures, output=output, duration=duration
+                )
+            return test_results, "".join(x.output for x in test_results.values()), None
+
+        if all_tests:
+            return self._run_tests(
+                executable, test_ids, [], test_args, harness, timeout
+            )
+        # the filters of the test cases of an invocation can't make its command line too long
+        test_results = {}
+        outputs = []
+        error = None
+        for group in split_filter(test_ids, ","):
+            group_results, output, group_error = self._run_tests(
+                executable,
+                group,
+                make_run_test_filters(group),
+                test_args,
+                harness,
+                timeout,
+            )
+            test_results.update(group_results)
+            outputs.append(output)
+            error = error or group_error
+        return test_results, "".join(outputs), error
+
+    def _run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        filters: Sequence[str],
+        test_args: Sequence[str],
+        harness: Sequence[str],
+        timeout: float | None,
+    ) -> tuple[dict[str, CppTestResult], str, BoostTestFailure | None]:
+        """
+        Runs the given test cases, selected with the given "--run_test" filters (all the
+        test cases of the executable if there are none), in a single invocation.
+        """
+        try:
+            with self._run(
+                executable,
+                ["--log_level=test_suite", *filters],
+                test_args,
+                harness,
+                self._parse_log_by_test_case,
+                timeout,
+            ) as (returncode, stdout, log_sink, report_sink):
+                error = None
+                if returncode not in (0, 200, 201):
+                    error = self._make_internal_error(
+                        executable,
+                        test_ids,
+                        returncode,
+                        stdout,
+                        log_sink,
+                        report_sink,
+                    )
+                try:
+                    test_cases, global_failures = log_sink.get_result()
+                except FileNotFoundError:
+                    test_cases, global_failures = {}, []
+                except ElementTree.ParseError:
+                    if error is None:
+                        raise
+                    return {}, stdout, error
+        except subprocess.TimeoutExpired as e:
+            return {}, e.output, self._make_timeout_error(executable, test_ids, e)
+
+        test_results = {}
+        for test_id in test_ids:
+            if test_id not in test_cases and not global_failures:
+                continue
+            failures, skipped, duration = test_cases.get(test_id, ([], None, None))
+            failures = global_failures + failures
+            test_results[test_id] = CppTestResult(
+                failures or None,
+                skipped if not failures else None,
+                stdout if failures else "",
+                duration,
+            )
+        return test_results, stdout, error
+
+    @contextlib.contextmanager
+    def _run(
+        self,
+        executable: str,
+        args: Sequence[str],
+        test_args: Sequence[str],
+        harness: Sequence[str],
+        parse_log: Callable[[BinaryIO], T],
+        timeout: float | None,
+    ) -> Iterator[tuple[int, str, ReportSink[T], ReportSink[None]]]:
+        """
+        Runs the executable with the given arguments, giving the return code, the
+        output, and the sinks of the log (parsed with ``parse_log``) and of the report,
+        which are available until the context is left.
+
+        ``subprocess.TimeoutExpired`` is raised if the executable is killed after
+        ``timeout`` seconds.
+        """
+        use_pipes = self.report_pipes and can_use_report_pipes(harness)
+        with ReportSinks(use_pipes) as sinks:
+            log_sink = sinks.add("log.xml", parse_log)
+            # the report is only needed for error messages
+            report_sink = sinks.add("report.xml", lambda f: None)
+            cmdline = list(
                 make_cmdline(
                     harness,
                     executable,
                     [
                         "--output_format=XML",
-                        f"--log_sink={log_xml}",
-                        f"--report_sink={report_xml}",
+                        f"--log_sink={log_sink.path}",
+                        f"--report_sink={report_sink.path}",
+                        *args,
                     ],
                 )
             )
-            args.extend(test_args)
-
-            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            raw_stdout, _ = p.communicate()
-            stdout = raw_stdout.decode("utf-8") if raw_stdout else ""
-
-            log = read_file(log_xml)
-            report = read_file(report_xml)
-
-        if p.returncode not in (0, 200, 201):
-            msg = (
-                "Internal Error: calling {executable} "
-                "for test {test_id} failed (returncode={returncode}):\n"
-                "output:{stdout}\n"
-                "log:{log}\n"
-                "report:{report}"
-            )
-            failure = BoostTestFailure(
-                "<no source file>",
-                linenum=0,
-                contents=msg.format(
-                    executable=executable,
-                    test_id=test_id,
-                    stdout=stdout,
-                    log=log,
-                    report=report,
-                    returncode=p.returncode,
-                ),
-            )
-            return [failure], stdout
+            cmdline.extend(test_args)
 
-        results = self._parse_log(log=log)
+            try:
+                process = run_process(cmdline, timeout=timeout, pass_fds=sinks.pass_fds)
+            finally:
+                sinks.close()
 
-        if results:
-            return results, stdout
+            yield process.returncode, process.stdout, log_sink, report_sink
+
+    def _make_internal_error(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        returncode: int,
+        stdout: str,
+        log_sink: ReportSink[Any],
+        report_sink: ReportSink[Any],
+    ) -> BoostTestFailure:
+        msg = (
+            "Internal Error: calling {executable} "
+            "for {test_ids} failed (returncode={returncode}):\n"
+            "output:{stdout}\n"
+            "log:{log}\n"
+            "report:{report}"
+        )
+        return BoostTestFailure(
+            "<no source file>",
+            linenum=0,
+            contents=msg.format(
+                executable=executable,
+                test_ids=describe_tests(test_ids),
+                stdout=stdout,
+                log=log_sink.get_text(),
+                report=report_sink.get_text(),
+                returncode=returncode,
+            ),
+        )
 
-        return None, stdout
+    def _make_timeout_error(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        error: subprocess.TimeoutExpired,
+    ) -> BoostTestFailure:
+        return BoostTestFailure(
+            "<no source file>",
+            linenum=0,
+            contents=get_timeout_message(executable, test_ids, error),
+        )
 
-    def _parse_log(self, log: str) -> list[BoostTestFailure]:
+    def _parse_log(
+        self, log_file: BinaryIO
+    ) -> tuple[list[BoostTestFailure], float | None]:
         """
         Parse the "log" section produced by BoostTest.
 
         This is always a XML file, and from this we produce most of the
         failures possible when running BoostTest.
+
+        Returns the failures and the total duration of the test cases which ran.
+        """
+        failures = []
+        duration = None
+        for elem, _ in _iter_log(log_file, (*_FAILURE_TAGS, "TestingTime")):
+            if elem.tag == "TestingTime":
+                duration = (duration or 0.0) + (_get_testing_time(elem) or 0.0)
+            else:
+                failures.append(_make_failure(elem))
+        return failures, duration
+
+    def _parse_log_by_test_case(self, log_file: BinaryIO) -> tuple[
+        dict[str, tuple[list[BoostTestFailure], str | None, float | None]],
+        list[BoostTestFailure],
+    ]:
+        """
+        Parse the "log" section produced by BoostTest with "--log_level=test_suite",
+        where the failures of each test case are found in its element:
+
+        <TestLog>
+          <TestSuite name="MyTest">
+            <TestSuite name="my_suite">
+              <TestCase name="my_test">
+                <Error file="test.cpp" line="19">check 2 == 1 has failed</Error>
+                <TestingTime>52</TestingTime>
+              </TestCase>
+            </TestSuite>
+          </TestSuite>
+        </TestLog>
+
+        Returns a dict of test id -> (failures, skipped message, duration), and the failures
+        found outside of any test case, like errors in global fixtures.
         """
-        # Boosttest will sometimes generate unparseable XML
-        # so we surround it with xml tags.
-        parsed_elements = []
-        log = "<xml>{}</xml>".format(log)
-
-        log_root = ElementTree.fromstring(log)
-        testlog = log_root.find("TestLog")
-
-        parsed_elements.extend(log_root.findall("Exception"))
-        parsed_elements.extend(log_root.findall("Error"))
-        parsed_elements.extend(log_root.findall("FatalError"))
-
-        if testlog is not None:
-            parsed_elements.extend(testlog.findall("Exception"))
-            parsed_elements.extend(testlog.findall("Error"))
-            parsed_elements.extend(testlog.findall("FatalError"))
-
-        result = []
-        for elem in parsed_elements:
-            filename = elem.attrib["file"]
-            linenum = int(elem.attrib["line"])
-            result.append(BoostTestFailure(filename, linenum, elem.text or ""))
-        return result
+        results = {}
+        global_failures = []
+        for elem, ancestors in _iter_log(log_file, ("TestCase", *_FAILURE_TAGS)):
+            if elem.tag != "TestCase":
+                global_failures.append(_make_failure(elem))
+                continue
+            # ancestors are the wrapping root element, the TestLog element, and the test
+            # suites starting from the master test suite, which is not part of test ids
+            path = [x.attrib["name"] for x in ancestors if x.tag == "TestSuite"][1:]
+            test_id = "/".join([*path, elem.attrib["name"]])
+            failures = [_make_failure(x) for x in elem.iter() if x.tag in _FAILURE_TAGS]
+            skipped = None
+            if elem.attrib.get("skipped") == "yes":
+                skipped = elem.attrib.get("reason", "skipped")
+            results[test_id] = (
+                failures,
+                skipped,
+                _get_testing_time(elem.find("TestingTime")),
+            )
+        return results, global_failures
+
+
+_FAILURE_TAGS = ("Exception", "Error", "FatalError")
+
+
+def _iter_log(
+    log_file: BinaryIO, tags: Container[str]
+) -> Iterator[tuple[ElementTree.Element, Sequence[ElementTree.Element]]]:
+    """Parse the given log incrementally (see ``iterparse_elements``)."""
+    # Boosttest will sometimes generate unparseable XML
+    # so we surround it with xml tags.
+    return iterparse_elements(log_file, tags, wrap=True)
+
+
+def _get_testing_time(elem: ElementTree.Element | None) -> float | None:
+    # the duration of test cases is given in microseconds
+    return parse_duration(elem.text, scale=1e-6) if elem is not None else None
+
+
+def _make_failure(elem: ElementTree.Element) -> BoostTestFailure:
+    return BoostTestFailure(
+        elem.attrib["file"], int(elem.attrib["line"]), elem.text or ""
+    )
+
+
+def parse_list_content(output: str) -> list[str]:
+    """
+    Parses the output of "--list_content", where test units are indented by 4 spaces
+    for each level of the test tree, and enabled test units are marked with "*":
+
+    my_suite1*
+        my_test1*
+        my_test2
+    my_test3*
+
+    Returns the ids of the enabled test cases, like "my_suite1/my_test1".
+    """
+    units = []
+    path: list[str] = []
+    for line in output.splitlines():
+        name = line.strip()
+        if not name:
+            continue
+        level = (len(line) - len(line.lstrip(" "))) // 4
+        enabled = name.endswith("*")
+        if enabled:
+            name = name[:-1]
+        del path[level:]
+        path.append(name)
+        units.append((level, "/".join(path), enabled))
+
+    result = []
+    for index, (level, test_id, enabled) in enumerate(units):
+        is_suite = index + 1 < len(units) and units[index + 1][0] > level
+        if enabled and not is_suite:
+            result.append(test_id)
+    return result
+
+
+def make_run_test_filters(test_ids: Sequence[str]) -> list[str]:
+    """
+    Return the "--run_test" arguments which select the given test cases, joining the
+    test cases of the same test suite in a single filter, like "my_suite/my_test1,my_test2".
+
+    Test units with names which can't be given as is (see ``make_name_filter``) are
+    selected by patterns, which might select other test cases too.
+    """
+    suites: dict[str, list[str]] = {}
+    for test_id in test_ids:
+        suite, _, name = test_id.rpartition("/")
+        names = suites.setdefault(suite, [])
+        name = make_name_filter(name)
+        if name not in names:
+            names.append(name)
+    return [
+        "--run_test={}{}".format(
+            (
+                "".join(make_name_filter(x) + "/" for x in suite.split("/"))
+                if suite
+                else ""
+            ),
+            ",".join(names),
+        )
+        for suite, names in suites.items()
+    ]
+
+
+def make_name_filter(name: str) -> str:
+    """
+    Return the component of a "--run_test" filter which selects the test unit with the
+    given name.
+
+    Boost.Test has no way to escape the characters which are part of the syntax of
+    filters (newer versions replace them with "_" in the names of test units), so names
+    with such characters are matched by their longest part without them instead, like
+    "*part*", which might match other test units too.
+    """
+    parts = _FILTER_SYNTAX_RE.split(name)
+    if len(parts) == 1:
+        return name
+    index = max(range(len(parts)), key=lambda i: len(parts[i]))
+    if not parts[index]:
+        return "*"
+    prefix = "" if index == 0 else "*"
+    suffix = "" if index == len(parts) - 1 else "*"
+    return prefix + parts[index] + suffix
+
+
+def is_exact_filter(test_id: str) -> bool:
+    """Return True if the "--run_test" filter of the given test selects only that test."""
+    return _FILTER_SYNTAX_RE.search(test_id) is None
 
 
 class BoostTestFailure(CppTestFailure):
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any
+from typing import Mapping
+from typing import Sequence
+
+import pytest
+
+from pytest_cpp.elf import read_build_id
+from pytest_cpp.helpers import run_process
+
+# Size of the chunks read from executables to hash them.
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_executable_identity(
+    executable: str, harness_collect: Sequence[str] = ()
+) -> list[Any] | None:
+    """
+    Return a JSON-serializable value which changes whenever the given executable is
+    rebuilt, or None if the file cannot be accessed.
+    """
+    try:
+        st = os.stat(executable)
+    except OSError:
+        return None
+    return [
+        st.st_size,
+        st.st_mtime_ns,
+        st.st_ino,
+        read_build_id(executable),
+        list(harness_collect),
+    ]
+
+
+class CollectionCache:
+    """
+    Persists which framework was detected for each executable and the tests it contains
+    across sessions using pytest's cache, so unchanged executables don't need to be
+    executed again during collection.
+
+    Entries are keyed by the executable's absolute path and are discarded as soon as
+    the executable identity (see ``get_executable_identity``) changes.
+    """
+
+    KEY = "cpp/collection"
+
+    def __init__(self, cache: pytest.Cache) -> None:
+        self._cache = cache
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._identities: dict[str, list[Any] | None] = {}
+        self._modified = False
+        entries = cache.get(self.KEY, {})
+        if isinstance(entries, dict):
+            self._entries = entries
+
+    def _get_entry(
+        self, executable: str, harness_collect: Sequence[str]
+    ) -> dict[str, Any] | None:
+        path = os.path.abspath(executable)
+        if path not in self._identities:
+            self._identities[path] = get_executable_identity(path, harness_collect)
+        identity = self._identities[path]
+        if identity is None:
+            return None
+        entry = self._entries.get(path)
+        if entry is None or entry.get("identity") != identity:
+            entry = self._entries[path] = {"identity": identity}
+        return entry
+
+    def get_facade(
+        self, executable: str, harness_collect: Sequence[str] = ()
+    ) -> tuple[bool, tuple[str, str | None] | None]:
+        """
+        Return a tuple of (found, facade), where facade is a tuple of
+        (facade class name, facade cache state), or None for executables which
+        were found not to be test suites.
+        """
+        entry = self._get_entry(executable, harness_collect)
+        if entry is None or "facade" not in entry:
+            return False, None
+        facade = entry["facade"]
+        return True, (facade[0], facade[1]) if facade is not None else None
+
+    def set_facade(
+        self,
+        executable: str,
+        facade: tuple[str, str | None] | None,
+        harness_collect: Sequence[str] = (),
+    ) -> None:
+        entry = self._get_entry(executable, harness_collect)
+        if entry is not None:
+            entry["facade"] = list(facade) if facade is not None else None
+            self._modified = True
+
+    def get_tests(
+        self, executable: str, harness_collect: Sequence[str] = ()
+    ) -> list[str] | None:
+        entry = self._get_entry(executable, harness_collect)
+        if entry is None:
+            return None
+        return entry.get("tests")
+
+    def set_tests(
+        self,
+        executable: str,
+        tests: Sequence[str],
+        harness_collect: Sequence[str] = (),
+    ) -> None:
+        entry = self._get_entry(executable, harness_collect)
+        if entry is not None:
+            entry["tests"] = list(tests)
+            self._modified = True
+
+    def save(self) -> None:
+        if not self._modified:
+            return
+        entries = {
+            path: entry
+            for path, entry in self._entries.items()
+            if os.path.exists(path) and len(entry) > 1
+        }
+        self._cache.set(self.KEY, entries)
+        self._modified = False
+
+
+def get_shared_libraries(executable: str) -> list[str]:
+    """
+    Return the shared libraries loaded by the given executable, as resolved by ``ldd``:
+    paths of the libraries found, and names of the libraries which could not be found.
+
+    Return an empty list for static executables, or when ``ldd`` is not available.
+    """
+    try:
+        output = run_process(["ldd", executable], check=True).stdout
+    except (subprocess.CalledProcessError, OSError):
+        return []
+    libraries = []
+    for line in output.splitlines():
+        name, _, location = line.strip().partition(" => ")
+        if location:
+            path = location.rsplit(" (", 1)[0].strip()
+            libraries.append(path if path.startswith("/") else name)
+        elif name.startswith("/"):
+            # the dynamic loader
+            libraries.append(name.rsplit(" (", 1)[0])
+    return libraries
+
+
+def hash_file(path: str) -> str:
+    """Return the SHA-256 hash of the contents of the given file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Stores which tests passed, keyed by a hash of everything which can change their outcome
+    (see ``get_key``), so tests of executables which did not change don't need to run again.
+
+    Each test which passed is stored as a file named after its key in the given directory,
+    which can be shared by several machines, for example in a network file system.
+    """
+
+    #: Changes whenever the way keys are computed changes.
+    VERSION = 2
+
+    def __init__(
+        self,
+        directory: Path,
+        env: Mapping[str, str | None],
+        settings: Mapping[str, Any] | None = None,
+    ) -> None:
+        self._directory = directory
+        self._env = dict(env)
+        #: JSON-serializable values of the options which can change the outcome of tests
+        self._settings = dict(settings or {})
+        self._executable_hashes: dict[str, str | None] = {}
+
+    def get_key(
+        self,
+        executable: str,
+        test_id: str,
+        arguments: Sequence[str] = (),
+        harness: Sequence[str] = (),
+    ) -> str | None:
+        """
+        Return the key of the given test, computed from the contents of the executable and
+        of its shared libraries, the arguments, the harness, the allowed environment variables,
+        the settings and the test id, or None if the executable cannot be read.
+        """
+        executable_hash = self._get_executable_hash(executable)
+        if executable_hash is None:
+            return None
+        data = [
+            self.VERSION,
+            executable_hash,
+            list(arguments),
+            list(harness),
+            self._env,
+            self._settings,
+            test_id,
+        ]
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _get_executable_hash(self, executable: str) -> str | None:
+        path = os.path.abspath(executable)
+        if path not in self._executable_hashes:
+            digest = hashlib.sha256()
+            try:
+                digest.update(hash_file(path).encode())
+                for library in get_shared_libraries(path):
+                    digest.update(library.encode())
+                    if os.path.isfile(library):
+                        digest.update(hash_file(library).encode())
+            except OSError:
+                self._executable_hashes[path] = None
+            else:
+                self._executable_hashes[path] = digest.hexdigest()
+        return self._executable_hashes[path]
+
+    def _get_path(self, key: str) -> Path:
+        return self._directory / key[:2] / key
+
+    def is_passed(self, key: str) -> bool:
+        return self._get_path(key).is_file()
+
+    def set_passed(self, key: str, test_id: str) -> None:
+        path = self._get_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first, so other sessions never read partial entries
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"test": test_id}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
@@ -3,22 +3,49 @@ from __future__ import annotations
 import enum
 import os
 import subprocess
-import tempfile
+from typing import BinaryIO
+from typing import Dict
 from typing import Optional
 from typing import Sequence
 from xml.etree import ElementTree
 
 import pytest
 
+from pytest_cpp.error import CppMessageFailure
 from pytest_cpp.error import CppTestFailure
 from pytest_cpp.error import Markup
 from pytest_cpp.facade_abc import AbstractFacade
+from pytest_cpp.facade_abc import CppTestResult
+from pytest_cpp.helpers import can_use_report_pipes
+from pytest_cpp.helpers import describe_tests
+from pytest_cpp.helpers import get_help_output
+from pytest_cpp.helpers import get_timeout_message
+from pytest_cpp.helpers import iterparse_elements
 from pytest_cpp.helpers import make_cmdline
+from pytest_cpp.helpers import parse_duration
+from pytest_cpp.helpers import ReportSinks
+from pytest_cpp.helpers import run_process
 
 # Map each special character's Unicode ordinal to the escaped character.
 _special_chars_map: dict[int, str] = {i: "\\" + chr(i) for i in b'[]*,~\\"'}
 
 
+# Longest test spec given in the command line, more test names are given in a file.
+_MAX_TEST_SPEC_LENGTH = 4096
+
+# Statistics of each benchmark of a test case, by benchmark name (see ``parse_benchmarks``).
+Benchmarks = Dict[str, Dict[str, float]]
+
+# Statistics read from each <BenchmarkResults> element: (name, element, attribute).
+_BENCHMARK_STATS = (
+    ("mean", "mean", "value"),
+    ("mean_lower_bound", "mean", "lowerBound"),
+    ("mean_upper_bound", "mean", "upperBound"),
+    ("std_deviation", "standardDeviation", "value"),
+    ("outlier_variance", "outliers", "variance"),
+)
+
+
 def escape(test_id: str) -> str:
     """Escape special characters in test names (see #123)."""
     return test_id.translate(_special_chars_map)
@@ -32,45 +59,94 @@ class Catch2Version(enum.Enum):
 class Catch2Facade(AbstractFacade):
     """
     Facade for Catch2.
+
+    The results of the ``BENCHMARK`` blocks of each test case are given in the
+    ``properties`` of its ``CppTestResult``, so they are only reported when tests run
+    through ``run_tests``.
     """
 
+    supports_batch = True
+
+    binary_markers = (
+        b"--list-test-names-only",
+        b"--list-tests",
+        b"libCatch2",
+        b"_ZN5Catch",
+    )
+
+    def __init__(self, catch_version: Catch2Version | None = None) -> None:
+        # when not given, the version is obtained by running each executable with "--help"
+        self.catch_version = catch_version
+        # "--shard-count" and "--shard-index" were added in Catch2 v3
+        self.supports_shards = catch_version == Catch2Version.V3
+        #: benchmarks of a previous run, by test case (see ``load_benchmark_baseline``)
+        self.benchmark_baseline: dict[str, Benchmarks] | None = None
+        #: benchmarks fail when their mean is larger than in the baseline by more than
+        #: this fraction
+        self.benchmark_threshold = 0.1
+
     @classmethod
     def get_catch_version(
         cls,
         executable: str,
         harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
     ) -> Optional[Catch2Version]:
-        args = make_cmdline(harness_collect, executable, ["--help"])
-        try:
-            output = subprocess.check_output(
-                args,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-            )
-        except (subprocess.CalledProcessError, OSError):
+        help_output = get_help_output(executable, harness_collect, timeout)
+        if help_output is None:
             return None
-        else:
-            return (
-                Catch2Version.V2
-                if "--list-test-names-only" in output
-                else Catch2Version.V3 if "--list-tests" in output else None
-            )
+        return cls._get_catch_version_from_help_output(help_output)
 
     @classmethod
-    def is_test_suite(
-        cls,
-        executable: str,
-        harness_collect: Sequence[str] = (),
-    ) -> bool:
-        return cls.get_catch_version(executable, harness_collect) in [
-            Catch2Version.V2,
-            Catch2Version.V3,
-        ]
+    def _get_catch_version_from_help_output(
+        cls, help_output: str
+    ) -> Optional[Catch2Version]:
+        return (
+            Catch2Version.V2
+            if "--list-test-names-only" in help_output
+            else Catch2Version.V3 if "--list-tests" in help_output else None
+        )
+
+    @classmethod
+    def from_help_output(cls, help_output: str) -> Catch2Facade | None:
+        catch_version = cls._get_catch_version_from_help_output(help_output)
+        if catch_version is None:
+            return None
+        return cls(catch_version)
+
+    @classmethod
+    def from_binary_markers(cls, markers: set[bytes]) -> Catch2Facade | None:
+        if b"--list-test-names-only" in markers:
+            return cls(Catch2Version.V2)
+        # only Catch2 v3 is distributed as a library
+        if b"--list-tests" in markers or b"libCatch2" in markers:
+            return cls(Catch2Version.V3)
+        return None
+
+    @classmethod
+    def from_cache_state(cls, state: str | None) -> Catch2Facade:
+        return cls(Catch2Version(state) if state is not None else None)
+
+    def get_cache_state(self) -> str | None:
+        return self.catch_version.value if self.catch_version is not None else None
+
+    @property
+    def batch_only(self) -> bool:  # type: ignore[override]
+        # benchmarks are only compared with the baseline by ``run_tests``
+        return self.benchmark_baseline is not None
+
+    def _get_catch_version(
+        self, executable: str, harness: Sequence[str], timeout: float | None
+    ) -> Optional[Catch2Version]:
+        if self.catch_version is not None:
+            return self.catch_version
+        return self.get_catch_version(executable, harness, timeout)
 
     def list_tests(
         self,
         executable: str,
         harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
     ) -> list[str]:
         """
         Executes test with "--list-test-names-only" (v2) or "--list-tests --verbosity quiet" (v3) and gets list of tests
@@ -83,18 +159,12 @@ class Catch2Facade(AbstractFacade):
         # This will return an exit code with the number of tests available
         exec_args = (
             ["--list-test-names-only"]
-            if self.get_catch_version(executable, harness_collect) == Catch2Version.V2
+            if self._get_catch_version(executable, harness_collect, timeout)
+            == Catch2Version.V2
             else ["--list-tests", "--verbosity quiet"]
         )
         args = make_cmdline(harness_collect, executable, exec_args)
-        try:
-            output = subprocess.check_output(
-                args,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-            )
-        except subprocess.CalledProcessError as e:
-            output = e.output
+        output = run_process(args, timeout=timeout).stdout
 
         result = output.strip().split("\n")
 
@@ -106,40 +176,24 @@ class Catch2Facade(AbstractFacade):
         test_id: str = "",
         test_args: Sequence[str] = (),
         harness: Sequence[str] = (),
-    ) -> tuple[Sequence[Catch2Failure] | None, str]:
-        with tempfile.TemporaryDirectory(prefix="pytest-cpp") as temp_dir:
-            """
-            On Windows, ValueError is raised when path and start are on different drives.
-            In this case failing back to the absolute path.
-            """
-            catch_version = self.get_catch_version(executable, harness)
+        timeout: float | None = None,
+    ) -> tuple[Sequence[CppTestFailure] | None, str, float | None]:
+        catch_version = self._get_catch_version(executable, harness, timeout)
 
-            if catch_version is None:
-                raise Exception("Invalid Catch Version")
-
-            try:
-                xml_filename = os.path.join(os.path.relpath(temp_dir), "cpp-report.xml")
-            except ValueError:
-                xml_filename = os.path.join(temp_dir, "cpp-report.xml")
-            exec_args = [
-                escape(test_id),
-                "--success",
-                "--reporter=xml",
-                f"--out={xml_filename}",
-            ]
-            exec_args.extend(test_args)
-            args = make_cmdline(harness, executable, exec_args)
+        if catch_version is None:
+            raise Exception("Invalid Catch Version")
 
-            try:
-                output = subprocess.check_output(
-                    args, stderr=subprocess.STDOUT, universal_newlines=True
-                )
-            except subprocess.CalledProcessError as e:
-                output = e.output
-
-            results = self._parse_xml(xml_filename, catch_version)
+        try:
+            results, output = self._run(
+                executable, [test_id], test_args, harness, catch_version, None, timeout
+            )
+        except _ReportError as e:
+            return [e.get_failure(executable, [test_id])], e.output, None
+        except subprocess.TimeoutExpired as e:
+            message = get_timeout_message(executable, [test_id], e)
+            return [CppMessageFailure(message)], e.output or "", None
 
-        for executed_test_id, failures, skipped in results:
+        for executed_test_id, failures, skipped, test_output, duration, _ in results:
             if executed_test_id == test_id:
                 if failures:
                     return (
@@ -147,64 +201,206 @@ class Catch2Facade(AbstractFacade):
                             Catch2Failure(filename, linenum, lines)
                             for (filename, linenum, lines) in failures
                         ],
-                        output,
+                        test_output + output,
+                        duration,
                     )
                 elif skipped:
                     pytest.skip()
                 else:
-                    return None, output
+                    return None, test_output + output, duration
 
         msg = "Internal Error: could not find test {test_id} in results:\n{results}"
 
-        results_list = "\n".join(n for (n, x, f) in results)
+        results_list = "\n".join(n for (n, x, f, o, d, b) in results)
         failure = Catch2Failure(
             msg.format(test_id=test_id, results=results_list), 0, ""
         )
-        return [failure], output
+        return [failure], output, None
+
+    def run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+        all_tests: bool = False,
+    ) -> tuple[dict[str, CppTestResult], str, CppTestFailure | None]:
+        """
+        Runs the given tests in a single invocation of the executable, parsing the report
+        once. The output of each test is the output captured by Catch2 in the report,
+        followed by the output of the whole invocation for failed tests, as it can't be
+        split by test (for example ``printf`` calls, or the report of a sanitizer).
+        """
+        catch_version = self._get_catch_version(executable, harness, timeout)
+
+        if catch_version is None:
+            raise Exception("Invalid Catch Version")
+
+        try:
+            results, output = self._run(
+                executable, test_ids, test_args, harness, catch_version, shard, timeout
+            )
+        except _ReportError as e:
+            return {}, e.output, e.get_failure(executable, test_ids)
+        except subprocess.TimeoutExpired as e:
+            failure = CppMessageFailure(get_timeout_message(executable, test_ids, e))
+            return {}, e.output or "", failure
+
+        selected = set(test_ids)
+        test_results = {}
+        for (
+            executed_test_id,
+            failures,
+            skipped,
+            test_output,
+            duration,
+            benchmarks,
+        ) in results:
+            if executed_test_id not in selected:
+                continue
+            test_failures: list[CppTestFailure] = [
+                Catch2Failure(filename, linenum, lines)
+                for (filename, linenum, lines) in failures
+            ]
+            if self.benchmark_baseline is not None:
+                baseline = self.benchmark_baseline.get(executed_test_id, {})
+                for name, stats in benchmarks.items():
+                    regression = check_benchmark_regression(
+                        name, stats, baseline.get(name), self.benchmark_threshold
+                    )
+                    if regression is not None:
+                        test_failures.append(CppMessageFailure(regression))
+            if test_failures:
+                test_output += output
+            test_results[executed_test_id] = CppTestResult(
+                test_failures or None,
+                "Skipped" if skipped and not test_failures else None,
+                test_output,
+                duration,
+                make_benchmark_properties(benchmarks),
+            )
+        return test_results, output, None
+
+    def _run(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str],
+        harness: Sequence[str],
+        catch_version: Catch2Version,
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+    ) -> tuple[
+        Sequence[
+            tuple[
+                str,
+                Sequence[tuple[str, int, str]],
+                bool,
+                str,
+                float | None,
+                Benchmarks,
+            ]
+        ],
+        str,
+    ]:
+        """
+        Runs the given tests in a single invocation of the executable, returning the
+        parsed results and the output.
+
+        The escaped test names are given as a single test spec separated by commas, or in
+        a file given with "--input-file" when they don't fit in a command line.
+
+        ``subprocess.TimeoutExpired`` is raised if the executable is killed after ``timeout``
+        seconds.
+        """
+        use_pipes = self.report_pipes and can_use_report_pipes(harness)
+        with ReportSinks(use_pipes) as sinks:
+            xml_sink = sinks.add(
+                "cpp-report.xml", lambda f: self._parse_xml(f, catch_version)
+            )
+
+            test_spec = ",".join(escape(x) for x in test_ids)
+            if len(test_spec) > _MAX_TEST_SPEC_LENGTH:
+                input_filename = os.path.join(sinks.get_temp_dir(), "test-names.txt")
+                with open(input_filename, "w", encoding="utf-8") as f:
+                    for test_id in test_ids:
+                        line = escape(test_id)
+                        # lines starting with "#" are comments
+                        if line.startswith("#"):
+                            line = "\\" + line
+                        f.write(line + "\n")
+                exec_args = [f"--input-file={input_filename}"]
+            else:
+                exec_args = [test_spec]
+            exec_args.extend(
+                [
+                    "--success",
+                    "--reporter=xml",
+                    f"--out={xml_sink.path}",
+                    # report the duration of each test
+                    "--durations",
+                    "yes",
+                ]
+            )
+            if shard is not None:
+                shard_index, shard_count = shard
+                exec_args.extend(
+                    [
+                        "--shard-count",
+                        str(shard_count),
+                        "--shard-index",
+                        str(shard_index),
+                    ]
+                )
+            exec_args.extend(test_args)
+            args = make_cmdline(harness, executable, exec_args)
+
+            try:
+                output = run_process(
+                    args, timeout=timeout, pass_fds=sinks.pass_fds
+                ).stdout
+            finally:
+                sinks.close()
+
+            try:
+                results = xml_sink.get_result()
+            except (OSError, ElementTree.ParseError) as e:
+                raise _ReportError(str(e), output) from e
+
+        return results, output
 
     def _parse_xml(
-        self, xml_filename: str, catch_version: Catch2Version
-    ) -> Sequence[tuple[str, Sequence[tuple[str, int, str]], bool]]:
-        root = ElementTree.parse(xml_filename)
+        self, xml_file: BinaryIO, catch_version: Catch2Version
+    ) -> Sequence[
+        tuple[str, Sequence[tuple[str, int, str]], bool, str, float | None, Benchmarks]
+    ]:
         result = []
-        test_suites = (
-            root.findall("Group")
-            if catch_version == Catch2Version.V2
-            else root.iter("Catch2TestRun")
+        test_suite_tag = (
+            "Group" if catch_version == Catch2Version.V2 else "Catch2TestRun"
         )
-        for test_suite in test_suites:
-            for test_case in test_suite.findall("TestCase"):
-                test_name = test_case.attrib["name"]
-                test_result = test_case.find("OverallResult")
-                failures = []
-                if test_result is not None and test_result.attrib["success"] == "false":
-                    test_checks = test_case.findall(".//Expression")
-                    for check in test_checks:
-                        file_name = check.attrib["filename"]
-                        line_num = int(check.attrib["line"])
-                        if check is not None and check.attrib["success"] == "false":
-                            item = check.find("Original")
-                            expected = item.text if item is not None else ""
-                            item = check.find("Expanded")
-                            actual = item.text if item is not None else ""
-                            fail_msg = "Expected: {expected}\nActual: {actual}".format(
-                                expected=expected, actual=actual
-                            )
-                            failures.append(
-                                (
-                                    file_name,
-                                    line_num,
-                                    fail_msg,
-                                )
-                            )
-                    # These two tags contain the same attributes and can be treated the same
-                    test_exception = test_case.findall(".//Exception")
-                    test_failure = test_case.findall(".//Failure")
-                    for exception in test_exception + test_failure:
-                        file_name = exception.attrib["filename"]
-                        line_num = int(exception.attrib["line"])
-
-                        fail_msg = f"Error: {exception.text}"
+        for test_case, ancestors in iterparse_elements(
+            xml_file, {"TestCase"}, prune=_is_passed_expression
+        ):
+            if ancestors[-1].tag != test_suite_tag:
+                continue
+            test_name = test_case.attrib["name"]
+            test_result = test_case.find("OverallResult")
+            failures = []
+            if test_result is not None and test_result.attrib["success"] == "false":
+                test_checks = test_case.findall(".//Expression")
+                for check in test_checks:
+                    file_name = check.attrib["filename"]
+                    line_num = int(check.attrib["line"])
+                    if check is not None and check.attrib["success"] == "false":
+                        item = check.find("Original")
+                        expected = item.text if item is not None else ""
+                        item = check.find("Expanded")
+                        actual = item.text if item is not None else ""
+                        fail_msg = "Expected: {expected}\nActual: {actual}".format(
+                            expected=expected, actual=actual
+                        )
                         failures.append(
                             (
                                 file_name,
@@ -212,12 +408,142 @@ class Catch2Facade(AbstractFacade):
                                 fail_msg,
                             )
                         )
-                skipped = False  # TODO: skipped tests don't appear in the results
-                result.append((test_name, failures, skipped))
+                # These two tags contain the same attributes and can be treated the same
+                test_exception = test_case.findall(".//Exception")
+                test_failure = test_case.findall(".//Failure")
+                for exception in test_exception + test_failure:
+                    file_name = exception.attrib["filename"]
+                    line_num = int(exception.attrib["line"])
+
+                    fail_msg = f"Error: {exception.text}"
+                    failures.append(
+                        (
+                            file_name,
+                            line_num,
+                            fail_msg,
+                        )
+                    )
+            skipped = False  # TODO: skipped tests don't appear in the results
+            # output of the test captured by Catch2
+            output = "".join(
+                x.text or ""
+                for x in test_case.findall("OverallResult/*")
+                if x.tag in ("StdOut", "StdErr")
+            )
+            duration = (
+                parse_duration(test_result.attrib.get("durationInSeconds"))
+                if test_result is not None
+                else None
+            )
+            benchmarks = parse_benchmarks(test_case)
+            result.append((test_name, failures, skipped, output, duration, benchmarks))
 
         return result
 
 
+def parse_benchmarks(test_case: ElementTree.Element) -> Benchmarks:
+    """
+    Return the statistics of the ``BENCHMARK`` blocks run by the given <TestCase> element
+    (in any of its sections), in nanoseconds, along with the number of samples and of
+    iterations per sample of each benchmark.
+    """
+    benchmarks: Benchmarks = {}
+    for element in test_case.iter("BenchmarkResults"):
+        stats: dict[str, float] = {}
+        for name in ("samples", "iterations"):
+            if name in element.attrib:
+                stats[name] = float(element.attrib[name])
+        for name, tag, attribute in _BENCHMARK_STATS:
+            child = element.find(tag)
+            if child is not None and attribute in child.attrib:
+                stats[name] = float(child.attrib[attribute])
+        benchmarks[element.attrib.get("name", "")] = stats
+    return benchmarks
+
+
+def load_benchmark_baseline(path: str) -> dict[str, Benchmarks]:
+    """
+    Return the benchmarks of each test case found in an XML report of Catch2 v2 or v3
+    ("--reporter xml"), for test cases which run any.
+    """
+    baseline = {}
+    for test_case, _ in iterparse_elements(
+        path, {"TestCase"}, prune=_is_passed_expression
+    ):
+        benchmarks = parse_benchmarks(test_case)
+        if benchmarks:
+            baseline[test_case.attrib["name"]] = benchmarks
+    return baseline
+
+
+def make_benchmark_properties(benchmarks: Benchmarks) -> list[tuple[str, object]]:
+    """
+    Return the properties attached to the report of a test case for its benchmarks, named
+    like "benchmark[name].mean".
+    """
+    return [
+        (f"benchmark[{name}].{stat}", value)
+        for name, stats in benchmarks.items()
+        for stat, value in stats.items()
+    ]
+
+
+def check_benchmark_regression(
+    name: str,
+    stats: dict[str, float],
+    baseline_stats: dict[str, float] | None,
+    threshold: float,
+) -> str | None:
+    """
+    Return a message if the mean of the given benchmark is larger than in the baseline by
+    more than the given fraction, or None otherwise.
+    """
+    if baseline_stats is None or "mean" not in stats or "mean" not in baseline_stats:
+        return None
+    value = stats["mean"]
+    baseline_value = baseline_stats["mean"]
+    if baseline_value <= 0 or value <= baseline_value * (1 + threshold):
+        return None
+    return (
+        "benchmark {name} is {increase:.1%} slower than the baseline "
+        "(mean: {value:.4g} ns, baseline: {baseline:.4g} ns), "
+        "above the threshold of {threshold:.1%}"
+    ).format(
+        name=name,
+        increase=value / baseline_value - 1,
+        value=value,
+        baseline=baseline_value,
+        threshold=threshold,
+    )
+
+
+def _is_passed_expression(elem: ElementTree.Element) -> bool:
+    # passed expressions are reported with "--success", but are not needed
+    return elem.tag == "Expression" and elem.attrib.get("success") == "true"
+
+
+class _ReportError(Exception):
+    """The executable did not produce a valid report."""
+
+    def __init__(self, message: str, output: str) -> None:
+        super().__init__(message)
+        self.output = output
+
+    def get_failure(self, executable: str, test_ids: Sequence[str]) -> CppTestFailure:
+        msg = (
+            "Internal Error: calling {executable} for {test_ids} "
+            "did not produce a valid report ({error}):\n{output}"
+        )
+        return CppMessageFailure(
+            msg.format(
+                executable=executable,
+                test_ids=describe_tests(test_ids),
+                error=self.args[0],
+                output=self.output,
+            )
+        )
+
+
 class Catch2Failure(CppTestFailure):
     def __init__(self, filename: str, linenum: int, lines: str):
         self.lines = lines.splitlines()
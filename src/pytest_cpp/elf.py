@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import mmap
+import struct
+from typing import BinaryIO
+from typing import Iterable
+from typing import NamedTuple
+
+ELF_MAGIC = b"\x7fELF"
+
+_ELFCLASS64 = 2
+_ELFDATA2MSB = 2
+_SHT_NOTE = 7
+_NT_GNU_BUILD_ID = 3
+
+
+class ElfSection(NamedTuple):
+    name: str
+    type: int
+    offset: int
+    size: int
+
+
+def read_sections(f: BinaryIO) -> list[ElfSection] | None:
+    """
+    Return the sections of the given ELF file, or None if it is not a (supported) ELF file.
+    """
+    ident = f.read(16)
+    if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+        return None
+    is_64 = ident[4] == _ELFCLASS64
+    endian = ">" if ident[5] == _ELFDATA2MSB else "<"
+
+    if is_64:
+        header_format = endian + "HHIQQQIHHHHHH"
+        section_format = endian + "IIQQQQIIQQ"
+    else:
+        header_format = endian + "HHIIIIIHHHHHH"
+        section_format = endian + "IIIIIIIIII"
+    header = f.read(struct.calcsize(header_format))
+    if len(header) < struct.calcsize(header_format):
+        return None
+    fields = struct.unpack(header_format, header)
+    shoff, shentsize, shnum, shstrndx = fields[5], fields[10], fields[11], fields[12]
+    if shoff == 0 or shnum == 0 or shstrndx >= shnum:
+        return None
+
+    f.seek(shoff)
+    data = f.read(shentsize * shnum)
+    if len(data) < shentsize * shnum:
+        return None
+    raw_sections = []
+    for index in range(shnum):
+        entry = data[index * shentsize : index * shentsize + shentsize]
+        name, type_, _, _, offset, size, *_ = struct.unpack(
+            section_format, entry[: struct.calcsize(section_format)]
+        )
+        raw_sections.append((name, type_, offset, size))
+
+    _, _, names_offset, names_size = raw_sections[shstrndx]
+    f.seek(names_offset)
+    names = f.read(names_size)
+
+    sections = []
+    for name, type_, offset, size in raw_sections:
+        end = names.find(b"\0", name)
+        section_name = names[name : end if end != -1 else None]
+        sections.append(
+            ElfSection(section_name.decode("ascii", "replace"), type_, offset, size)
+        )
+    return sections
+
+
+def read_build_id(path: str) -> str | None:
+    """
+    Return the GNU build-id of the given executable as an hex string, or None if
+    the file is not an ELF file or has no build-id.
+    """
+    try:
+        with open(path, "rb") as f:
+            sections = read_sections(f)
+            if sections is None:
+                return None
+            f.seek(0)
+            endian = ">" if f.read(6)[5] == _ELFDATA2MSB else "<"
+            for section in sections:
+                if section.type != _SHT_NOTE:
+                    continue
+                f.seek(section.offset)
+                notes = f.read(section.size)
+                build_id = _find_build_id(notes, endian)
+                if build_id is not None:
+                    return build_id
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+def find_markers(
+    path: str,
+    markers: Iterable[bytes],
+    section_names: Iterable[str] = (".rodata", ".dynstr"),
+) -> set[bytes] | None:
+    """
+    Return which of the given markers are found in the given sections of an executable,
+    without executing it, or None if the file is not an ELF file.
+
+    The default sections contain the string literals and the names of the dynamic symbols
+    and libraries used by the executable.
+    """
+    try:
+        with open(path, "rb") as f:
+            sections = read_sections(f)
+            if sections is None:
+                return None
+            ranges = [
+                (x.offset, x.offset + x.size)
+                for x in sections
+                if x.name in set(section_names)
+            ]
+            if not ranges:
+                return set()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return {
+                    marker
+                    for marker in markers
+                    if any(data.find(marker, start, end) != -1 for start, end in ranges)
+                }
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _find_build_id(notes: bytes, endian: str) -> str | None:
+    def align(x: int) -> int:
+        return (x + 3) & ~3
+
+    pos = 0
+    while pos + 12 <= len(notes):
+        namesz, descsz, type_ = struct.unpack_from(endian + "III", notes, pos)
+        pos += 12
+        name = notes[pos : pos + namesz].rstrip(b"\0")
+        pos += align(namesz)
+        desc = notes[pos : pos + descsz]
+        pos += align(descsz)
+        if name == b"GNU" and type_ == _NT_GNU_BUILD_ID:
+            return desc.hex()
+    return None
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
+import functools
+import itertools
 import os
+import stat
 import string
 from abc import ABC
 from abc import abstractmethod
+from array import array
 from typing import Sequence
 from typing import Tuple
 
 from _pytest._code.code import ReprFileLocation
 from _pytest._io import TerminalWriter
 
+from pytest_cpp.overhead import timed
+
+# Number of source files whose line offsets are kept by ``get_code_context_around_line``.
+_MAX_INDEXED_FILES = 128
+
 
 class CppFailureError(Exception):
     """
@@ -49,6 +58,23 @@ class CppTestFailure(ABC):
         """
 
 
+class CppMessageFailure(CppTestFailure):
+    """
+    A failure which is not related to a location in the C++ sources, like
+    internal errors detected by the plugin itself.
+    """
+
+    def __init__(self, contents: str) -> None:
+        self.lines = contents.splitlines()
+
+    def get_lines(self) -> list[tuple[str, Markup]]:
+        m = ("red", "bold")
+        return [(x, m) for x in self.lines]
+
+    def get_file_reference(self) -> tuple[str, int]:
+        return "unknown file", 0
+
+
 class CppFailureRepr(object):
     """
     "repr" object for pytest that knows how to print a CppFailure instance
@@ -57,15 +83,24 @@ class CppFailureRepr(object):
 
     failure_sep = "---"
 
-    def __init__(self, failures: Sequence[CppTestFailure]) -> None:
+    def __init__(
+        self,
+        failures: Sequence[CppTestFailure],
+        executable: str | None = None,
+        test_id: str | None = None,
+    ) -> None:
         self.failures = list(failures)
+        # the executable and test which failed, for --cpp-profile-overhead
+        self.executable = executable
+        self.test_id = test_id
 
     def __str__(self) -> str:
         reprs = []
-        for failure in self.failures:
-            pure_lines = "\n".join(x[0] for x in failure.get_lines())
-            repr_loc = self._get_repr_file_location(failure)
-            reprs.append("%s\n%s" % (pure_lines, repr_loc))
+        with timed("repr", self.executable, self.test_id):
+            for failure in self.failures:
+                pure_lines = "\n".join(x[0] for x in failure.get_lines())
+                repr_loc = self._get_repr_file_location(failure)
+                reprs.append("%s\n%s" % (pure_lines, repr_loc))
         return self.failure_sep.join(reprs)
 
     def _get_repr_file_location(self, failure: CppTestFailure) -> ReprFileLocation:
@@ -73,6 +108,10 @@ class CppFailureRepr(object):
         return ReprFileLocation(filename, linenum, "C++ failure")
 
     def toterminal(self, tw: TerminalWriter) -> None:
+        with timed("repr", self.executable, self.test_id):
+            self._toterminal(tw)
+
+    def _toterminal(self, tw: TerminalWriter) -> None:
         for index, failure in enumerate(self.failures):
             filename, linenum = failure.get_file_reference()
             code_lines = get_code_context_around_line(filename, linenum)
@@ -96,14 +135,47 @@ def get_code_context_around_line(filename: str, linenum: int) -> list[str]:
     """
     return code context lines, with the last line being the line at
     linenum.
+
+    Only the context lines are read, using the offsets of the lines of the file, which are
+    cached until the file changes (see ``_get_line_offsets``).
     """
-    if os.path.isfile(filename):
+    try:
+        st = os.stat(filename)
+    except (OSError, ValueError):
+        return []
+    if not stat.S_ISREG(st.st_mode):
+        return []
+    try:
+        offsets = _get_line_offsets(filename, st.st_mtime_ns, st.st_size)
         index = linenum - 1
-        with open(filename) as f:
-            index_above = index - 2
-            index_above = index_above if index_above >= 0 else 0
-            return [x.rstrip() for x in f.readlines()[index_above : index + 1]]
-    return []
+        start = max(index - 2, 0)
+        end = min(index + 1, len(offsets) - 1)
+        if start >= end:
+            return []
+        with open(filename, "rb") as f:
+            f.seek(offsets[start])
+            data = f.read(offsets[end] - offsets[start])
+    except OSError:
+        return []
+    return [
+        data[offsets[i] - offsets[start] : offsets[i + 1] - offsets[start]]
+        .decode("utf-8", errors="replace")
+        .rstrip()
+        for i in range(start, end)
+    ]
+
+
+@functools.lru_cache(maxsize=_MAX_INDEXED_FILES)
+def _get_line_offsets(filename: str, mtime_ns: int, size: int) -> array[int]:
+    """
+    Return the offset of the start of each line of the given file, followed by the size of
+    the file; the modification time and size are part of the key of the cache, so files
+    are indexed again when they change.
+    """
+    offsets = array("q", [0])
+    with open(filename, "rb") as f:
+        offsets.extend(itertools.accumulate(len(line) for line in f))
+    return offsets
 
 
 def get_left_whitespace(line: str) -> str:
@@ -5,25 +5,105 @@ from abc import abstractmethod
 from typing import Sequence
 
 from pytest_cpp.error import CppTestFailure
+from pytest_cpp.helpers import get_help_output
+
+
+class CppTestResult:
+    """
+    Outcome of a single test executed as part of a batch (see ``AbstractFacade.run_tests``).
+    """
+
+    def __init__(
+        self,
+        failures: Sequence[CppTestFailure] | None = None,
+        skipped: str | None = None,
+        output: str = "",
+        duration: float | None = None,
+        properties: Sequence[tuple[str, object]] = (),
+    ) -> None:
+        self.failures = failures
+        self.skipped = skipped
+        self.output = output
+        # duration of the test measured by the framework, in seconds
+        self.duration = duration
+        # (name, value) pairs attached to the report of the test as user properties
+        self.properties = properties
 
 
 class AbstractFacade(ABC):
+    #: True if the facade implements ``run_tests``, running several tests in a single
+    #: invocation of the executable.
+    supports_batch = False
+
+    #: True if ``run_tests`` supports running a batch of tests split in shards.
+    supports_shards = False
+
+    #: True if tests always run through ``run_tests``, even one test per invocation (with
+    #: ``cpp_batch_size = 1``), because ``run_tests`` gives results which ``run_test``
+    #: can't, like the ``properties`` of ``CppTestResult``.
+    batch_only = False
+
+    #: Strings which might be found in the read-only data or in the names of dynamic
+    #: symbols and libraries of executables which use this framework.
+    binary_markers: tuple[bytes, ...] = ()
+
+    #: True if executables should write their reports to pipes instead of files, when
+    #: possible (see ``helpers.ReportSinks``); set from the ``cpp_report_pipes`` option.
+    report_pipes = False
+
     @classmethod
-    @abstractmethod
     def is_test_suite(
         cls,
         executable: str,
         harness_collect: Sequence[str] = (),
     ) -> bool:
         """Return True if the given path to an executable contains tests for this framework."""
+        help_output = get_help_output(executable, harness_collect)
+        return help_output is not None and cls.from_help_output(help_output) is not None
+
+    @classmethod
+    @abstractmethod
+    def from_help_output(cls, help_output: str) -> AbstractFacade | None:
+        """
+        Return a facade instance if the output of ``executable --help`` shows that the executable
+        contains tests for this framework, or None otherwise.
+
+        This allows running ``--help`` only once per executable to detect its framework.
+        """
+
+    @classmethod
+    def from_binary_markers(cls, markers: set[bytes]) -> AbstractFacade | None:
+        """
+        Return a facade instance if the ``binary_markers`` found in an ELF executable, without
+        running it, are enough to tell that it contains tests for this framework, or None otherwise.
+        """
+        return None
+
+    @classmethod
+    def from_cache_state(cls, state: str | None) -> AbstractFacade:
+        """Return a facade instance from the value returned by ``get_cache_state``."""
+        return cls()
+
+    def get_cache_state(self) -> str | None:
+        """
+        Return the information obtained from ``--help`` by ``from_help_output``, which is
+        stored in the collection cache along with the facade class.
+        """
+        return None
 
     @abstractmethod
     def list_tests(
         self,
         executable: str,
         harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
     ) -> list[str]:
-        """Return a list of test ids found in the given executable."""
+        """
+        Return a list of test ids found in the given executable.
+
+        ``subprocess.TimeoutExpired`` is raised if the executable doesn't finish within
+        ``timeout`` seconds.
+        """
 
     @abstractmethod
     def run_test(
@@ -32,7 +112,8 @@ class AbstractFacade(ABC):
         test_id: str,
         test_args: Sequence[str] = (),
         harness: Sequence[str] = (),
-    ) -> tuple[Sequence[CppTestFailure] | None, str]:
+        timeout: float | None = None,
+    ) -> tuple[Sequence[CppTestFailure] | None, str, float | None]:
         """
         Runs a test and returns the results.
 
@@ -49,8 +130,50 @@ class AbstractFacade(ABC):
             If given, extra arguments which will be prepended to the command line, which
             usually wraps the executable for performance and/or memory profiling.
 
+        :param timeout:
+            If given, the executable (along with the harness) is killed if it doesn't
+            finish within this number of seconds, which is reported as a failure with the
+            output captured so far (see ``helpers.run_process``).
+
         :return:
             Return a tuple of:
             * list of failures, or None.
             * output from the executable call
+            * duration of the test measured by the framework, in seconds, or None if
+              not known.
+        """
+
+    def run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+        all_tests: bool = False,
+    ) -> tuple[dict[str, CppTestResult], str, CppTestFailure | None]:
+        """
+        Runs several tests in a single invocation of the executable.
+
+        Only called when ``supports_batch`` is True; parameters are the same as in
+        ``run_test``, except that ``test_ids`` is a list of test ids as returned by
+        ``list_tests``.
+
+        :param shard:
+            If given, a tuple of (shard index, total shards): the executable runs only
+            its share of the given tests, so several shards can run concurrently.
+            Only given when ``supports_shards`` is True.
+
+        :param all_tests:
+            True if ``test_ids`` are all the tests of the executable, which then doesn't
+            need to be told which tests to run.
+
+        :return:
+            Return a tuple of:
+            * dict mapping each test id to its ``CppTestResult``; tests which did not run
+              or could not be found in the results are left out.
+            * output from the executable call
+            * failure describing why the executable did not finish normally, or None.
         """
+        raise NotImplementedError(f"{type(self).__name__} does not support batches")
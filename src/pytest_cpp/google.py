@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import os
+import socket
 import subprocess
-import tempfile
+import threading
+import urllib.parse
+from typing import BinaryIO
 from typing import Sequence
 from xml.etree import ElementTree
 
@@ -11,7 +14,16 @@ import pytest
 from pytest_cpp.error import CppTestFailure
 from pytest_cpp.error import Markup
 from pytest_cpp.facade_abc import AbstractFacade
+from pytest_cpp.facade_abc import CppTestResult
+from pytest_cpp.helpers import can_use_report_pipes
+from pytest_cpp.helpers import describe_tests
+from pytest_cpp.helpers import get_timeout_message
+from pytest_cpp.helpers import iterparse_elements
 from pytest_cpp.helpers import make_cmdline
+from pytest_cpp.helpers import parse_duration
+from pytest_cpp.helpers import ReportSinks
+from pytest_cpp.helpers import run_process
+from pytest_cpp.helpers import split_filter
 
 
 class GoogleTestFacade(AbstractFacade):
@@ -19,28 +31,46 @@ class GoogleTestFacade(AbstractFacade):
     Facade for GoogleTests.
     """
 
+    supports_batch = True
+    supports_shards = True
+    binary_markers = (
+        b"--gtest_list_tests",
+        b"--gtest_stream_result_to",
+        b"libgtest",
+        b"_ZN7testing",
+    )
+
+    def __init__(self, stream_results: bool = False) -> None:
+        # if the executable supports "--gtest_stream_result_to", which is used
+        # to know the results of the tests which finished before a batch crashed
+        self.stream_results = stream_results
+
     @classmethod
-    def is_test_suite(
-        cls,
-        executable: str,
-        harness_collect: Sequence[str] = (),
-    ) -> bool:
-        args = make_cmdline(harness_collect, executable, ["--help"])
-        try:
-            output = subprocess.check_output(
-                args,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-            )
-        except (subprocess.CalledProcessError, OSError):
-            return False
-        else:
-            return "--gtest_list_tests" in output
+    def from_help_output(cls, help_output: str) -> GoogleTestFacade | None:
+        if "--gtest_list_tests" in help_output:
+            return cls(stream_results="--gtest_stream_result_to" in help_output)
+        return None
+
+    @classmethod
+    def from_cache_state(cls, state: str | None) -> GoogleTestFacade:
+        return cls(stream_results=state == "stream")
+
+    def get_cache_state(self) -> str | None:
+        return "stream" if self.stream_results else None
+
+    @classmethod
+    def from_binary_markers(cls, markers: set[bytes]) -> GoogleTestFacade | None:
+        if b"--gtest_list_tests" in markers or b"libgtest" in markers:
+            # the help of the flags is only found when linked statically, otherwise
+            # results are not streamed
+            return cls(stream_results=b"--gtest_stream_result_to" in markers)
+        return None
 
     def list_tests(
         self,
         executable: str,
         harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
     ) -> list[str]:
         """
         Executes google-test with "--gtest_list_tests" and gets list of tests
@@ -52,11 +82,7 @@ class GoogleTestFacade(AbstractFacade):
           CanGetNextPrime
         """
         args = make_cmdline(harness_collect, executable, ["--gtest_list_tests"])
-        output = subprocess.check_output(
-            args,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        )
+        output = run_process(args, timeout=timeout, check=True).stdout
 
         def strip_comment(x: str) -> str:
             comment_start = x.find("#")
@@ -81,94 +107,366 @@ class GoogleTestFacade(AbstractFacade):
         test_id: str,
         test_args: Sequence[str] = (),
         harness: Sequence[str] = (),
-    ) -> tuple[list[GoogleTestFailure] | None, str]:
-        with tempfile.TemporaryDirectory(prefix="pytest-cpp") as temp_dir:
-            # On Windows, ValueError is raised when path and start are on different drives.
-            # In this case failing back to the absolute path.
-            try:
-                xml_filename = os.path.join(os.path.relpath(temp_dir), "cpp-report.xml")
-            except ValueError:
-                xml_filename = os.path.join(temp_dir, "cpp-report.xml")
+        timeout: float | None = None,
+    ) -> tuple[list[GoogleTestFailure] | None, str, float | None]:
+        results, output, error = self._run_and_parse(
+            executable, [test_id], test_args, harness, timeout=timeout
+        )
+        if error is not None:
+            return [error], output, None
+
+        for executed_test_id, failures, skipped, duration in results:
+            if executed_test_id == test_id:
+                if failures:
+                    return [GoogleTestFailure(x) for x in failures], output, duration
+                elif skipped:
+                    pytest.skip("\n".join(skipped))
+                else:
+                    return None, output, duration
+
+        msg = "Internal Error: could not find test " "{test_id} in results:\n{results}"
+        results_list = "\n".join(x for (x, f, s, d) in results)
+        failure = GoogleTestFailure(msg.format(test_id=test_id, results=results_list))
+        return [failure], output, None
+
+    def run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+        all_tests: bool = False,
+    ) -> tuple[dict[str, CppTestResult], str, GoogleTestFailure | None]:
+        # the tests are selected with a single argument, which can't be too long
+        groups = [test_ids] if all_tests else split_filter(test_ids, ":")
+        selected = set(test_ids)
+        test_results = {}
+        outputs = []
+        error = None
+        for group in groups:
+            results, output, group_error = self._run_and_parse(
+                executable,
+                group,
+                test_args,
+                harness,
+                shard,
+                self.stream_results,
+                timeout,
+                select=not all_tests,
+            )
+            test_outputs = split_output(output)
+            for executed_test_id, failures, skipped, duration in results:
+                if executed_test_id not in selected:
+                    continue
+                test_results[executed_test_id] = CppTestResult(
+                    [GoogleTestFailure(x) for x in failures] if failures else None,
+                    "\n".join(skipped) if skipped and not failures else None,
+                    test_outputs.get(executed_test_id, ""),
+                    duration,
+                )
+            outputs.append(output)
+            error = error or group_error
+        return test_results, "".join(outputs), error
+
+    def _run_and_parse(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str],
+        harness: Sequence[str],
+        shard: tuple[int, int] | None = None,
+        stream_results: bool = False,
+        timeout: float | None = None,
+        select: bool = True,
+    ) -> tuple[
+        Sequence[tuple[str, Sequence[str], Sequence[str], float | None]],
+        str,
+        GoogleTestFailure | None,
+    ]:
+        """
+        Runs the given tests in a single invocation of the executable, returning
+        the parsed results, the output, and an internal error failure, if the
+        executable did not finish normally.
+
+        If ``select`` is False, the executable runs all its tests, which must be the
+        given ones.
+
+        If ``stream_results`` is True, the results are also streamed while the tests
+        run, so the results of the tests which finished are returned even if the
+        executable crashes or is killed after ``timeout`` seconds.
+        """
+        env = None
+        if shard is not None:
+            shard_index, total_shards = shard
+            env = dict(
+                os.environ,
+                GTEST_SHARD_INDEX=str(shard_index),
+                GTEST_TOTAL_SHARDS=str(total_shards),
+            )
+        use_pipes = self.report_pipes and can_use_report_pipes(harness)
+        with ReportSinks(use_pipes) as sinks:
+            xml_sink = sinks.add("cpp-report.xml", self._parse_xml)
             args = list(
                 make_cmdline(
-                    harness,
-                    executable,
-                    [f"--gtest_filter={test_id}", f"--gtest_output=xml:{xml_filename}"],
+                    harness, executable, [f"--gtest_output=xml:{xml_sink.path}"]
                 )
             )
+            if select:
+                args.append(f"--gtest_filter={':'.join(test_ids)}")
             args.extend(test_args)
 
+            stream = None
+            if stream_results:
+                try:
+                    stream = GoogleTestResultStream()
+                except OSError:
+                    # local connections might not be allowed, the XML report
+                    # is enough when the executable does not crash
+                    pass
+                else:
+                    args.append(f"--gtest_stream_result_to={stream.address}")
+
+            msg = None
             try:
-                output = subprocess.check_output(
-                    args, stderr=subprocess.STDOUT, universal_newlines=True
+                process = run_process(
+                    args,
+                    timeout=timeout,
+                    env=env,
+                    pass_fds=sinks.pass_fds,
                 )
-            except subprocess.CalledProcessError as e:
-                output = e.output
-                if e.returncode != 1:
+            except subprocess.TimeoutExpired as e:
+                output = e.output or ""
+                msg = get_timeout_message(executable, test_ids, e)
+            else:
+                output = process.stdout
+                if process.returncode not in (0, 1):
                     msg = (
                         "Internal Error: calling {executable} "
-                        "for test {test_id} failed (returncode={returncode}):\n"
+                        "for {test_ids} failed (returncode={returncode}):\n"
                         "{output}"
+                    ).format(
+                        executable=executable,
+                        test_ids=describe_tests(test_ids),
+                        output=output,
+                        returncode=process.returncode,
                     )
-                    failure = GoogleTestFailure(
-                        msg.format(
-                            executable=executable,
-                            test_id=test_id,
-                            output=e.output,
-                            returncode=e.returncode,
-                        )
-                    )
+            finally:
+                sinks.close()
+                if stream is not None:
+                    stream.close()
 
-                    return [failure], output
+            if msg is None:
+                try:
+                    return xml_sink.get_result(), output, None
+                except (OSError, ElementTree.ParseError) as e:
+                    msg = (
+                        "Internal Error: calling {executable} for {test_ids} "
+                        "did not produce a valid report ({error}):\n{output}"
+                    ).format(
+                        executable=executable,
+                        test_ids=describe_tests(test_ids),
+                        error=e,
+                        output=output,
+                    )
 
-            results = self._parse_xml(xml_filename)
-
-        for executed_test_id, failures, skipped in results:
-            if executed_test_id == test_id:
-                if failures:
-                    return [GoogleTestFailure(x) for x in failures], output
-                elif skipped:
-                    pytest.skip("\n".join(skipped))
-                else:
-                    return None, output
-
-        msg = "Internal Error: could not find test " "{test_id} in results:\n{results}"
-        results_list = "\n".join(x for (x, f, s) in results)
-        failure = GoogleTestFailure(msg.format(test_id=test_id, results=results_list))
-        return [failure], output
+            results = stream.get_results(output, msg) if stream is not None else []
+            return results, output, GoogleTestFailure(msg)
 
     def _parse_xml(
-        self, xml_filename: str
-    ) -> Sequence[tuple[str, Sequence[str], Sequence[str]]]:
-        root = ElementTree.parse(xml_filename)
+        self, xml_file: BinaryIO
+    ) -> Sequence[tuple[str, Sequence[str], Sequence[str], float | None]]:
         result = []
-        for test_suite in root.findall("testsuite"):
+        for test_case, ancestors in iterparse_elements(xml_file, {"testcase"}):
+            test_suite = ancestors[-1]
+            if test_suite.tag != "testsuite":
+                continue
             test_suite_name = test_suite.attrib["name"]
-            for test_case in test_suite.findall("testcase"):
-                test_name = test_case.attrib["name"]
-                failures = []
-                failure_elements = test_case.findall("failure")
-                for failure_elem in failure_elements:
-                    failures.append(failure_elem.text or "")
-                skippeds = []
-                if test_case.attrib.get("result", None) == "skipped":
-                    # In gtest 1.11 a skipped message was added to
-                    # the output file
-                    skipped_elements = test_case.findall("skipped")
-                    for skipped_elem in skipped_elements:
-                        skippeds.append(skipped_elem.text or "")
-                    # In gtest 1.10 the skipped message is not dump,
-                    # so if no skipped message was found just
-                    # append a "skipped" keyword
-                    if not skipped_elements:
-                        skippeds.append("Skipped")
-                elif test_case.attrib.get("status", None) == "notrun":
-                    skippeds.append("Disabled")
-                result.append((test_suite_name + "." + test_name, failures, skippeds))
+            test_name = test_case.attrib["name"]
+            failures = []
+            failure_elements = test_case.findall("failure")
+            for failure_elem in failure_elements:
+                failures.append(failure_elem.text or "")
+            skippeds = []
+            if test_case.attrib.get("result", None) == "skipped":
+                # In gtest 1.11 a skipped message was added to
+                # the output file
+                skipped_elements = test_case.findall("skipped")
+                for skipped_elem in skipped_elements:
+                    skippeds.append(skipped_elem.text or "")
+                # In gtest 1.10 the skipped message is not dump,
+                # so if no skipped message was found just
+                # append a "skipped" keyword
+                if not skipped_elements:
+                    skippeds.append("Skipped")
+            elif test_case.attrib.get("status", None) == "notrun":
+                skippeds.append("Disabled")
+            duration = parse_duration(test_case.attrib.get("time"))
+            result.append(
+                (test_suite_name + "." + test_name, failures, skippeds, duration)
+            )
 
         return result
 
 
+class GoogleTestResultStream:
+    """
+    Receives the events of a google-test run while the tests run, through a local
+    connection given to the executable with "--gtest_stream_result_to", so the results
+    of the tests which finished are known even if the executable crashes later.
+
+    Each event is a line of url-encoded fields, like these:
+
+    event=TestStart&name=test_failure
+    event=TestPartResult&file=gtest.cpp&line=19&message=Expected equality...
+    event=TestEnd&passed=0&elapsed_time=12ms
+    """
+
+    def __init__(self) -> None:
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._server.bind(("127.0.0.1", 0))
+            self._server.listen(1)
+        except OSError:
+            self._server.close()
+            raise
+        self._server.settimeout(0.1)
+        self.address = "127.0.0.1:{}".format(self._server.getsockname()[1])
+        # test id -> (passed, failures, duration) of the tests which finished
+        self.finished: dict[str, tuple[bool, list[str], float | None]] = {}
+        # test id and failures of the test running when the stream ended
+        self.running: str | None = None
+        self.running_failures: list[str] = []
+        self._test_suite = ""
+        self._closing = threading.Event()
+        self._thread = threading.Thread(
+            target=self._receive, name="pytest-cpp-gtest-stream", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """Wait until all the events sent by the executable, which exited, are received."""
+        self._closing.set()
+        self._thread.join()
+        self._server.close()
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                connection, _ = self._server.accept()
+                break
+            except socket.timeout:
+                if self._closing.is_set():
+                    return
+            except OSError:
+                return
+        with connection:
+            connection.settimeout(0.1)
+            pending = b""
+            while True:
+                try:
+                    data = connection.recv(65536)
+                except socket.timeout:
+                    # the connection might be kept open by a child process
+                    if self._closing.is_set():
+                        break
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b"\n")
+                for line in lines:
+                    self._handle_event(line.decode("utf-8", "replace"))
+
+    def _handle_event(self, line: str) -> None:
+        fields = {}
+        for field in line.split("&"):
+            name, _, value = field.partition("=")
+            fields[name] = urllib.parse.unquote(value)
+        event = fields.get("event")
+        if event == "TestCaseStart":
+            self._test_suite = fields.get("name", "")
+        elif event == "TestStart":
+            self.running = self._test_suite + "." + fields.get("name", "")
+            self.running_failures = []
+        elif event == "TestPartResult":
+            filename = fields.get("file")
+            location = (
+                f"{filename}:{fields.get('line')}" if filename else "unknown file"
+            )
+            self.running_failures.append(location + "\n" + fields.get("message", ""))
+        elif event == "TestEnd" and self.running is not None:
+            elapsed_time = fields.get("elapsed_time", "")
+            self.finished[self.running] = (
+                fields.get("passed") == "1",
+                self.running_failures,
+                (
+                    parse_duration(elapsed_time[:-2], scale=0.001)
+                    if elapsed_time.endswith("ms")
+                    else None
+                ),
+            )
+            self.running = None
+            self.running_failures = []
+
+    def get_results(
+        self, output: str, error: str
+    ) -> list[tuple[str, Sequence[str], Sequence[str], float | None]]:
+        """
+        Return the results received, in the same format as ``_parse_xml``, where
+        the given error is added to the failures of the test which did not finish.
+
+        The events don't tell skipped tests from failed ones, so the console output is used
+        for that.
+        """
+        outputs = split_output(output)
+        results: list[tuple[str, Sequence[str], Sequence[str], float | None]] = []
+        for test_id, (passed, failures, duration) in self.finished.items():
+            test_output = outputs.get(test_id, "").rstrip().splitlines()
+            if passed:
+                results.append((test_id, [], [], duration))
+            elif test_output and test_output[-1].startswith("[  SKIPPED ] "):
+                results.append((test_id, [], failures or ["Skipped"], duration))
+            else:
+                results.append((test_id, failures, [], duration))
+        if self.running is not None:
+            results.append((self.running, [*self.running_failures, error], [], None))
+        return results
+
+
+_RUN_MARKER = "[ RUN      ] "
+_END_MARKERS = ("[       OK ] ", "[  FAILED  ] ", "[  SKIPPED ] ")
+
+
+def split_output(output: str) -> dict[str, str]:
+    """
+    Splits the console output of a google-test run into the output of each test,
+    delimited by lines like these:
+
+    [ RUN      ] FooTest.test_success
+    [       OK ] FooTest.test_success (0 ms)
+    """
+    result = {}
+    test_id: str | None = None
+    lines: list[str] = []
+    for line in output.splitlines(keepends=True):
+        if line.startswith(_RUN_MARKER):
+            test_id = line[len(_RUN_MARKER) :].strip()
+            lines = [line]
+        elif test_id is not None:
+            lines.append(line)
+            for marker in _END_MARKERS:
+                if line.startswith(marker) and line[len(marker) :].split()[:1] == [
+                    test_id
+                ]:
+                    result[test_id] = "".join(lines)
+                    test_id = None
+                    break
+    return result
+
+
 class GoogleTestFailure(CppTestFailure):
     def __init__(self, contents: str) -> None:
         self.lines = contents.splitlines()
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import json
+import subprocess
+from typing import Any
+from typing import BinaryIO
+from typing import Sequence
+
+import pytest
+
+from pytest_cpp.error import CppMessageFailure
+from pytest_cpp.error import CppTestFailure
+from pytest_cpp.facade_abc import AbstractFacade
+from pytest_cpp.facade_abc import CppTestResult
+from pytest_cpp.helpers import can_use_report_pipes
+from pytest_cpp.helpers import describe_tests
+from pytest_cpp.helpers import get_timeout_message
+from pytest_cpp.helpers import make_cmdline
+from pytest_cpp.helpers import ReportSinks
+from pytest_cpp.helpers import run_process
+
+# Seconds in each "time_unit" of the results.
+_TIME_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0}
+
+# Metrics which can be compared with the baseline.
+METRICS = ("real_time", "cpu_time")
+
+# Fields of the results which are not counters, see ``make_properties``.
+_NON_COUNTER_FIELDS = {
+    "name",
+    "family_index",
+    "per_family_instance_index",
+    "run_name",
+    "run_type",
+    "repetitions",
+    "repetition_index",
+    "threads",
+    "aggregate_name",
+    "aggregate_unit",
+    "error_occurred",
+    "error_message",
+    "skipped",
+    "skip_message",
+    "label",
+    "iterations",
+    "real_time",
+    "cpu_time",
+    "time_unit",
+}
+
+# Characters with a special meaning in the regular expressions of "--benchmark_filter".
+_special_chars_map: dict[int, str] = {i: "\\" + chr(i) for i in b"\\^$.|?*+()[]{}"}
+
+
+class GoogleBenchmarkFacade(AbstractFacade):
+    """
+    Facade for Google Benchmark, where each benchmark is a test which fails if it reports
+    an error, or if it is slower than in the ``baseline``.
+
+    The results of each benchmark (times, iterations and counters) are given in the
+    ``properties`` of its ``CppTestResult``, so benchmarks always run through ``run_tests``.
+    """
+
+    supports_batch = True
+    batch_only = True
+    binary_markers = (b"--benchmark_list_tests", b"libbenchmark")
+
+    def __init__(self) -> None:
+        #: results of a previous run, by benchmark name (see ``load_baseline``)
+        self.baseline: dict[str, dict[str, Any]] | None = None
+        #: benchmarks fail when ``metric`` is larger than in the baseline by more than
+        #: this fraction
+        self.threshold = 0.1
+        #: result compared with the baseline, one of ``METRICS``
+        self.metric = "real_time"
+
+    @classmethod
+    def from_help_output(cls, help_output: str) -> GoogleBenchmarkFacade | None:
+        if "--benchmark_list_tests" in help_output:
+            return cls()
+        return None
+
+    @classmethod
+    def from_binary_markers(cls, markers: set[bytes]) -> GoogleBenchmarkFacade | None:
+        if b"--benchmark_list_tests" in markers or b"libbenchmark" in markers:
+            return cls()
+        return None
+
+    def list_tests(
+        self,
+        executable: str,
+        harness_collect: Sequence[str] = (),
+        timeout: float | None = None,
+    ) -> list[str]:
+        """
+        Executes the benchmarks with "--benchmark_list_tests=true", which lists the name
+        of each benchmark in its own line:
+
+        BM_memcpy/8
+        BM_memcpy/64
+        """
+        args = make_cmdline(
+            harness_collect, executable, ["--benchmark_list_tests=true"]
+        )
+        output = run_process(args, timeout=timeout, check=True).stdout
+        return [x.strip() for x in output.splitlines() if x.strip()]
+
+    def run_test(
+        self,
+        executable: str,
+        test_id: str,
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        timeout: float | None = None,
+    ) -> tuple[Sequence[CppTestFailure] | None, str, float | None]:
+        results, output, error = self.run_tests(
+            executable, [test_id], test_args, harness, timeout=timeout
+        )
+        if error is not None:
+            return [error], output, None
+        result = results.get(test_id)
+        if result is None:
+            msg = "Internal Error: could not find test {test_id} in results:\n{results}"
+            failure = CppMessageFailure(
+                msg.format(test_id=test_id, results="\n".join(results))
+            )
+            return [failure], output, None
+        if result.skipped is not None and not result.failures:
+            pytest.skip(result.skipped)
+        return result.failures, output, result.duration
+
+    def run_tests(
+        self,
+        executable: str,
+        test_ids: Sequence[str],
+        test_args: Sequence[str] = (),
+        harness: Sequence[str] = (),
+        shard: tuple[int, int] | None = None,
+        timeout: float | None = None,
+        all_tests: bool = False,
+    ) -> tuple[dict[str, CppTestResult], str, CppTestFailure | None]:
+        """
+        Runs the given benchmarks in a single invocation of the executable, selected with
+        "--benchmark_filter", reading their results from a JSON report.
+
+        The console output can't be split by benchmark, so the output of the whole
+        invocation is given to the failed benchmarks only.
+        """
+        use_pipes = self.report_pipes and can_use_report_pipes(harness)
+        with ReportSinks(use_pipes) as sinks:
+            json_sink = sinks.add("benchmark.json", parse_results)
+            args = list(
+                make_cmdline(
+                    harness,
+                    executable,
+                    [
+                        f"--benchmark_filter={make_filter(test_ids)}",
+                        f"--benchmark_out={json_sink.path}",
+                        "--benchmark_out_format=json",
+                    ],
+                )
+            )
+            args.extend(test_args)
+            try:
+                process = run_process(args, timeout=timeout, pass_fds=sinks.pass_fds)
+            except subprocess.TimeoutExpired as e:
+                failure = CppMessageFailure(
+                    get_timeout_message(executable, test_ids, e)
+                )
+                return {}, e.output or "", failure
+            finally:
+                sinks.close()
+
+            output = process.stdout
+            error = None
+            if process.returncode != 0:
+                error = "returncode={}".format(process.returncode)
+            try:
+                results = json_sink.get_result()
+            except (OSError, ValueError) as e:
+                results = {}
+                error = error or str(e)
+            if error is not None:
+                msg = (
+                    "Internal Error: calling {executable} for {test_ids} "
+                    "failed ({error}):\n{output}"
+                )
+                failure = CppMessageFailure(
+                    msg.format(
+                        executable=executable,
+                        test_ids=describe_tests(test_ids),
+                        error=error,
+                        output=output,
+                    )
+                )
+                return {}, output, failure
+
+        test_results = {}
+        for test_id in test_ids:
+            entry = results.get(test_id)
+            if entry is None:
+                continue
+            failures: list[CppTestFailure] = []
+            if entry.get("error_occurred"):
+                failures.append(
+                    CppMessageFailure(entry.get("error_message") or "Error")
+                )
+            elif self.baseline is not None and not entry.get("skipped"):
+                regression = check_regression(
+                    entry, self.baseline.get(test_id), self.metric, self.threshold
+                )
+                if regression is not None:
+                    failures.append(CppMessageFailure(regression))
+            skipped = (
+                entry.get("skip_message") or "Skipped"
+                if entry.get("skipped") and not failures
+                else None
+            )
+            test_results[test_id] = CppTestResult(
+                failures or None,
+                skipped,
+                output if failures else "",
+                get_duration(entry),
+                make_properties(entry),
+            )
+        return test_results, output, None
+
+
+def make_filter(test_ids: Sequence[str]) -> str:
+    """Return the regular expression for "--benchmark_filter" which selects the given tests."""
+    names = "|".join(x.translate(_special_chars_map) for x in test_ids)
+    return f"^({names})$"
+
+
+def parse_results(json_file: BinaryIO) -> dict[str, dict[str, Any]]:
+    """
+    Parse a JSON report of Google Benchmark, returning the results of each benchmark by name.
+
+    When benchmarks run several times ("--benchmark_repetitions"), the median of the runs is
+    used, otherwise the result of the single run.
+    """
+    results: dict[str, dict[str, Any]] = {}
+    for entry in json.load(json_file).get("benchmarks", []):
+        name = entry.get("run_name", entry["name"])
+        if entry.get("run_type") == "aggregate":
+            if entry.get("aggregate_name") == "median":
+                results[name] = entry
+        elif results.get(name, {}).get("run_type") != "aggregate":
+            results[name] = entry
+    return results
+
+
+def load_baseline(path: str) -> dict[str, dict[str, Any]]:
+    """Return the results of each benchmark found in a JSON report (see ``parse_results``)."""
+    with open(path, "rb") as f:
+        return parse_results(f)
+
+
+def get_time(entry: dict[str, Any], metric: str) -> float:
+    """Return the given time of a result in seconds."""
+    return float(entry[metric]) * _TIME_UNITS.get(entry.get("time_unit", "ns"), 1e-9)
+
+
+def get_duration(entry: dict[str, Any]) -> float | None:
+    """Return the time spent in the iterations of a single run, in seconds."""
+    if entry.get("run_type") == "aggregate" or "real_time" not in entry:
+        return None
+    return get_time(entry, "real_time") * int(entry.get("iterations", 1))
+
+
+def make_properties(entry: dict[str, Any]) -> list[tuple[str, object]]:
+    """
+    Return the properties attached to the report of a benchmark: "real_time", "cpu_time",
+    "time_unit", "iterations", the label and the counters.
+    """
+    properties: list[tuple[str, object]] = [
+        (name, entry[name])
+        for name in ("real_time", "cpu_time", "time_unit", "iterations", "label")
+        if name in entry
+    ]
+    properties.extend(
+        (name, value)
+        for name, value in entry.items()
+        if name not in _NON_COUNTER_FIELDS and isinstance(value, (int, float))
+    )
+    return properties
+
+
+def check_regression(
+    entry: dict[str, Any],
+    baseline_entry: dict[str, Any] | None,
+    metric: str,
+    threshold: float,
+) -> str | None:
+    """
+    Return a message if the given result is slower than the baseline by more than the
+    given fraction, comparing the given metric, or None otherwise.
+    """
+    if baseline_entry is None or metric not in entry or metric not in baseline_entry:
+        return None
+    value = get_time(entry, metric)
+    baseline_value = get_time(baseline_entry, metric)
+    if baseline_value <= 0 or value <= baseline_value * (1 + threshold):
+        return None
+    unit = entry.get("time_unit", "ns")
+    scale = _TIME_UNITS.get(unit, 1e-9)
+    return (
+        "{name} is {increase:.1%} slower than the baseline "
+        "({metric}: {value:.4g} {unit}, baseline: {baseline:.4g} {unit}), "
+        "above the threshold of {threshold:.1%}"
+    ).format(
+        name=entry.get("run_name", entry.get("name")),
+        increase=value / baseline_value - 1,
+        metric=metric,
+        value=value / scale,
+        baseline=baseline_value / scale,
+        unit=unit,
+        threshold=threshold,
+    )
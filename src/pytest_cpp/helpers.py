@@ -1,7 +1,582 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from types import TracebackType
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import cast
+from typing import Container
+from typing import Generic
+from typing import IO
+from typing import Iterator
+from typing import Mapping
 from typing import Sequence
+from typing import TypeVar
+from xml.etree import ElementTree
+
+from pytest_cpp.overhead import timed
+from pytest_cpp.resources import get_cpu_time_limit
+from pytest_cpp.resources import get_own_max_rss
+from pytest_cpp.resources import is_tracking_usage
+from pytest_cpp.resources import limit_cpu_time
+from pytest_cpp.resources import record_usage
+from pytest_cpp.resources import set_cpu_time_limit
+
+# Size of the chunks read from XML reports.
+_CHUNK_SIZE = 64 * 1024
+
+# Number of bytes kept from the end of reports written to pipes, for error messages.
+_PIPE_TAIL_SIZE = 64 * 1024
+
+# Longest argument selecting tests given to an executable, in bytes: well below the
+# limits of the length of each argument (128K on Linux) and of the whole command line
+# (32K characters on Windows).
+_MAX_FILTER_LENGTH = 8 * 1024
+
+# Tracker of the processes run by the current thread, if any (see ``ProcessTracker``).
+_process_tracker: contextvars.ContextVar[ProcessTracker | None] = (
+    contextvars.ContextVar("pytest_cpp_process_tracker", default=None)
+)
+
+T = TypeVar("T")
 
 
 def make_cmdline(
     harness: Sequence[str], executable: str, arg: Sequence[str] = ()
 ) -> Sequence[str]:
     return [*harness, executable, *arg]
+
+
+def split_filter(
+    items: Sequence[str], separator: str, max_length: int | None = None
+) -> list[list[str]]:
+    """
+    Split the given items in groups which, joined with ``separator``, are at most
+    ``max_length`` bytes long (``_MAX_FILTER_LENGTH`` by default), so each group can be
+    given to an executable in a single argument. Longer items are in groups of their own.
+    """
+    if max_length is None:
+        max_length = _MAX_FILTER_LENGTH
+    groups: list[list[str]] = []
+    length = 0
+    for item in items:
+        item_length = len(os.fsencode(item))
+        if groups and length + len(separator) + item_length <= max_length:
+            groups[-1].append(item)
+            length += len(separator) + item_length
+        else:
+            groups.append([item])
+            length = item_length
+    return groups
+
+
+def run_process(
+    args: Sequence[str],
+    timeout: float | None = None,
+    check: bool = False,
+    stderr: int = subprocess.STDOUT,
+    env: Mapping[str, str] | None = None,
+    pass_fds: Sequence[int] = (),
+) -> subprocess.CompletedProcess[str]:
+    """
+    Run the given command line (an executable, possibly wrapped by a harness) like
+    ``subprocess.run``, capturing its output as text; stderr is merged with the output
+    unless ``stderr`` is ``subprocess.PIPE``.
+
+    The process runs in its own process group, so if it doesn't finish within ``timeout``
+    seconds, the whole group is killed, including any processes started by a harness,
+    and ``subprocess.TimeoutExpired`` is raised with the output captured so far.
+
+    The peak RSS and CPU time of the process are recorded, and limited, as given to
+    ``resources.tracked_usage``.
+    """
+    # the peak RSS of the process is only known when above the one of this process
+    min_max_rss = get_own_max_rss() if is_tracking_usage() else None
+    cpu_time_limit = get_cpu_time_limit()
+    with timed("spawn"):
+        process = subprocess.Popen(
+            args if cpu_time_limit is None else limit_cpu_time(args, cpu_time_limit),
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            universal_newlines=True,
+            env=env,
+            pass_fds=pass_fds,
+            start_new_session=True,
+        )
+        if cpu_time_limit is not None:
+            set_cpu_time_limit(process.pid, cpu_time_limit)
+    tracker = _process_tracker.get()
+    if tracker is not None:
+        tracker.add(process)
+    try:
+        with timed("run"):
+            if hasattr(os, "wait4") and min_max_rss is not None:
+                output, errors, rusage = _communicate_and_wait4(process, args, timeout)
+                record_usage(rusage, min_max_rss)
+            else:
+                output, errors = _communicate(process, args, timeout)
+    finally:
+        if tracker is not None:
+            tracker.discard(process)
+    result = subprocess.CompletedProcess(
+        args, process.returncode, output or "", errors or ""
+    )
+    if check:
+        result.check_returncode()
+    return result
+
+
+def _communicate(
+    process: subprocess.Popen[str], args: Sequence[str], timeout: float | None
+) -> tuple[str, str | None]:
+    """
+    Return the output of the given process once it finished, killing its process group if
+    it doesn't finish within ``timeout`` seconds (or this is interrupted).
+    """
+    try:
+        return process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(process)
+        # no output is lost when communicating again
+        output, errors = process.communicate()
+        raise subprocess.TimeoutExpired(
+            args, cast(float, timeout), output=output, stderr=errors
+        ) from None
+    except BaseException:
+        _kill_process_group(process)
+        process.wait()
+        raise
+
+
+def _communicate_and_wait4(
+    process: subprocess.Popen[str], args: Sequence[str], timeout: float | None
+) -> tuple[str, str | None, Any]:
+    """
+    Like ``_communicate``, but reaping the process with ``os.wait4`` (which sets its
+    ``returncode``), to also return its resource usage, or None if it could not be
+    obtained.
+    """
+    outputs: list[str | None] = [None, None]
+    statuses: list[tuple[int, Any]] = []
+
+    def read(index: int, stream: IO[str]) -> None:
+        with stream:
+            outputs[index] = stream.read()
+
+    def reap() -> None:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except OSError:
+            # for example ECHILD, if the process was reaped elsewhere
+            return
+        statuses.append((status, rusage))
+
+    threads = [threading.Thread(target=reap, daemon=True)]
+    for index, stream in enumerate([process.stdout, process.stderr]):
+        if stream is not None:
+            threads.append(
+                threading.Thread(target=read, args=(index, stream), daemon=True)
+            )
+    for thread in threads:
+        thread.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    timed_out = False
+    try:
+        for thread in threads:
+            thread.join(None if deadline is None else deadline - time.monotonic())
+        timed_out = any(x.is_alive() for x in threads)
+    finally:
+        if any(x.is_alive() for x in threads):
+            _kill_process_group(process)
+            # no output is lost, as the pipes are read until they are closed
+            for thread in threads:
+                thread.join()
+        if statuses:
+            status = statuses[0][0]
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+        else:
+            # the usage is unknown, but the process must still be waited for
+            process.wait()
+    rusage = statuses[0][1] if statuses else None
+    if timed_out:
+        raise subprocess.TimeoutExpired(
+            args, cast(float, timeout), output=outputs[0], stderr=outputs[1]
+        )
+    return outputs[0] or "", outputs[1], rusage
+
+
+def _kill_process_group(process: subprocess.Popen[str]) -> None:
+    if os.name == "posix":
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # the process group is gone
+            pass
+    else:
+        process.kill()
+
+
+class ProcessTracker:
+    """
+    Keeps track of the processes run by ``run_process`` within ``tracking`` blocks, in any
+    thread, so they can be killed at once without waiting for them to finish (like when
+    pytest is interrupted), as they run in their own process groups and don't receive the
+    signals sent to pytest.
+
+    The processes of a tracker created within a ``tracking`` block are also tracked by the
+    tracker of the block.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._processes: set[subprocess.Popen[str]] = set()
+        self._killed = False
+        self._parent = _process_tracker.get()
+
+    @contextlib.contextmanager
+    def tracking(self) -> Iterator[None]:
+        """Track the processes run by the current thread within the block."""
+        token = _process_tracker.set(self)
+        try:
+            yield
+        finally:
+            _process_tracker.reset(token)
+
+    def add(self, process: subprocess.Popen[str]) -> None:
+        with self._lock:
+            killed = self._killed
+            if not killed:
+                self._processes.add(process)
+        if self._parent is not None:
+            self._parent.add(process)
+        if killed:
+            _kill_process_group(process)
+
+    def discard(self, process: subprocess.Popen[str]) -> None:
+        with self._lock:
+            self._processes.discard(process)
+        if self._parent is not None:
+            self._parent.discard(process)
+
+    def kill(self) -> None:
+        """Kill the process groups of the processes running, and of those started later."""
+        with self._lock:
+            self._killed = True
+            for process in self._processes:
+                _kill_process_group(process)
+
+
+def describe_tests(test_ids: Sequence[str]) -> str:
+    """
+    Return the id of the given test, or the number of tests when there are several, for
+    error messages (batches can have thousands of tests).
+    """
+    if len(test_ids) == 1:
+        return test_ids[0]
+    return f"{len(test_ids)} tests"
+
+
+def get_timeout_message(
+    executable: str, test_ids: Sequence[str], error: subprocess.TimeoutExpired
+) -> str:
+    """Return the message of the failure of tests which were killed after a timeout."""
+    return (
+        "Timeout: calling {executable} for {test_ids} did not finish within "
+        "{timeout} seconds and was killed, output so far:\n{output}"
+    ).format(
+        executable=executable,
+        test_ids=describe_tests(test_ids),
+        timeout=error.timeout,
+        output=error.output or "",
+    )
+
+
+def get_help_output(
+    executable: str, harness_collect: Sequence[str] = (), timeout: float | None = None
+) -> str | None:
+    """
+    Return the output of ``executable --help``, or None if the executable could not be run
+    or returned an error.
+
+    ``subprocess.TimeoutExpired`` is raised if it doesn't finish within ``timeout`` seconds.
+    """
+    args = make_cmdline(harness_collect, executable, ["--help"])
+    try:
+        return run_process(args, timeout=timeout, check=True).stdout
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def parse_duration(value: str | None, scale: float = 1.0) -> float | None:
+    """
+    Return the duration in seconds given by a report, in units of ``scale`` seconds, or
+    None if it is missing or not valid.
+    """
+    if not value:
+        return None
+    try:
+        return float(value) * scale
+    except ValueError:
+        return None
+
+
+def iterparse_elements(
+    source: str | BinaryIO,
+    tags: Container[str],
+    wrap: bool = False,
+    prune: Callable[[ElementTree.Element], bool] | None = None,
+) -> Iterator[tuple[ElementTree.Element, Sequence[ElementTree.Element]]]:
+    """
+    Parse the XML document in the given file (a path or a binary file object), yielding
+    each element with one of the given tags once it is complete, along with its ancestors
+    (which only have their attributes at that point).
+
+    Elements are discarded as soon as they are processed, so memory usage doesn't depend on
+    the size of the document:
+
+    * yielded elements are discarded once the consumer is done with them;
+    * elements outside of the yielded elements are discarded once complete;
+    * elements inside the yielded elements are discarded once complete if ``prune``
+      returns True for them.
+
+    If ``wrap`` is True, the document is wrapped by a root element, for documents with
+    several root elements (like the logs of Boost.Test).
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            yield from iterparse_elements(f, tags, wrap, prune)
+        return
+
+    parser: ElementTree.XMLPullParser[Any] = ElementTree.XMLPullParser(
+        events=("start", "end")
+    )
+    ancestors: list[ElementTree.Element] = []
+    # number of ancestors with one of the given tags
+    inside = 0
+
+    def process_events() -> (
+        Iterator[tuple[ElementTree.Element, Sequence[ElementTree.Element]]]
+    ):
+        nonlocal inside
+        # only "start" and "end" events are requested, which give elements
+        events = cast("Iterator[tuple[str, ElementTree.Element]]", parser.read_events())
+        for event, elem in events:
+            if event == "start":
+                ancestors.append(elem)
+                if elem.tag in tags:
+                    inside += 1
+                continue
+            ancestors.pop()
+            if elem.tag in tags:
+                inside -= 1
+            if inside:
+                if prune is None or not prune(elem):
+                    continue
+            elif elem.tag in tags:
+                yield elem, ancestors
+            if ancestors:
+                ancestors[-1].remove(elem)
+
+    if wrap:
+        parser.feed(b"<xml>")
+    while True:
+        chunk = source.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from process_events()
+    if wrap:
+        parser.feed(b"</xml>")
+    parser.close()
+    yield from process_events()
+
+
+def can_use_report_pipes(harness: Sequence[str]) -> bool:
+    """
+    Return True if reports can be written to pipes given to the executable as paths like
+    "/dev/fd/5", which requires the executable to run directly in this platform: a harness
+    (like an emulator or a remote runner) might not have access to the inherited pipes.
+    """
+    return not harness and os.name == "posix" and os.path.isdir("/dev/fd")
+
+
+class ReportSinks:
+    """
+    Context manager which creates the sinks where an executable writes its reports.
+
+    The sinks are files in a temporary directory, parsed after the executable exits, or
+    if ``use_pipes`` is True, pipes inherited by the executable (see ``pass_fds``), which
+    are parsed by a thread while the executable writes them, avoiding the round-trip
+    through the file system.
+    """
+
+    def __init__(self, use_pipes: bool) -> None:
+        self.use_pipes = use_pipes
+        self._temp_dir: str | None = None
+        self._exit_stack = contextlib.ExitStack()
+        self._pipes: list[ReportPipe[Any]] = []
+
+    def __enter__(self) -> ReportSinks:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+        for pipe in self._pipes:
+            pipe.wait()
+        self._exit_stack.close()
+
+    @property
+    def pass_fds(self) -> tuple[int, ...]:
+        """File descriptors which must be inherited by the executable."""
+        return tuple(x.write_fd for x in self._pipes if x.write_fd is not None)
+
+    def add(self, name: str, parse: Callable[[BinaryIO], T]) -> ReportSink[T]:
+        """
+        Return a new sink, where ``name`` is the name of its file, if any, and ``parse``
+        is called with the report as a binary file object.
+        """
+        if self.use_pipes:
+            pipe = ReportPipe(parse)
+            self._pipes.append(pipe)
+            return pipe
+        return ReportFile(os.path.join(self.get_temp_dir(), name), parse)
+
+    def get_temp_dir(self) -> str:
+        """
+        Return the path of a temporary directory, created on first use, which exists until
+        the context is left.
+        """
+        if self._temp_dir is None:
+            temp_dir = self._exit_stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="pytest-cpp")
+            )
+            # On Windows, ValueError is raised when path and start are on different
+            # drives. In this case failing back to the absolute path.
+            try:
+                self._temp_dir = os.path.relpath(temp_dir)
+            except ValueError:
+                self._temp_dir = temp_dir
+        return self._temp_dir
+
+    def close(self) -> None:
+        """
+        Close the write ends of the pipes, which must be done once the executable exited,
+        so the pipes are read until their end.
+        """
+        for pipe in self._pipes:
+            pipe.close()
+
+
+class ReportSink(Generic[T]):
+    """Where an executable writes a report to, see ``ReportSinks``."""
+
+    #: path of the report given to the executable.
+    path: str
+
+    def get_result(self) -> T:
+        """
+        Return the parsed report, raising the exception raised while parsing it (for example
+        ``OSError`` or ``ElementTree.ParseError`` if the executable didn't write it).
+        """
+        raise NotImplementedError
+
+    def get_text(self) -> str:
+        """Return the contents of the report (or its end), for error messages."""
+        raise NotImplementedError
+
+
+class ReportFile(ReportSink[T]):
+    def __init__(self, path: str, parse: Callable[[BinaryIO], T]) -> None:
+        self.path = path
+        self._parse = parse
+
+    def get_result(self) -> T:
+        with open(self.path, "rb") as f, timed("parse"):
+            return self._parse(f)
+
+    def get_text(self) -> str:
+        try:
+            with open(self.path, encoding="utf-8", errors="replace") as f:
+                return f.read()
+        except OSError:
+            return ""
+
+
+class ReportPipe(ReportSink[T]):
+    def __init__(self, parse: Callable[[BinaryIO], T]) -> None:
+        read_fd, write_fd = os.pipe()
+        self.write_fd: int | None = write_fd
+        self.path = f"/dev/fd/{write_fd}"
+        self._parse = parse
+        self._tail = b""
+        self._result: T | None = None
+        self._error: BaseException | None = None
+        # the context tells which executable the report belongs to (see ``overhead.timed``)
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._read, os.fdopen(read_fd, "rb", buffering=0)),
+            name="pytest-cpp-report-pipe",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def wait(self) -> None:
+        self.close()
+        self._thread.join()
+
+    def get_result(self) -> T:
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return cast(T, self._result)
+
+    def get_text(self) -> str:
+        self.wait()
+        return self._tail.decode("utf-8", "replace")
+
+    def _read(self, f: BinaryIO) -> None:
+        with f:
+            reader = _TailReader(f)
+            try:
+                with timed("parse"):
+                    self._result = self._parse(cast(BinaryIO, reader))
+            except Exception as e:
+                self._error = e
+            # the executable would block writing to a pipe which is not read
+            while reader.read(_CHUNK_SIZE):
+                pass
+            self._tail = reader.tail
+
+
+class _TailReader:
+    """Reads a file keeping the last bytes read."""
+
+    def __init__(self, f: BinaryIO) -> None:
+        self._f = f
+        self.tail = b""
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self.tail = (self.tail + data)[-_PIPE_TAIL_SIZE:]
+        return data
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any
+from typing import Iterator
+
+#: Phases timed with ``--cpp-profile-overhead``, along with their descriptions.
+PHASES = {
+    "probe": "detecting the framework of executables",
+    "list": "listing the tests of executables",
+    "spawn": "starting test executables",
+    "run": "waiting for test executables to finish",
+    "parse": "parsing reports",
+    "repr": "rendering failures",
+}
+
+# Executable and test id being worked on by the current thread, the test id being None
+# for batches of tests and during collection.
+_node: ContextVar[tuple[str | None, str | None]] = ContextVar(
+    "pytest_cpp_node", default=(None, None)
+)
+
+# Phase being timed by the current thread, so phases which happen as part of another
+# (like starting an executable to list its tests) are not counted twice.
+_phase: ContextVar[str | None] = ContextVar("pytest_cpp_phase", default=None)
+
+_profiler: OverheadProfiler | None = None
+
+
+class OverheadProfiler:
+    """
+    Accumulates the time spent in each phase of ``PHASES`` by executable and test,
+    from any thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (phase, executable, test id) -> [total time, number of calls]
+        self._timings: dict[tuple[str, str | None, str | None], list[float]] = {}
+
+    def add(
+        self,
+        phase: str,
+        elapsed: float,
+        executable: str | None = None,
+        test_id: str | None = None,
+    ) -> None:
+        with self._lock:
+            timing = self._timings.setdefault((phase, executable, test_id), [0.0, 0])
+            timing[0] += elapsed
+            timing[1] += 1
+
+    def get_totals(self) -> dict[str, tuple[float, int]]:
+        """Return the total time and number of calls of each phase, in ``PHASES`` order."""
+        totals = {phase: (0.0, 0) for phase in PHASES}
+        with self._lock:
+            for (phase, _, _), (elapsed, calls) in self._timings.items():
+                total, total_calls = totals.get(phase, (0.0, 0))
+                totals[phase] = total + elapsed, total_calls + int(calls)
+        return totals
+
+    def get_slowest_executables(
+        self, phase: str, count: int
+    ) -> list[tuple[str, float]]:
+        """Return the ``count`` executables which spent the most time in the given phase."""
+        executables: dict[str, float] = {}
+        with self._lock:
+            for (timing_phase, executable, _), (elapsed, _) in self._timings.items():
+                if timing_phase == phase and executable is not None:
+                    executables[executable] = executables.get(executable, 0.0) + elapsed
+        return sorted(executables.items(), key=lambda x: x[1], reverse=True)[:count]
+
+    def write(self, path: str) -> None:
+        """Write the totals and the time of each phase by executable and test as JSON."""
+        with self._lock:
+            timings = [
+                {
+                    "phase": phase,
+                    "executable": executable,
+                    "test": test_id,
+                    "total": elapsed,
+                    "calls": int(calls),
+                }
+                for (phase, executable, test_id), (elapsed, calls) in sorted(
+                    self._timings.items(),
+                    key=lambda x: (x[0][0], x[0][1] or "", x[0][2] or ""),
+                )
+            ]
+        data: dict[str, Any] = {
+            "phases": {
+                phase: {"total": total, "calls": calls}
+                for phase, (total, calls) in self.get_totals().items()
+            },
+            "timings": timings,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+def start_profiling() -> OverheadProfiler:
+    """Start timing the phases of pytest-cpp (see ``timed``)."""
+    global _profiler
+    _profiler = OverheadProfiler()
+    return _profiler
+
+
+def stop_profiling() -> None:
+    global _profiler
+    _profiler = None
+
+
+@contextlib.contextmanager
+def profiled_node(executable: str, test_id: str | None = None) -> Iterator[None]:
+    """Attribute the phases timed by the current thread to the given executable and test."""
+    token = _node.set((executable, test_id))
+    try:
+        yield
+    finally:
+        _node.reset(token)
+
+
+@contextlib.contextmanager
+def timed(
+    phase: str, executable: str | None = None, test_id: str | None = None
+) -> Iterator[None]:
+    """
+    Time the given phase, attributed to the given executable and test, or else to the ones
+    given to ``profiled_node``. Does nothing unless profiling was started.
+    """
+    profiler = _profiler
+    if profiler is None or _phase.get() is not None:
+        yield
+        return
+    token = _phase.set(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _phase.reset(token)
+        if executable is None:
+            executable, test_id = _node.get()
+        profiler.add(phase, elapsed, executable, test_id)
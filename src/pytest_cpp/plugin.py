@@ -1,24 +1,68 @@
 from __future__ import annotations
 
+import contextvars
+import functools
+import getpass
+import hashlib
 import os
+import re
 import stat
+import subprocess
 import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
 from pathlib import Path
 from typing import Any
+from typing import Callable
+from typing import cast
+from typing import Dict
+from typing import Hashable
 from typing import Iterator
 from typing import Sequence
 from typing import Type
 from typing import TYPE_CHECKING
+from xml.etree import ElementTree
 
 import pytest
 
 from pytest_cpp.boost import BoostTestFacade
+from pytest_cpp.cache import CollectionCache
+from pytest_cpp.cache import hash_file
+from pytest_cpp.cache import ResultCache
+from pytest_cpp.catch2 import Benchmarks
 from pytest_cpp.catch2 import Catch2Facade
+from pytest_cpp.catch2 import load_benchmark_baseline
+from pytest_cpp.elf import find_markers
 from pytest_cpp.error import CppFailureError
 from pytest_cpp.error import CppFailureRepr
+from pytest_cpp.error import CppMessageFailure
+from pytest_cpp.error import CppTestFailure
 from pytest_cpp.facade_abc import AbstractFacade
+from pytest_cpp.facade_abc import CppTestResult
 from pytest_cpp.google import GoogleTestFacade
+from pytest_cpp.google_benchmark import GoogleBenchmarkFacade
+from pytest_cpp.google_benchmark import load_baseline
+from pytest_cpp.google_benchmark import METRICS
+from pytest_cpp.helpers import get_help_output
+from pytest_cpp.helpers import ProcessTracker
+from pytest_cpp.overhead import OverheadProfiler
+from pytest_cpp.overhead import PHASES
+from pytest_cpp.overhead import profiled_node
+from pytest_cpp.overhead import start_profiling
+from pytest_cpp.overhead import stop_profiling
+from pytest_cpp.overhead import timed
+from pytest_cpp.resources import combine_usages
+from pytest_cpp.resources import get_machine_resources
+from pytest_cpp.resources import parse_resources
+from pytest_cpp.resources import parse_size
+from pytest_cpp.resources import ProcessUsage
+from pytest_cpp.resources import ResourceBudget
+from pytest_cpp.resources import Resources
+from pytest_cpp.resources import tracked_usage
+from pytest_cpp.runner import ParallelRunner
 
 if TYPE_CHECKING:
     from _pytest._code.code import TerminalRepr
@@ -28,11 +72,30 @@ FACADES: Sequence[Type[AbstractFacade]] = (
     GoogleTestFacade,
     BoostTestFacade,
     Catch2Facade,
+    GoogleBenchmarkFacade,
 )
 DEFAULT_MASKS = ("test_*", "*_test")
 
+#: Values of ``cpp_output_capture``.
+OUTPUT_CAPTURE_POLICIES = ("full", "tail", "failures-only")
+
 _ARGUMENTS = "cpp_arguments"
 
+_collection_cache_key = pytest.StashKey[CollectionCache]()
+_prefetcher_key = pytest.StashKey["CollectionPrefetcher"]()
+_runner_key = pytest.StashKey[ParallelRunner]()
+_last_failed_key = pytest.StashKey["dict[Path, set[str] | None]"]()
+_result_cache_key = pytest.StashKey[ResultCache]()
+_profiler_key = pytest.StashKey[OverheadProfiler]()
+_benchmark_baseline_key = pytest.StashKey[Dict[str, Dict[str, Any]]]()
+_catch2_benchmark_baseline_key = pytest.StashKey[Dict[str, Benchmarks]]()
+_resource_budget_key = pytest.StashKey[ResourceBudget]()
+_resource_rules_key = pytest.StashKey["list[tuple[str, Resources]]"]()
+
+_DURATION_PROPERTIES = ("cpp_duration", "cpp_overhead")
+_USAGE_PROPERTIES = ("cpp_max_rss", "cpp_user_time", "cpp_system_time")
+_CACHED_PROPERTY = ("cpp_cached", True)
+
 
 def matches_any_mask(path: Path, masks: Sequence[str]) -> bool:
     """Return True if the given path matches any of the masks given"""
@@ -41,45 +104,712 @@ def matches_any_mask(path: Path, masks: Sequence[str]) -> bool:
     return any(fnmatch(path.name, m) for m in masks)
 
 
-def pytest_collect_file(
-    parent: pytest.Collector, file_path: Path
-) -> pytest.Collector | None:
+def get_int_ini(config: pytest.Config, name: str) -> int:
+    """Return the value of an integer ini option, which must not be negative."""
+    value = config.getini(name)
+    try:
+        result = int(value)
+    except ValueError:
+        result = -1
+    if result < 0:
+        raise pytest.UsageError(
+            f"{name} must be a non-negative integer, got: {value!r}"
+        )
+    return result
+
+
+def get_float_ini(config: pytest.Config, name: str) -> float:
+    """Return the value of a number ini option, which must not be negative."""
+    value = config.getini(name)
+    try:
+        result = float(value)
+    except ValueError:
+        result = -1
+    if result < 0:
+        raise pytest.UsageError(f"{name} must be a non-negative number, got: {value!r}")
+    return result
+
+
+def get_timeout(config: pytest.Config, name: str) -> float | None:
+    """Return the value of a timeout ini option in seconds, None meaning no timeout."""
+    return get_float_ini(config, name) or None
+
+
+def get_batch_timeout(config: pytest.Config, tests: int) -> float | None:
+    """
+    Return the timeout of an invocation running the given number of tests: cpp_timeout
+    applies to each of them, while cpp_batch_timeout limits the invocation as a whole.
+    """
+    timeout = get_timeout(config, "cpp_timeout")
+    if timeout is not None:
+        timeout *= tests
+    batch_timeout = get_timeout(config, "cpp_batch_timeout")
+    if batch_timeout is None:
+        return timeout
+    if timeout is None:
+        return batch_timeout
+    return min(timeout, batch_timeout)
+
+
+def get_benchmark_metric(config: pytest.Config) -> str:
+    metric: str = config.getini("cpp_benchmark_metric")
+    if metric not in METRICS:
+        raise pytest.UsageError(
+            f"cpp_benchmark_metric must be one of {', '.join(METRICS)}, got: {metric!r}"
+        )
+    return metric
+
+
+def get_benchmark_baseline(config: pytest.Config) -> dict[str, dict[str, Any]] | None:
+    """Return the results of the benchmarks in the ``cpp_benchmark_baseline`` file, if any."""
+    path = config.getini("cpp_benchmark_baseline")
+    if not path:
+        return None
+    path = str(config.rootpath / path)
+    try:
+        return load_baseline(path)
+    except (OSError, ValueError, KeyError) as e:
+        raise pytest.UsageError(f"could not read cpp_benchmark_baseline {path}: {e}")
+
+
+def get_catch2_benchmark_baseline(
+    config: pytest.Config,
+) -> dict[str, Benchmarks] | None:
+    """
+    Return the benchmarks of each test case in the ``cpp_catch2_benchmark_baseline`` file,
+    if any.
+    """
+    path = config.getini("cpp_catch2_benchmark_baseline")
+    if not path:
+        return None
+    path = str(config.rootpath / path)
+    try:
+        return load_benchmark_baseline(path)
+    except (OSError, ElementTree.ParseError, KeyError, ValueError) as e:
+        raise pytest.UsageError(
+            f"could not read cpp_catch2_benchmark_baseline {path}: {e}"
+        )
+
+
+def get_resource_rules(config: pytest.Config) -> list[tuple[str, Resources]]:
+    """
+    Return the (pattern, resources) pairs of the ``cpp_resources`` option, where each line
+    is a pattern followed by "cpus=N" and "memory=SIZE" arguments.
+    """
+    rules = []
+    for line in config.getini("cpp_resources"):
+        pattern, *args = line.split()
+        try:
+            rules.append((pattern, parse_resources(args)))
+        except ValueError as e:
+            raise pytest.UsageError(f"invalid cpp_resources line {line!r}: {e}")
+    return rules
+
+
+def get_resource_budget(config: pytest.Config) -> ResourceBudget:
+    """
+    Return the budget of the resources used by tests, shared by all the sessions which use
+    the same ``cpp_resource_dir``, by default the CPUs and memory of the machine.
+    """
+    try:
+        budget = parse_resources(
+            config.getini("cpp_resource_budget"), get_machine_resources()
+        )
+    except ValueError as e:
+        raise pytest.UsageError(f"invalid cpp_resource_budget: {e}")
+    directory = config.getini("cpp_resource_dir")
+    if directory:
+        path = config.rootpath / directory
+    else:
+        try:
+            user = getpass.getuser()
+        except Exception:
+            user = "unknown"
+        path = Path(tempfile.gettempdir()) / f"pytest-cpp-resources-{user}"
+    return ResourceBudget(path, budget)
+
+
+def get_max_rss(config: pytest.Config) -> int | None:
+    """Return the value of ``cpp_max_rss`` in bytes, None meaning no limit."""
+    value = config.getini("cpp_max_rss")
+    if not value:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise pytest.UsageError(
+            f"cpp_max_rss must be a size like 512M or 4G, got: {value!r}"
+        )
+
+
+def get_output_capture(config: pytest.Config) -> str:
+    policy: str = config.getini("cpp_output_capture")
+    if policy not in OUTPUT_CAPTURE_POLICIES:
+        raise pytest.UsageError(
+            f"cpp_output_capture must be one of {', '.join(OUTPUT_CAPTURE_POLICIES)}, "
+            f"got: {policy!r}"
+        )
+    return policy
+
+
+def get_output_tail_size(config: pytest.Config) -> int:
+    """Return the value of ``cpp_output_tail_size`` in characters, 0 meaning no limit."""
+    value = config.getini("cpp_output_tail_size")
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise pytest.UsageError(
+            f"cpp_output_tail_size must be a size like 64K, got: {value!r}"
+        )
+
+
+def get_output_path(directory: Path, executable: Path, test_id: str) -> Path:
+    """Return the path of the file where the output of the given test is written."""
+    name = re.sub(r"[^\w.-]", "_", test_id)
+    if name != test_id:
+        # tell apart tests whose names only differ by the replaced characters
+        name += "-" + hashlib.sha1(test_id.encode("utf-8")).hexdigest()[:8]
+    return directory / executable.name / f"{name}.log"
+
+
+def keep_output(
+    config: pytest.Config, executable: Path, test_id: str, output: str, failed: bool
+) -> str:
+    """
+    Return the part of the output of a test which is kept in memory and attached to its
+    report, according to ``cpp_output_capture``: the last ``cpp_output_tail_size``
+    characters, unless the policy is "full", and nothing for tests which passed when it
+    is "failures-only".
+
+    The whole output of the tests whose output is kept is written to a file in
+    ``cpp_output_dir``, if given.
+    """
+    if get_output_capture(config) == "failures-only" and not failed:
+        return ""
+    path = None
+    directory = config.getini("cpp_output_dir")
+    if directory and output:
+        path = get_output_path(config.rootpath / directory, executable, test_id)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(output, encoding="utf-8", errors="replace")
+        except OSError:
+            path = None
+    tail_size = get_output_tail_size(config)
+    if (
+        get_output_capture(config) == "full"
+        or not tail_size
+        or len(output) <= tail_size
+    ):
+        return output
+    omitted = len(output) - tail_size
+    where = f", full output in {path}" if path is not None else ""
+    return f"[{omitted} characters of output omitted{where}]\n" + output[-tail_size:]
+
+
+def get_batch_size(config: pytest.Config) -> int:
+    """Return the maximum number of tests per invocation, 0 meaning no limit."""
+    batch_size = get_int_ini(config, "cpp_batch_size")
+    if batch_size == 1 and get_shards(config) > 1:
+        # shards need batches to split
+        return 0
+    return batch_size
+
+
+def splits_executables(config: pytest.Config) -> bool:
+    """
+    Return True if this is a pytest-xdist worker which might run only some of the tests of
+    each executable, while its session has all of them: the workers only know which tests
+    they run as they receive them, unless all tests of a file go to the same worker.
+    """
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is None:
+        return False
+    return workerinput.get("cpp_dist") not in ("loadfile", "loadscope")
+
+
+def get_shards(config: pytest.Config) -> int:
+    shards: int = config.getoption("cpp_shards")
+    if shards < 1:
+        raise pytest.UsageError(f"--cpp-shards must be at least 1, got: {shards}")
+    return shards
+
+
+def get_jobs(config: pytest.Config) -> int:
+    jobs: int = config.getoption("cpp_jobs")
+    if jobs < 1:
+        raise pytest.UsageError(f"--cpp-jobs must be at least 1, got: {jobs}")
+    return jobs
+
+
+def get_last_failed(config: pytest.Config) -> dict[Path, set[str] | None] | None:
+    """
+    Return the names of the tests which failed in the last run by path, when running
+    with ``--lf``, where None means that the whole file failed (for example, to be collected).
+
+    Return None if all tests should run, because there are no known failures among the
+    selected paths (pytest then runs all their tests).
+    """
+    if not config.getoption("lf", False) or getattr(config, "cache", None) is None:
+        return None
+    assert config.cache is not None
+    last_failed: dict[Path, set[str] | None] = {}
+    for nodeid in config.cache.get("cache/lastfailed", {}):
+        file_id, _, name = nodeid.partition("::")
+        path = config.rootpath / file_id
+        if not path.exists():
+            continue
+        names = last_failed.setdefault(path, set())
+        if names is not None and name:
+            names.add(name)
+        else:
+            last_failed[path] = None
+    selected = [
+        Path(os.path.abspath(config.invocation_params.dir / arg.partition("::")[0]))
+        for arg in config.args
+    ]
+    if not any(
+        x == path or x in path.parents for path in last_failed for x in selected
+    ):
+        return None
+    return last_failed
+
+
+def get_result_cache(config: pytest.Config) -> ResultCache | None:
+    """Return the cache of test results configured by the ``cpp_result_cache`` options."""
+    if not config.getini("cpp_result_cache"):
+        return None
+    directory = config.getini("cpp_result_cache_dir")
+    if directory:
+        path = config.rootpath / directory
+    elif getattr(config, "cache", None) is not None:
+        assert config.cache is not None
+        path = config.cache.mkdir("cpp-results")
+    else:
+        return None
+    env = {name: os.environ.get(name) for name in config.getini("cpp_result_cache_env")}
+    return ResultCache(path, env, get_result_cache_settings(config))
+
+
+def get_result_cache_settings(config: pytest.Config) -> dict[str, Any]:
+    """
+    Return the values of the options which can change the outcome of tests, which are part
+    of the keys of ``ResultCache``: the limits of tests, and the benchmark settings (with the
+    hashes of the contents of the baselines).
+    """
+    settings: dict[str, Any] = {
+        "cpp_timeout": get_timeout(config, "cpp_timeout"),
+        "cpp_batch_timeout": get_timeout(config, "cpp_batch_timeout"),
+        "cpp_max_rss": get_max_rss(config),
+        "cpp_max_cpu_time": get_float_ini(config, "cpp_max_cpu_time"),
+        "cpp_benchmark_threshold": get_float_ini(config, "cpp_benchmark_threshold"),
+        "cpp_benchmark_metric": get_benchmark_metric(config),
+    }
+    for name in ("cpp_benchmark_baseline", "cpp_catch2_benchmark_baseline"):
+        path = config.getini(name)
+        try:
+            settings[name] = hash_file(str(config.rootpath / path)) if path else None
+        except OSError as e:
+            raise pytest.UsageError(f"could not read {name} {path}: {e}")
+    return settings
+
+
+def is_same_error(
+    error: CppTestFailure,
+    output: str,
+    other_error: CppTestFailure | None,
+    other_output: str,
+) -> bool:
+    """
+    Return True if two invocations of an executable running different tests failed in the
+    same way: with the same kind of error and the same output.
+    """
+    return type(other_error) is type(error) and other_output == output
+
+
+def check_usage(
+    config: pytest.Config, test_id: str, usage: ProcessUsage | None
+) -> list[CppTestFailure]:
+    """
+    Return failures for the limits of ``cpp_max_rss`` and ``cpp_max_cpu_time`` exceeded by
+    the given usage of a test.
+    """
+    if usage is None:
+        return []
+    failures: list[CppTestFailure] = []
+    max_rss = get_max_rss(config)
+    if max_rss is not None and (usage.max_rss or 0) > max_rss:
+        failures.append(
+            CppMessageFailure(
+                f"{test_id} used {format_size(usage.max_rss or 0)} of memory "
+                "(peak RSS), "
+                f"above cpp_max_rss of {format_size(max_rss)}"
+            )
+        )
+    max_cpu_time = get_float_ini(config, "cpp_max_cpu_time")
+    if max_cpu_time and usage.cpu_time > max_cpu_time:
+        failures.append(
+            CppMessageFailure(
+                f"{test_id} used {usage.cpu_time:.3f}s of CPU time, "
+                f"above cpp_max_cpu_time of {max_cpu_time:g}s"
+            )
+        )
+    return failures
+
+
+def is_executable(file_path: Path) -> bool:
     try:
-        is_executable = os.stat(str(file_path)).st_mode & stat.S_IXUSR
+        return bool(os.stat(str(file_path)).st_mode & stat.S_IXUSR)
     except OSError:
         # in some situations the file might not be available anymore at this point
-        is_executable = False
-    if not is_executable:
-        return None
+        return False
 
-    config = parent.config
+
+def is_selected(session: pytest.Session, path: Path) -> bool:
+    """Return True if the given path was given to pytest, or is in a directory which was."""
+    return any(session.isinitpath(x) for x in (path, *path.parents))
+
+
+def is_candidate(session: pytest.Session, file_path: Path) -> bool:
+    """Return True if the given file should be checked for C++ tests."""
+    # pytest might collect the other files of the directories of the given files, only
+    # to discard them
+    if not is_selected(session, file_path) or not is_executable(file_path):
+        return False
+
+    config = session.config
     masks = config.getini("cpp_files")
-    test_args = config.getini("cpp_arguments")
     cpp_ignore_py_files = config.getini("cpp_ignore_py_files")
 
     # don't attempt to check *.py files even if they were given as explicit arguments
     if cpp_ignore_py_files and fnmatch(file_path.name, "*.py"):
-        return None
+        return False
 
-    if not parent.session.isinitpath(file_path) and not matches_any_mask(
-        file_path, masks
-    ):
+    # with --lf, executables without failures are skipped by pytest anyway
+    last_failed = config.stash.get(_last_failed_key, None)
+    if last_failed is not None and file_path not in last_failed:
+        return False
+
+    return session.isinitpath(file_path) or matches_any_mask(file_path, masks)
+
+
+def pytest_collect_file(
+    parent: pytest.Collector, file_path: Path
+) -> pytest.Collector | None:
+    if not is_executable(file_path) or not is_candidate(parent.session, file_path):
         return None
 
-    harness_collect = parent.config.getini("cpp_harness_collect")
-    for facade_class in FACADES:
-        if facade_class.is_test_suite(str(file_path), harness_collect=harness_collect):
-            return CppFile.from_parent(
-                path=file_path,
-                parent=parent,
-                facade=facade_class(),
-                arguments=test_args,
+    config = parent.config
+    test_args = config.getini("cpp_arguments")
+    prefetcher = config.stash.get(_prefetcher_key, None)
+    try:
+        if prefetcher is not None:
+            prefetcher.prefetch_directory(parent.session, file_path.parent)
+            facade = prefetcher.get_facade(file_path)
+        else:
+            harness_collect = config.getini("cpp_harness_collect")
+            facade = detect_facade(
+                str(file_path),
+                harness_collect,
+                config.stash.get(_collection_cache_key, None),
+                static=config.getini("cpp_static_detection"),
+                timeout=get_timeout(config, "cpp_collect_timeout"),
             )
+    except subprocess.TimeoutExpired as e:
+        return CppErrorFile.from_parent(
+            parent=parent, path=file_path, message=get_collect_timeout_message(e)
+        )
+    if facade is not None:
+        facade.report_pipes = config.getini("cpp_report_pipes")
+        if isinstance(facade, GoogleBenchmarkFacade):
+            facade.baseline = config.stash.get(_benchmark_baseline_key, None)
+            facade.threshold = get_float_ini(config, "cpp_benchmark_threshold")
+            facade.metric = get_benchmark_metric(config)
+        elif isinstance(facade, Catch2Facade):
+            facade.benchmark_baseline = config.stash.get(
+                _catch2_benchmark_baseline_key, None
+            )
+            facade.benchmark_threshold = get_float_ini(
+                config, "cpp_benchmark_threshold"
+            )
+        return CppFile.from_parent(
+            path=file_path,
+            parent=parent,
+            facade=facade,
+            arguments=test_args,
+        )
 
     return None
 
 
+def detect_facade_statically(executable: str) -> tuple[bool, AbstractFacade | None]:
+    """
+    Try to find out the framework used by the given executable without running it, by
+    looking for the ``binary_markers`` of each facade in it.
+
+    Return a tuple of (decided, facade): the executable is considered not to contain tests
+    only if it is an ELF file without any of the markers, and ``decided`` is False
+    when the markers found are not conclusive.
+    """
+    all_markers = [marker for x in FACADES for marker in x.binary_markers]
+    markers = find_markers(executable, all_markers)
+    if markers is None:
+        return False, None
+    if not markers:
+        return True, None
+    facades = [
+        facade
+        for facade in (x.from_binary_markers(markers) for x in FACADES)
+        if facade is not None
+    ]
+    if len(facades) == 1:
+        return True, facades[0]
+    return False, None
+
+
+def detect_facade(
+    executable: str,
+    harness_collect: Sequence[str] = (),
+    cache: CollectionCache | None = None,
+    static: bool = False,
+    timeout: float | None = None,
+) -> AbstractFacade | None:
+    """
+    Return a facade for the framework used by the given executable, or None if it
+    doesn't contain tests of any known framework.
+
+    If ``static`` is True, the executable is first inspected without running it
+    (see ``detect_facade_statically``). Otherwise it is run with "--help" only once,
+    and its output is given to each facade to find out which framework it uses.
+
+    ``subprocess.TimeoutExpired`` is raised if it doesn't finish within ``timeout`` seconds.
+    """
+    facades_by_name = {x.__name__: x for x in FACADES}
+    if cache is not None:
+        found, cached = cache.get_facade(executable, harness_collect)
+        if found and (cached is None or cached[0] in facades_by_name):
+            if cached is None:
+                return None
+            facade_name, state = cached
+            return facades_by_name[facade_name].from_cache_state(state)
+
+    with profiled_node(executable), timed("probe"):
+        decided, facade = (
+            detect_facade_statically(executable) if static else (False, None)
+        )
+        help_output = (
+            get_help_output(executable, harness_collect, timeout)
+            if not decided
+            else None
+        )
+    if help_output is not None:
+        for facade_class in FACADES:
+            facade = facade_class.from_help_output(help_output)
+            if facade is not None:
+                break
+
+    if cache is not None:
+        cache.set_facade(
+            executable,
+            (
+                (type(facade).__name__, facade.get_cache_state())
+                if facade is not None
+                else None
+            ),
+            harness_collect,
+        )
+    return facade
+
+
+def list_tests(
+    facade: AbstractFacade,
+    executable: str,
+    harness_collect: Sequence[str] = (),
+    cache: CollectionCache | None = None,
+    timeout: float | None = None,
+) -> list[str]:
+    """Return the test ids found in the given executable, using the cache if given."""
+    test_ids = (
+        cache.get_tests(executable, harness_collect) if cache is not None else None
+    )
+    if test_ids is None:
+        with profiled_node(executable), timed("list"):
+            test_ids = facade.list_tests(
+                executable, harness_collect=harness_collect, timeout=timeout
+            )
+        if cache is not None:
+            cache.set_tests(executable, test_ids, harness_collect)
+    return test_ids
+
+
+def get_collect_timeout_message(error: subprocess.TimeoutExpired) -> str:
+    return (
+        "{cmdline} did not finish within {timeout} seconds (cpp_collect_timeout) "
+        "and was killed, output so far:\n{output}"
+    ).format(
+        cmdline=" ".join(error.cmd), timeout=error.timeout, output=error.output or ""
+    )
+
+
+class CollectionPrefetcher:
+    """
+    Detects the framework and lists the tests of candidate executables using a pool of
+    threads, ahead of their collection by pytest, which then only waits for the results
+    of each executable as it gets collected.
+
+    Prefetching starts when the first file of a directory is collected, including all
+    its sub-directories, except those containing a ``conftest.py`` file: those are only
+    prefetched when pytest reaches them, so they are ignored as configured by the
+    ``conftest.py`` files. Only the paths given to pytest, and those within the
+    directories given to it, are prefetched, as pytest collects no others.
+    """
+
+    def __init__(self, config: pytest.Config, workers: int) -> None:
+        self._config = config
+        self._harness_collect = config.getini("cpp_harness_collect")
+        self._cache = config.stash.get(_collection_cache_key, None)
+        self._static = config.getini("cpp_static_detection")
+        self._timeout = get_timeout(config, "cpp_collect_timeout")
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="pytest-cpp"
+        )
+        self._directories: set[Path] = set()
+        self._futures: dict[
+            Path,
+            Future[tuple[AbstractFacade | None, list[str] | None, Exception | None]],
+        ] = {}
+        self._listings: dict[Path, tuple[list[str] | None, Exception | None]] = {}
+        self._processes = ProcessTracker()
+
+    def prefetch_directory(self, session: pytest.Session, directory: Path) -> None:
+        if directory in self._directories:
+            return
+        self._directories.add(directory)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda x: x.name)
+        except OSError:
+            return
+        ihook = session.gethookproxy(directory)
+        for entry in entries:
+            path = Path(entry.path)
+            if not is_selected(session, path):
+                continue
+            if entry.is_dir():
+                if path.joinpath("conftest.py").is_file():
+                    continue
+                if ihook.pytest_ignore_collect(
+                    collection_path=path, config=self._config
+                ):
+                    continue
+                self.prefetch_directory(session, path)
+            elif entry.is_file():
+                if not session.isinitpath(path) and ihook.pytest_ignore_collect(
+                    collection_path=path, config=self._config
+                ):
+                    continue
+                if is_candidate(session, path):
+                    self._submit(path)
+
+    def _submit(self, path: Path) -> None:
+        if path not in self._futures:
+            self._futures[path] = self._executor.submit(self._detect_and_list, path)
+
+    def _detect_and_list(
+        self, path: Path
+    ) -> tuple[AbstractFacade | None, list[str] | None, Exception | None]:
+        with self._processes.tracking():
+            facade = detect_facade(
+                str(path),
+                self._harness_collect,
+                self._cache,
+                static=self._static,
+                timeout=self._timeout,
+            )
+            if facade is None:
+                return None, None, None
+            try:
+                test_ids = list_tests(
+                    facade, str(path), self._harness_collect, self._cache, self._timeout
+                )
+            except Exception as e:
+                return facade, None, e
+            return facade, test_ids, None
+
+    def get_facade(self, path: Path) -> AbstractFacade | None:
+        self._submit(path)
+        facade, test_ids, error = self._futures.pop(path).result()
+        if facade is not None:
+            self._listings[path] = test_ids, error
+        return facade
+
+    def pop_tests(self, path: Path) -> list[str] | None:
+        """
+        Return the prefetched test ids of the given executable, or None if they were not
+        prefetched; errors raised while listing the tests are raised here.
+        """
+        test_ids, error = self._listings.pop(path, (None, None))
+        if error is not None:
+            raise error
+        return test_ids
+
+    def shutdown(self) -> None:
+        """
+        Stop prefetching, killing the processes still running for executables which were
+        not collected (collection might also have been interrupted).
+        """
+        for future in self._futures.values():
+            future.cancel()
+        self._processes.kill()
+        self._executor.shutdown(wait=True)
+
+
 def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("cpp", "C++ tests")
+    group.addoption(
+        "--cpp-cache-clear",
+        action="store_true",
+        default=False,
+        help="discard the cached collection results of C++ test executables",
+    )
+    group.addoption(
+        "--cpp-jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="run up to N C++ tests (or batches of tests) concurrently, "
+        "reporting them in the usual order",
+    )
+    group.addoption(
+        "--cpp-shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help="run the tests of each executable split in N concurrent invocations, "
+        "for frameworks which support it",
+    )
+    group.addoption(
+        "--cpp-durations",
+        type=int,
+        default=None,
+        metavar="N",
+        help="show the N slowest C++ tests, and the time spent in each executable, "
+        "split in the time measured by the framework and the overhead (N=0 for all)",
+    )
+    group.addoption(
+        "--cpp-usage",
+        type=int,
+        default=None,
+        metavar="N",
+        help="show the N C++ tests which used the most memory (peak RSS) and CPU time "
+        "(N=0 for all)",
+    )
+    group.addoption(
+        "--cpp-profile-overhead",
+        default=None,
+        metavar="PATH",
+        help="time the phases of collecting and running C++ tests, showing a summary "
+        "and writing the timings of each executable and test to PATH (JSON)",
+    )
     parser.addini(
         "cpp_files",
         type="args",
@@ -116,6 +846,406 @@ def pytest_addoption(parser: pytest.Parser) -> None:
         default=False,
         help="print the test output right after it ran, requires -s",
     )
+    parser.addini(
+        "cpp_output_capture",
+        default="full",
+        help="output of tests attached to their reports: full, tail (only the last "
+        "cpp_output_tail_size of it) or failures-only (the tail, for failed tests only)",
+    )
+    parser.addini(
+        "cpp_output_tail_size",
+        default="64K",
+        help="number of characters kept from the end of the output of each test with "
+        "cpp_output_capture = tail or failures-only (0 keeps all)",
+    )
+    parser.addini(
+        "cpp_output_dir",
+        default="",
+        help="directory where the whole output of each test is written, one file per test",
+    )
+    parser.addini(
+        "cpp_batch_size",
+        default="1",
+        help="maximum number of tests run by a single invocation of a test executable, "
+        "for frameworks which support it (0 means no limit, 1 disables batches)",
+    )
+    parser.addini(
+        "cpp_collect_cache",
+        type="bool",
+        default=False,
+        help="cache the tests found in each executable across sessions, "
+        "until the executable changes",
+    )
+    parser.addini(
+        "cpp_static_detection",
+        type="bool",
+        default=False,
+        help="detect the framework of ELF executables by inspecting them, "
+        'running them with "--help" only if that is not conclusive',
+    )
+    parser.addini(
+        "cpp_collect_workers",
+        default="0",
+        help="number of threads used to probe and list the tests of executables "
+        "concurrently during collection (0 disables concurrent collection)",
+    )
+    parser.addini(
+        "cpp_timeout",
+        default="0",
+        help="seconds each test can run, after which its test executable is killed, "
+        "failing its running tests (0 disables the timeout)",
+    )
+    parser.addini(
+        "cpp_batch_timeout",
+        default="0",
+        help="seconds after which an invocation running a batch of tests is killed, "
+        "whatever the number of tests (0 disables the timeout)",
+    )
+    parser.addini(
+        "cpp_collect_timeout",
+        default="0",
+        help="seconds after which test executables are killed while collecting "
+        "their tests (0 disables the timeout)",
+    )
+    parser.addini(
+        "cpp_report_pipes",
+        type="bool",
+        default=False,
+        help="give the reports of test executables to pytest-cpp through pipes "
+        "instead of temporary files, when possible",
+    )
+    parser.addini(
+        "cpp_benchmark_baseline",
+        default="",
+        help="JSON report of Google Benchmark (--benchmark_out) which benchmarks are "
+        "compared with, failing if they got slower by more than cpp_benchmark_threshold",
+    )
+    parser.addini(
+        "cpp_benchmark_threshold",
+        default="0.1",
+        help="fraction by which benchmarks can be slower than in cpp_benchmark_baseline "
+        "or cpp_catch2_benchmark_baseline before failing (default: 0.1)",
+    )
+    parser.addini(
+        "cpp_benchmark_metric",
+        default="real_time",
+        help="time compared with cpp_benchmark_baseline: real_time or cpu_time",
+    )
+    parser.addini(
+        "cpp_catch2_benchmark_baseline",
+        default="",
+        help="XML report of Catch2 (--reporter xml) which the BENCHMARK blocks of Catch2 "
+        "tests are compared with, failing if their mean got larger by more than "
+        "cpp_benchmark_threshold",
+    )
+    parser.addini(
+        "cpp_max_rss",
+        default="",
+        help="peak RSS (a size like 512M or 4G) above which C++ tests fail",
+    )
+    parser.addini(
+        "cpp_max_cpu_time",
+        default="0",
+        help="seconds of CPU time after which test executables are killed, failing "
+        "their tests (0 disables the limit)",
+    )
+    parser.addini(
+        "cpp_resources",
+        type="linelist",
+        default=[],
+        help="resources used by tests, one pattern matching executables "
+        '(or "executable::test") per line, followed by "cpus=N" and "memory=SIZE"',
+    )
+    parser.addini(
+        "cpp_resource_budget",
+        type="args",
+        default=(),
+        help='"cpus=N" and "memory=SIZE" available to the tests of all the sessions '
+        "of the machine (default: the CPUs and memory of the machine)",
+    )
+    parser.addini(
+        "cpp_resource_dir",
+        default="",
+        help="directory of the budget of cpp_resources shared by concurrent sessions "
+        "(default: in the temporary directory of the system)",
+    )
+    parser.addini(
+        "cpp_result_cache",
+        type="bool",
+        default=False,
+        help="skip tests which passed in a previous session, as long as their "
+        "executable, libraries, arguments and environment did not change",
+    )
+    parser.addini(
+        "cpp_result_cache_dir",
+        default="",
+        help="directory where cpp_result_cache stores the tests which passed, "
+        "which can be shared by several machines (default: in pytest's cache)",
+    )
+    parser.addini(
+        "cpp_result_cache_env",
+        type="args",
+        default=(),
+        help="environment variables which are part of the keys of cpp_result_cache",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    # validate options early, so mistakes are reported as usage errors
+    get_batch_size(config)
+    get_shards(config)
+    get_timeout(config, "cpp_timeout")
+    get_timeout(config, "cpp_batch_timeout")
+    get_timeout(config, "cpp_collect_timeout")
+    get_max_rss(config)
+    get_float_ini(config, "cpp_max_cpu_time")
+    get_output_capture(config)
+    get_output_tail_size(config)
+    get_float_ini(config, "cpp_benchmark_threshold")
+    get_benchmark_metric(config)
+
+    baseline = get_benchmark_baseline(config)
+    if baseline is not None:
+        config.stash[_benchmark_baseline_key] = baseline
+    catch2_baseline = get_catch2_benchmark_baseline(config)
+    if catch2_baseline is not None:
+        config.stash[_catch2_benchmark_baseline_key] = catch2_baseline
+
+    config.addinivalue_line(
+        "markers",
+        "cpp_resources(cpus=0, memory=0): CPUs and memory (a size like '4G') used by "
+        "a C++ test, acquired from cpp_resource_budget before running it",
+    )
+    config.stash[_resource_rules_key] = get_resource_rules(config)
+    config.stash[_resource_budget_key] = get_resource_budget(config)
+
+    last_failed = get_last_failed(config)
+    if last_failed is not None:
+        config.stash[_last_failed_key] = last_failed
+
+    result_cache = get_result_cache(config)
+    if result_cache is not None:
+        config.stash[_result_cache_key] = result_cache
+
+    if config.getoption("cpp_profile_overhead"):
+        config.stash[_profiler_key] = start_profiling()
+
+    cache = getattr(config, "cache", None)
+    if cache is not None:
+        if config.getoption("cpp_cache_clear"):
+            cache.set(CollectionCache.KEY, {})
+        if config.getini("cpp_collect_cache"):
+            config.stash[_collection_cache_key] = CollectionCache(cache)
+
+    jobs = get_jobs(config)
+    # pytest-xdist workers only run some of the items, which they don't know beforehand
+    if jobs > 1 and not hasattr(config, "workerinput"):
+        config.stash[_runner_key] = ParallelRunner(jobs)
+
+    collect_workers = get_int_ini(config, "cpp_collect_workers")
+    if collect_workers > 0:
+        config.stash[_prefetcher_key] = CollectionPrefetcher(config, collect_workers)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node: Any) -> None:
+    # the workers of pytest-xdist don't know how the tests are distributed
+    node.workerinput["cpp_dist"] = node.config.getoption("dist", "no")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session: pytest.Session) -> None:
+    runner = session.config.stash.get(_runner_key, None)
+    if runner is not None:
+        for item in session.items:
+            if isinstance(item, CppItem) and not item.is_cached():
+                runner.add(*item.get_work())
+
+
+def pytest_report_teststatus(
+    report: pytest.TestReport, config: pytest.Config
+) -> tuple[str, str, tuple[str, dict[str, bool]]] | None:
+    if (
+        report.when == "call"
+        and report.passed
+        and _CACHED_PROPERTY in report.user_properties
+    ):
+        return "passed", ".", ("PASSED (cached)", {"green": True})
+    return None
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    prefetcher = session.config.stash.get(_prefetcher_key, None)
+    if prefetcher is not None:
+        prefetcher.shutdown()
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    prefetcher = session.config.stash.get(_prefetcher_key, None)
+    if prefetcher is not None:
+        # collection might have been interrupted
+        prefetcher.shutdown()
+    runner = session.config.stash.get(_runner_key, None)
+    if runner is not None:
+        runner.shutdown()
+    cache = session.config.stash.get(_collection_cache_key, None)
+    if cache is not None:
+        cache.save()
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    profiler = config.stash.get(_profiler_key, None)
+    if profiler is not None:
+        stop_profiling()
+        path = config.getoption("cpp_profile_overhead")
+        workerinput = getattr(config, "workerinput", None)
+        if workerinput is not None:
+            # each pytest-xdist worker writes its own timings
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{workerinput['workerid']}{ext}"
+        profiler.write(path)
+
+
+def pytest_terminal_summary(terminalreporter: pytest.TerminalReporter) -> None:
+    write_durations_summary(terminalreporter)
+    write_usage_summary(terminalreporter)
+    write_overhead_summary(terminalreporter)
+
+
+def write_overhead_summary(terminalreporter: pytest.TerminalReporter) -> None:
+    """Write the time spent in each phase with --cpp-profile-overhead."""
+    profiler = terminalreporter.config.stash.get(_profiler_key, None)
+    if profiler is None:
+        return
+
+    terminalreporter.write_sep("=", "pytest-cpp overhead")
+    terminalreporter.write_line(f"{'total':>10} {'calls':>7}  phase")
+    for phase, (total, calls) in profiler.get_totals().items():
+        terminalreporter.write_line(
+            f"{total:>9.3f}s {calls:>7}  {phase} ({PHASES[phase]})"
+        )
+    terminalreporter.write_sep("-", "slowest executables per phase")
+    for phase in PHASES:
+        slowest = profiler.get_slowest_executables(phase, 3)
+        if slowest:
+            terminalreporter.write_line(f"{phase}:")
+        for executable, total in slowest:
+            try:
+                executable = os.path.relpath(
+                    executable, terminalreporter.config.rootpath
+                )
+            except ValueError:
+                # on Windows, when the paths are on different drives
+                pass
+            terminalreporter.write_line(f"{total:>9.3f}s  {executable}")
+
+
+def write_durations_summary(terminalreporter: pytest.TerminalReporter) -> None:
+    """Write the durations of the C++ tests with --cpp-durations."""
+    count = terminalreporter.config.getoption("cpp_durations")
+    if count is None:
+        return
+
+    tests: list[tuple[str, str, float | None, float]] = []
+    for reports in terminalreporter.stats.values():
+        for report in reports:
+            if not isinstance(report, pytest.TestReport) or report.when != "call":
+                continue
+            properties = dict(report.user_properties)
+            if "cpp_overhead" in properties:
+                tests.append(
+                    (
+                        report.nodeid,
+                        report.fspath,
+                        cast("float | None", properties.get("cpp_duration")),
+                        cast(float, properties["cpp_overhead"]),
+                    )
+                )
+    if not tests:
+        return
+
+    def format_duration(duration: float | None) -> str:
+        return f"{duration:.3f}s" if duration is not None else "-"
+
+    tests.sort(key=lambda x: (x[2] or 0) + x[3], reverse=True)
+    shown = tests[:count] if count > 0 else tests
+    terminalreporter.write_sep(
+        "=", f"slowest {count} C++ test durations" if count else "C++ test durations"
+    )
+    terminalreporter.write_line(f"{'C++ time':>10} {'overhead':>10}  test")
+    for nodeid, _, duration, overhead in shown:
+        terminalreporter.write_line(
+            f"{format_duration(duration):>10} {format_duration(overhead):>10}  {nodeid}"
+        )
+
+    # executable -> (C++ time, overhead, number of tests)
+    executables: dict[str, tuple[float, float, int]] = {}
+    for _, fspath, duration, overhead in tests:
+        total_duration, total_overhead, total_tests = executables.get(
+            fspath, (0.0, 0.0, 0)
+        )
+        executables[fspath] = (
+            total_duration + (duration or 0),
+            total_overhead + overhead,
+            total_tests + 1,
+        )
+    terminalreporter.write_sep("=", "C++ durations per executable")
+    terminalreporter.write_line(f"{'C++ time':>10} {'overhead':>10}  executable")
+    for fspath, (duration, overhead, total_tests) in sorted(
+        executables.items(), key=lambda x: x[1][0] + x[1][1], reverse=True
+    ):
+        terminalreporter.write_line(
+            f"{format_duration(duration):>10} {format_duration(overhead):>10}  "
+            f"{fspath} ({total_tests} test{'s' if total_tests != 1 else ''})"
+        )
+
+
+def write_usage_summary(terminalreporter: pytest.TerminalReporter) -> None:
+    """Write the C++ tests which used the most memory and CPU time with --cpp-usage."""
+    count = terminalreporter.config.getoption("cpp_usage")
+    if count is None:
+        return
+
+    tests: list[tuple[str, ProcessUsage]] = []
+    for reports in terminalreporter.stats.values():
+        for report in reports:
+            if not isinstance(report, pytest.TestReport) or report.when != "call":
+                continue
+            properties = dict(report.user_properties)
+            if "cpp_user_time" in properties:
+                usage = ProcessUsage(
+                    *(cast(Any, properties.get(name)) for name in _USAGE_PROPERTIES)
+                )
+                tests.append((report.nodeid, usage))
+    if not tests:
+        return
+
+    for title, key in [
+        ("peak RSS", lambda x: x[1].max_rss or 0),
+        ("CPU time", lambda x: x[1].cpu_time),
+    ]:
+        tests.sort(key=key, reverse=True)
+        shown = tests[:count] if count > 0 else tests
+        terminalreporter.write_sep(
+            "=",
+            f"C++ tests with the highest {title}"
+            + (f" (top {count})" if count else ""),
+        )
+        terminalreporter.write_line(f"{'peak RSS':>10} {'CPU time':>10}  test")
+        for nodeid, usage in shown:
+            max_rss = format_size(usage.max_rss) if usage.max_rss is not None else "-"
+            terminalreporter.write_line(
+                f"{max_rss:>10} {usage.cpu_time:>9.3f}s  {nodeid}"
+            )
+
+
+def format_size(size: float) -> str:
+    """Format a size in bytes using the largest suffix which keeps it above 1."""
+    for suffix in ("B", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.1f}{suffix}" if suffix != "B" else f"{size:.0f}B"
+        size /= 1024
+    return f"{size:.1f}T"
 
 
 class CppFile(pytest.File):
@@ -131,6 +1261,20 @@ class CppFile(pytest.File):
         super().__init__(path=path, parent=parent, **kwargs)
         self.facade = facade
         self._arguments = arguments
+        self._batches: list[list[str]] | None = None
+        self._batch_indexes: dict[str, int] = {}
+        self._batches_done: set[int] = set()
+        self._batch_results: dict[str, CppTestResult] = {}
+        # share of the time spent running each batch, for each of its tests
+        self._batch_run_times: dict[str, float] = {}
+        # resources used by the tests of the batches (see ``CppItem.get_resources``)
+        self._batch_resources: dict[str, Resources] = {}
+        # share of the resource usage of the processes which ran each batch
+        self._batch_usages: dict[str, ProcessUsage | None] = {}
+        # True if only the tests which failed in the last run were collected (--lf)
+        self._last_failed_only = False
+        # all the tests of the executable, once collected
+        self._test_ids: frozenset[str] = frozenset()
 
     @classmethod
     def from_parent(  # type: ignore[override]
@@ -147,11 +1291,31 @@ class CppFile(pytest.File):
         )
 
     def collect(self) -> Iterator[CppItem]:
-        harness_collect = self.config.getini("cpp_harness_collect")
-        for test_id in self.facade.list_tests(
-            str(self.fspath),
-            harness_collect=harness_collect,
-        ):
+        prefetcher = self.config.stash.get(_prefetcher_key, None)
+        try:
+            test_ids = (
+                prefetcher.pop_tests(self.path) if prefetcher is not None else None
+            )
+            if test_ids is None:
+                test_ids = list_tests(
+                    self.facade,
+                    str(self.fspath),
+                    self.config.getini("cpp_harness_collect"),
+                    self.config.stash.get(_collection_cache_key, None),
+                    get_timeout(self.config, "cpp_collect_timeout"),
+                )
+        except subprocess.TimeoutExpired as e:
+            raise self.CollectError(get_collect_timeout_message(e)) from e
+        self._test_ids = frozenset(test_ids)
+        # with --lf, only create the items which failed, unless the executable was given
+        # explicitly (pytest then keeps all its items)
+        last_failed = self.config.stash.get(_last_failed_key, {}).get(self.path)
+        if last_failed is not None and not self.session.isinitpath(self.path):
+            selected = [x for x in test_ids if x in last_failed]
+            if selected:
+                test_ids = selected
+                self._last_failed_only = True
+        for test_id in test_ids:
             yield CppItem.from_parent(
                 parent=self,
                 name=test_id,
@@ -159,6 +1323,256 @@ class CppFile(pytest.File):
                 arguments=self._arguments,
             )
 
+    def uses_batches(self) -> bool:
+        return self.facade.supports_batch and (
+            self.facade.batch_only or self._get_batch_size() != 1
+        )
+
+    def _get_batch_size(self) -> int:
+        if splits_executables(self.config):
+            # the other tests of a batch might have been given to other workers
+            return 1
+        batch_size = get_batch_size(self.config)
+        if batch_size == 1 and self._last_failed_only:
+            # run the tests which failed in the last run in a single invocation
+            return 0
+        return batch_size
+
+    def get_batch_index(self, item: CppItem) -> int:
+        """
+        Return the index of the batch of the given item.
+
+        The selected items of this file are split in batches of ``cpp_batch_size`` items
+        in the order they will run, the first time this is called.
+        """
+        if self._batches is None:
+            items = [
+                x
+                for x in self.session.items
+                if isinstance(x, CppItem) and x.parent is self and not x.is_cached()
+            ]
+            names = [x.name for x in items]
+            self._batch_resources = {x.name: x.get_resources() for x in items}
+            batch_size = self._get_batch_size() or len(names) or 1
+            self._batches = [
+                names[i : i + batch_size] for i in range(0, len(names), batch_size)
+            ]
+            self._batch_indexes = {
+                name: index
+                for index, batch in enumerate(self._batches)
+                for name in batch
+            }
+        index = self._batch_indexes.get(item.name)
+        if index is None:
+            # item which is not part of the session items
+            self._batch_resources[item.name] = item.get_resources()
+            self._batches.append([item.name])
+            index = self._batch_indexes[item.name] = len(self._batches) - 1
+        return index
+
+    def run_batch(self, index: int) -> None:
+        """Run the tests of the given batch, unless they already ran."""
+        assert self._batches is not None
+        if index in self._batches_done:
+            return
+        self._batches_done.add(index)
+        test_ids = self._batches[index]
+        # the tests of a batch run one after the other
+        resources = [self._batch_resources.get(x, Resources()) for x in test_ids]
+        budget = self.config.stash[_resource_budget_key]
+        with budget.acquire(
+            Resources(max(x.cpus for x in resources), max(x.memory for x in resources))
+        ):
+            start = time.perf_counter()
+            # the CPU time limit applies to each test, which run one after the other
+            max_cpu_time = get_float_ini(self.config, "cpp_max_cpu_time")
+            with tracked_usage(max_cpu_time * len(test_ids) or None) as usages:
+                results, output, error = self._run_recovering(test_ids)
+        run_time = (time.perf_counter() - start) / len(test_ids)
+        # the peak RSS of a batch is shared by all its tests, while its CPU time is split
+        usage = combine_usages(usages)
+        if usage is not None:
+            usage = ProcessUsage(
+                usage.max_rss,
+                usage.user_time / len(test_ids),
+                usage.system_time / len(test_ids),
+            )
+        for test_id in test_ids:
+            self._batch_run_times[test_id] = run_time
+            self._batch_usages[test_id] = usage
+            if test_id in results:
+                result = results[test_id]
+            elif error is not None:
+                result = CppTestResult([error], output=output)
+            else:
+                msg = "Internal Error: could not find test {test_id} in results:\n{results}"
+                failure = CppMessageFailure(
+                    msg.format(test_id=test_id, results="\n".join(results))
+                )
+                result = CppTestResult([failure], output=output)
+            failed = bool(result.failures) or bool(
+                check_usage(self.config, test_id, usage)
+            )
+            result.output = keep_output(
+                self.config, self.path, test_id, result.output, failed
+            )
+            self._batch_results[test_id] = result
+
+    def pop_batch_result(
+        self, item: CppItem
+    ) -> tuple[CppTestResult, float, ProcessUsage | None]:
+        """
+        Return the result of the given item, after its batch ran (see ``run_batch``), and
+        its share of the time and resources spent running the batch.
+        """
+        result = self._batch_results.pop(item.name, None)
+        if result is None:
+            # the item is running again (for example, by a plugin which re-runs failed tests)
+            assert self._batches is not None
+            self._batches.append([item.name])
+            self.run_batch(len(self._batches) - 1)
+            result = self._batch_results.pop(item.name)
+        return (
+            result,
+            self._batch_run_times.pop(item.name),
+            self._batch_usages.pop(item.name, None),
+        )
+
+    def _run_recovering(
+        self,
+        test_ids: Sequence[str],
+        run: tuple[dict[str, CppTestResult], str, CppTestFailure | None] | None = None,
+    ) -> tuple[dict[str, CppTestResult], str, CppTestFailure | None]:
+        """
+        Run the given tests, recovering from crashes of the executable (or timeouts), which
+        would otherwise fail all the tests which did not run.
+
+        When the results include the tests which finished before the crash, along with the
+        test which was running (as when Google Test streams its results), the tests which did
+        not run are run again. Otherwise the test to blame is not known, so the tests are split in
+        halves which are run separately, until the tests which crash run on their own.
+
+        When both halves fail in the same way without any results, the executable fails
+        whatever tests it runs (for example when a shared library is missing), so the error
+        is given to all the tests instead of running smaller splits.
+
+        ``run`` is the result of running the given tests, if they already ran.
+        """
+        results, output, error = run if run is not None else self._run_batch(test_ids)
+        missing = [x for x in test_ids if x not in results]
+        if error is None or not missing or len(test_ids) == 1:
+            return results, output, error
+
+        splits: list[
+            tuple[
+                Sequence[str],
+                tuple[dict[str, CppTestResult], str, CppTestFailure | None] | None,
+            ]
+        ]
+        if results:
+            splits = [(missing, None)]
+        else:
+            middle = len(missing) // 2
+            halves = [missing[:middle], missing[middle:]]
+            runs = [self._run_batch(x) for x in halves]
+            if all(
+                not x_results and is_same_error(error, output, x_error, x_output)
+                for x_results, x_output, x_error in runs
+            ):
+                return {}, "".join([output, *(x[1] for x in runs)]), error
+            splits = list(zip(halves, runs))
+        outputs = [output]
+        for split, split_run in splits:
+            split_results, split_output, split_error = self._run_recovering(
+                split, split_run
+            )
+            outputs.append(split_output)
+            results.update(split_results)
+            if split_error is not None:
+                for test_id in split:
+                    if test_id not in split_results:
+                        results[test_id] = CppTestResult(
+                            [split_error], output=split_output
+                        )
+        return results, "".join(outputs), None
+
+    def _run_batch(
+        self, test_ids: Sequence[str]
+    ) -> tuple[dict[str, CppTestResult], str, CppTestFailure | None]:
+        """
+        Run the given tests, split in concurrent shards if requested, merging the results.
+        """
+        shards = get_shards(self.config) if self.facade.supports_shards else 1
+        shards = min(shards, len(test_ids))
+        all_tests = self._test_ids == frozenset(test_ids)
+
+        def run(shard: tuple[int, int] | None) -> tuple[
+            dict[str, CppTestResult],
+            str,
+            CppTestFailure | None,
+        ]:
+            with profiled_node(str(self.fspath)):
+                return self.facade.run_tests(
+                    str(self.fspath),
+                    test_ids,
+                    self._arguments,
+                    harness=self.config.getini("cpp_harness"),
+                    shard=shard,
+                    timeout=get_batch_timeout(self.config, len(test_ids)),
+                    all_tests=all_tests,
+                )
+
+        if shards == 1:
+            return run(None)
+
+        processes = ProcessTracker()
+
+        def run_shard(index: int) -> tuple[
+            dict[str, CppTestResult],
+            str,
+            CppTestFailure | None,
+        ]:
+            with processes.tracking():
+                return run((index, shards))
+
+        with ThreadPoolExecutor(max_workers=shards) as executor:
+            # the shards run in the context of this thread, which tracks their usage
+            futures = [
+                executor.submit(contextvars.copy_context().run, run_shard, i)
+                for i in range(shards)
+            ]
+            try:
+                runs = [x.result() for x in futures]
+            except BaseException:
+                # the other shards are not waited for, as when pytest is interrupted
+                processes.kill()
+                raise
+        results: dict[str, CppTestResult] = {}
+        error = None
+        for shard_results, _, shard_error in runs:
+            results.update(shard_results)
+            error = error or shard_error
+        return results, "".join(x[1] for x in runs), error
+
+
+class CppErrorFile(pytest.File):
+    """
+    Executable which could not be checked for tests, reported as a collection error.
+    """
+
+    def __init__(self, *, message: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._message = message
+
+    @classmethod
+    def from_parent(  # type: ignore[override]
+        cls, *, parent: pytest.Collector, path: Path, message: str
+    ) -> CppErrorFile:
+        return super().from_parent(parent=parent, path=path, message=message)
+
+    def collect(self) -> Iterator[CppItem]:
+        raise self.CollectError(self._message)
+
 
 class CppItem(pytest.Item):
     def __init__(
@@ -173,6 +1587,8 @@ class CppItem(pytest.Item):
         pytest.Item.__init__(self, name, parent, **kwargs)
         self.facade = facade
         self._arguments = arguments
+        self._result_cache_key: str | None = None
+        self._cached: bool | None = None
 
     @classmethod
     def from_parent(  # type: ignore[override]
@@ -188,13 +1604,109 @@ class CppItem(pytest.Item):
             name=name, parent=parent, facade=facade, arguments=arguments, **kwargs
         )
 
+    def is_cached(self) -> bool:
+        """
+        Return True if this test passed in a previous session and nothing which might change
+        its outcome changed since then (see ``ResultCache``), so it doesn't need to run again.
+        """
+        if self._cached is None:
+            cache = self.config.stash.get(_result_cache_key, None)
+            if cache is not None:
+                self._result_cache_key = cache.get_key(
+                    str(self.fspath),
+                    self.name,
+                    self._arguments,
+                    self.config.getini("cpp_harness"),
+                )
+            self._cached = (
+                cache is not None
+                and self._result_cache_key is not None
+                and cache.is_passed(self._result_cache_key)
+            )
+        return self._cached
+
+    def get_resources(self) -> Resources:
+        """
+        Return the resources used by this test, given by its ``cpp_resources`` marker, or
+        else by the first line of the ``cpp_resources`` option which matches it.
+        """
+        marker = self.get_closest_marker("cpp_resources")
+        if marker is not None:
+            try:
+                return parse_resources(
+                    [f"{name}={value}" for name, value in marker.kwargs.items()]
+                )
+            except ValueError as e:
+                raise pytest.UsageError(
+                    f"invalid cpp_resources marker of {self.nodeid}: {e}"
+                )
+        executable = self.path.name
+        for pattern, resources in self.config.stash.get(_resource_rules_key, []):
+            if "::" in pattern:
+                if fnmatch(f"{executable}::{self.name}", pattern):
+                    return resources
+            elif fnmatch(executable, pattern):
+                return resources
+        return Resources()
+
+    def get_work(self) -> tuple[Hashable, Callable[[], Any]]:
+        """
+        Return a tuple of (key, function) which runs this item, where items with the same key
+        share the same work (for example all items of the same batch).
+        """
+        parent = self.parent
+        if isinstance(parent, CppFile) and parent.uses_batches():
+            index = parent.get_batch_index(self)
+            return (parent.nodeid, index), functools.partial(parent.run_batch, index)
+        return self.nodeid, self._run_test
+
+    def _run_test(
+        self,
+    ) -> tuple[
+        Sequence[CppTestFailure] | None, str, float | None, float, ProcessUsage | None
+    ]:
+        budget = self.config.stash[_resource_budget_key]
+        max_cpu_time = get_float_ini(self.config, "cpp_max_cpu_time") or None
+        with budget.acquire(self.get_resources()), tracked_usage(
+            max_cpu_time
+        ) as usages:
+            start = time.perf_counter()
+            with profiled_node(str(self.fspath), self.name):
+                failures, output, duration = self.facade.run_test(
+                    str(self.fspath),
+                    self.name,
+                    self._arguments,
+                    harness=self.config.getini("cpp_harness"),
+                    timeout=get_batch_timeout(self.config, 1),
+                )
+            run_time = time.perf_counter() - start
+        usage = combine_usages(usages)
+        failed = bool(failures) or bool(check_usage(self.config, self.name, usage))
+        output = keep_output(self.config, self.path, self.name, output, failed)
+        return failures, output, duration, run_time, usage
+
     def runtest(self) -> None:
-        failures, output = self.facade.run_test(
-            str(self.fspath),
-            self.name,
-            self._arguments,
-            harness=self.config.getini("cpp_harness"),
-        )
+        if self.is_cached():
+            if _CACHED_PROPERTY not in self.user_properties:
+                self.user_properties.append(_CACHED_PROPERTY)
+            return
+
+        key, work = self.get_work()
+        runner = self.config.stash.get(_runner_key, None)
+        outcome = runner.run(key, work) if runner is not None else work()
+        if isinstance(self.parent, CppFile) and self.parent.uses_batches():
+            result, run_time, usage = self.parent.pop_batch_result(self)
+            self._add_duration_properties(result.duration, run_time)
+            self._add_usage_properties(usage)
+            self._add_properties(result.properties)
+            if result.skipped is not None and not result.failures:
+                pytest.skip(result.skipped)
+            failures, output = result.failures, result.output
+        else:
+            failures, output, duration, run_time, usage = outcome
+            self._add_duration_properties(duration, run_time)
+            self._add_usage_properties(usage)
+        failures = [*(failures or []), *check_usage(self.config, self.name, usage)]
         # Report the c++ output in its own sections
         self.add_report_section("call", "c++", output)
 
@@ -204,11 +1716,51 @@ class CppItem(pytest.Item):
         if failures:
             raise CppFailureError(failures)
 
+        cache = self.config.stash.get(_result_cache_key, None)
+        if cache is not None and self._result_cache_key is not None:
+            cache.set_passed(self._result_cache_key, self.name)
+
+    def _add_duration_properties(self, duration: float | None, run_time: float) -> None:
+        """
+        Attach the duration of the test measured by the framework ("cpp_duration"), if known,
+        and the rest of the time spent running it ("cpp_overhead") to the test report.
+        """
+        # the item might run more than once
+        self.user_properties[:] = [
+            x for x in self.user_properties if x[0] not in _DURATION_PROPERTIES
+        ]
+        if duration is not None:
+            self.user_properties.append(("cpp_duration", duration))
+        self.user_properties.append(
+            ("cpp_overhead", max(run_time - (duration or 0), 0))
+        )
+
+    def _add_usage_properties(self, usage: ProcessUsage | None) -> None:
+        """
+        Attach the peak RSS in bytes ("cpp_max_rss") and the CPU time in seconds
+        ("cpp_user_time" and "cpp_system_time") of the test to the test report, if known.
+        """
+        self.user_properties[:] = [
+            x for x in self.user_properties if x[0] not in _USAGE_PROPERTIES
+        ]
+        if usage is not None:
+            self.user_properties.extend(
+                (name, value)
+                for name, value in zip(_USAGE_PROPERTIES, usage)
+                if value is not None
+            )
+
+    def _add_properties(self, properties: Sequence[tuple[str, object]]) -> None:
+        """Attach the given properties reported by the facade to the test report."""
+        names = {name for name, _ in properties}
+        self.user_properties[:] = [x for x in self.user_properties if x[0] not in names]
+        self.user_properties.extend(properties)
+
     def repr_failure(  # type: ignore[override]
         self, excinfo: pytest.ExceptionInfo[BaseException]
     ) -> str | TerminalRepr | CppFailureRepr:
         if isinstance(excinfo.value, CppFailureError):
-            return CppFailureRepr(excinfo.value.failures)
+            return CppFailureRepr(excinfo.value.failures, str(self.fspath), self.name)
         return pytest.Item.repr_failure(self, excinfo)
 
     def reportinfo(self) -> tuple[Any, int, str]:
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import NamedTuple
+from typing import Sequence
+
+if sys.platform == "win32":
+    import ctypes
+    import msvcrt
+else:
+    import fcntl
+    import resource
+
+# Multipliers of the suffixes of memory sizes.
+_SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+# Unit of ru_maxrss in bytes: bytes on macOS, and kilobytes elsewhere.
+_MAX_RSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+# Longest time to wait before checking again whether resources became available.
+_MAX_POLL_INTERVAL = 0.5
+
+# Windows constants used to check whether processes are running.
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_ERROR_ACCESS_DENIED = 5
+_STILL_ACTIVE = 259
+
+# Usage of the processes run by the current thread, when tracked (see ``tracked_usage``).
+_usages: ContextVar[list[ProcessUsage] | None] = ContextVar(
+    "pytest_cpp_usages", default=None
+)
+
+# Seconds of CPU time after which the processes run by the current thread are killed.
+_cpu_time_limit: ContextVar[float | None] = ContextVar(
+    "pytest_cpp_cpu_time_limit", default=None
+)
+
+
+class Resources(NamedTuple):
+    """CPUs and memory (in bytes) used by a test, or available to all tests."""
+
+    cpus: float = 0
+    memory: int = 0
+
+    def fits(self, used: Resources, budget: Resources) -> bool:
+        return (
+            used.cpus + self.cpus <= budget.cpus
+            and used.memory + self.memory <= budget.memory
+        )
+
+
+def parse_size(text: str) -> int:
+    """Parse a memory size in bytes, with an optional K, M, G or T suffix (powers of 1024)."""
+    text = text.strip().upper().rstrip("B")
+    multiplier = _SIZE_SUFFIXES.get(text[-1:], 1)
+    if text[-1:] in _SIZE_SUFFIXES:
+        text = text[:-1]
+    size = float(text) * multiplier
+    if not math.isfinite(size) or size < 0:
+        raise ValueError(f"invalid size: {text!r}")
+    return int(size)
+
+
+def parse_resources(args: Sequence[str], default: Resources = Resources()) -> Resources:
+    """
+    Parse resources given as "cpus=N" and "memory=SIZE" arguments, the missing ones being
+    taken from ``default``, raising ``ValueError`` if they are invalid.
+    """
+    cpus, memory = default
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if name == "cpus" and sep:
+            cpus = float(value)
+            if not math.isfinite(cpus) or cpus < 0:
+                raise ValueError(f"invalid number of cpus: {value!r}")
+        elif name == "memory" and sep:
+            memory = parse_size(value)
+        else:
+            raise ValueError(f'expected "cpus=N" or "memory=SIZE", got: {arg!r}')
+    return Resources(cpus, memory)
+
+
+class ProcessUsage(NamedTuple):
+    """
+    Peak RSS (in bytes, None if unknown, see ``from_rusage``) and CPU time (in seconds)
+    used by processes.
+    """
+
+    max_rss: int | None = None
+    user_time: float = 0.0
+    system_time: float = 0.0
+
+    @property
+    def cpu_time(self) -> float:
+        return self.user_time + self.system_time
+
+    @classmethod
+    def from_rusage(cls, rusage: Any, min_max_rss: int = 0) -> ProcessUsage:
+        """
+        Return the usage of a process given by ``os.wait4``.
+
+        On Linux, the peak RSS of a process includes the peak RSS of the process which
+        started it (like pytest), so peaks up to ``min_max_rss`` (see ``get_own_max_rss``)
+        are not known.
+        """
+        max_rss = rusage.ru_maxrss * _MAX_RSS_SCALE
+        return cls(
+            max_rss if max_rss > min_max_rss else None,
+            rusage.ru_utime,
+            rusage.ru_stime,
+        )
+
+
+def get_own_max_rss() -> int:
+    """Return the peak RSS of the current process in bytes, or 0 if unknown."""
+    if sys.platform == "win32":
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAX_RSS_SCALE
+
+
+def combine_usages(usages: Iterable[ProcessUsage]) -> ProcessUsage | None:
+    """
+    Return the usage of processes which ran one after the other (the largest peak RSS and
+    the total CPU time), or None if there are none.
+    """
+    usages = list(usages)
+    if not usages:
+        return None
+    max_rss = [x.max_rss for x in usages if x.max_rss is not None]
+    return ProcessUsage(
+        max(max_rss) if max_rss else None,
+        sum(x.user_time for x in usages),
+        sum(x.system_time for x in usages),
+    )
+
+
+@contextlib.contextmanager
+def tracked_usage(
+    cpu_time_limit: float | None = None,
+) -> Iterator[list[ProcessUsage]]:
+    """
+    Collect the usage of the processes run by the current thread (with
+    ``helpers.run_process``) in the given list, killing them if they use more than
+    ``cpu_time_limit`` seconds of CPU time.
+    """
+    usages: list[ProcessUsage] = []
+    token = _usages.set(usages)
+    limit_token = _cpu_time_limit.set(cpu_time_limit)
+    try:
+        yield usages
+    finally:
+        _cpu_time_limit.reset(limit_token)
+        _usages.reset(token)
+
+
+def is_tracking_usage() -> bool:
+    return _usages.get() is not None
+
+
+def record_usage(rusage: Any, min_max_rss: int = 0) -> None:
+    """
+    Record the usage of a process reaped by ``os.wait4`` (see ``ProcessUsage.from_rusage``),
+    if usage is being tracked and ``rusage`` is not None.
+    """
+    usages = _usages.get()
+    if usages is not None and rusage is not None:
+        usages.append(ProcessUsage.from_rusage(rusage, min_max_rss))
+
+
+def get_cpu_time_limit() -> int | None:
+    """
+    Return the CPU time limit given to ``tracked_usage`` in whole seconds, as applied to
+    the RLIMIT_CPU of processes, or None if there is no limit.
+    """
+    limit = _cpu_time_limit.get()
+    if limit is None or sys.platform == "win32":
+        return None
+    return max(math.ceil(limit), 1)
+
+
+def limit_cpu_time(args: Sequence[str], seconds: int) -> list[str]:
+    """
+    Return the given command line, wrapped by a shell which sets the RLIMIT_CPU of the
+    process to the given seconds when it can't be set once started (see
+    ``set_cpu_time_limit``).
+    """
+    if sys.platform == "win32" or hasattr(resource, "prlimit"):
+        return list(args)
+    return ["/bin/sh", "-c", f'ulimit -t {seconds} && exec "$@"', "sh", *args]
+
+
+def set_cpu_time_limit(pid: int, seconds: int) -> None:
+    """
+    Set the RLIMIT_CPU of the given process, just started, to the given seconds where
+    supported (Linux): the process receives SIGXCPU when reaching them, and SIGKILL a
+    second later.
+    """
+    if sys.platform == "win32" or not hasattr(resource, "prlimit"):
+        return
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (seconds, seconds + 1))
+    except ProcessLookupError:
+        # the process already exited
+        pass
+
+
+def get_total_memory() -> int:
+    """Return the physical memory of the machine in bytes, or 0 if unknown."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def get_machine_resources() -> Resources:
+    """Return the CPUs and memory of the machine, unknown memory being unlimited."""
+    return Resources(os.cpu_count() or 1, get_total_memory() or sys.maxsize)
+
+
+def is_process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        # signals can't be used to check processes on Windows
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # processes of other users can't be opened
+            return ctypes.get_last_error() == _ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == _STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on the given file, shared by all processes of the machine."""
+    with open(path, "a+b") as f:
+        if sys.platform == "win32":
+            f.seek(0)
+            # retries for 10 seconds before failing
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if sys.platform == "win32":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class ResourceBudget:
+    """
+    Semaphore for the CPUs and memory used by tests, shared by all the pytest processes
+    of the machine (like the workers of pytest-xdist) which use the same ``directory``.
+
+    The resources held by each test are recorded in a JSON file, which is only read and
+    written while holding a lock on a file next to it. Resources held by processes which
+    exited without releasing them are reclaimed.
+    """
+
+    def __init__(self, directory: Path, budget: Resources) -> None:
+        self.directory = directory
+        self.budget = budget
+
+    def _update(self, update: Callable[[dict[str, list[Any]]], bool]) -> bool:
+        """
+        Call ``update`` with the holders of resources (by token) while holding the lock,
+        writing them back if it returns True, and return what it returned.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state_path = self.directory / "budget.json"
+        with _locked(self.directory / "budget.lock"):
+            try:
+                holders = json.loads(state_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                holders = {}
+            if not isinstance(holders, dict):
+                holders = {}
+            holders = {
+                token: holder
+                for token, holder in holders.items()
+                if is_process_alive(holder[0])
+            }
+            changed: bool = update(holders)
+            if changed:
+                state_path.write_text(json.dumps(holders), encoding="utf-8")
+            return changed
+
+    def try_acquire(self, resources: Resources, token: str) -> bool:
+        """
+        Hold the given resources if they are available, returning True if they were.
+
+        Resources larger than the budget are clamped to it, so they are acquired once no
+        other test holds any.
+        """
+        resources = Resources(
+            min(resources.cpus, self.budget.cpus),
+            min(resources.memory, self.budget.memory),
+        )
+
+        def update(holders: dict[str, list[Any]]) -> bool:
+            used = Resources(
+                sum(x[1] for x in holders.values()),
+                sum(x[2] for x in holders.values()),
+            )
+            if not resources.fits(used, self.budget):
+                return False
+            holders[token] = [os.getpid(), resources.cpus, resources.memory]
+            return True
+
+        return self._update(update)
+
+    def release(self, token: str) -> None:
+        self._update(lambda holders: holders.pop(token, None) is not None)
+
+    @contextlib.contextmanager
+    def acquire(self, resources: Resources) -> Iterator[None]:
+        """Wait until the given resources are available, holding them within the block."""
+        if not resources.cpus and not resources.memory:
+            yield
+            return
+        token = f"{os.getpid()}-{uuid.uuid4().hex}"
+        interval = 0.01
+        while not self.try_acquire(resources, token):
+            time.sleep(interval)
+            interval = min(interval * 2, _MAX_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.release(token)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Hashable
+
+from pytest_cpp.helpers import ProcessTracker
+
+
+class ParallelRunner:
+    """
+    Runs C++ tests concurrently using a pool of threads, ahead of pytest's runtest protocol,
+    which then only waits for the result of each item, reporting them in the usual order.
+
+    Each piece of work is identified by a key, so items which share the same work (like the
+    items of a batch) run it only once. Only a few works are started ahead of the one pytest
+    is waiting for, to avoid keeping too many results in memory.
+
+    When shut down, the processes of the works still running are killed.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="pytest-cpp-run"
+        )
+        self._ahead = jobs * 2
+        self._works: list[tuple[Hashable, Callable[[], Any]]] = []
+        self._positions: dict[Hashable, int] = {}
+        self._submitted = 0
+        self._futures: dict[Hashable, Future[Any]] = {}
+        self._processes = ProcessTracker()
+
+    def add(self, key: Hashable, work: Callable[[], Any]) -> None:
+        """Add a work, in the order pytest will ask for their results."""
+        if key not in self._positions:
+            self._positions[key] = len(self._works)
+            self._works.append((key, work))
+
+    def run(self, key: Hashable, work: Callable[[], Any]) -> Any:
+        """
+        Return the result of the given work, starting the works which come after it.
+
+        Works which were not added, or whose result was already obtained, run in the
+        calling thread.
+        """
+        position = self._positions.get(key)
+        if position is not None:
+            end = min(position + 1 + self._ahead, len(self._works))
+            while self._submitted < end:
+                next_key, next_work = self._works[self._submitted]
+                self._futures[next_key] = self._executor.submit(
+                    self._run_tracked, next_work
+                )
+                self._submitted += 1
+        future = self._futures.pop(key, None)
+        if future is None:
+            return work()
+        return future.result()
+
+    def _run_tracked(self, work: Callable[[], Any]) -> Any:
+        with self._processes.tracking():
+            return work()
+
+    def shutdown(self) -> None:
+        for future in self._futures.values():
+            future.cancel()
+        # pytest might have been interrupted, so the works left are not waited for
+        self._processes.kill()
+        self._executor.shutdown(wait=True)
@@ -4,18 +4,18 @@ import pytest
 @pytest.mark.parametrize(
     "name, passed, failed",
     [
-        ("unit_test_example_01", 0, 1),
+        ("unit_test_example_01", 0, 2),
         ("unit_test_example_02", 0, 1),
-        ("unit_test_example_03", 0, 1),
-        ("unit_test_example_04", 0, 1),
-        ("unit_test_example_05", 0, 1),
-        ("unit_test_example_06", 0, 1),
-        ("unit_test_example_07", 1, 0),
+        ("unit_test_example_03", 0, 2),
+        ("unit_test_example_04", 1, 4),
+        ("unit_test_example_05", 0, 2),
+        ("unit_test_example_06", 0, 2),
+        ("unit_test_example_07", 4, 0),
         ("unit_test_example_08", 0, 1),
         ("unit_test_example_09_1", 1, 0),
         ("unit_test_example_09_2", 1, 0),
         ("unit_test_example_13", 1, 0),
-        ("utest_case_template_example", 0, 1),
+        ("utest_case_template_example", 1, 9),
     ],
 )
 def test_samples(exes, testdir, name, passed, failed):
@@ -41,6 +41,6 @@ def test_example_11(exes, testdir):
         [
             "*something happened*",
             "*check s.substr*",
-            "*1 failed in*",
+            "*3 failed in*",
         ]
     )
@@ -0,0 +1,22 @@
+#include <cstring>
+#include <benchmark/benchmark.h>
+
+static void BM_memcpy(benchmark::State& state) {
+  char src[1024] = {};
+  char dst[1024];
+  for (auto _ : state) {
+    memcpy(dst, src, state.range(0));
+    benchmark::DoNotOptimize(dst);
+  }
+  state.counters["bytes"] = state.range(0);
+}
+BENCHMARK(BM_memcpy)->Arg(8)->Arg(64)->Iterations(100);
+
+static void BM_error(benchmark::State& state) {
+  state.SkipWithError("could not set up the benchmark");
+  for (auto _ : state) {
+  }
+}
+BENCHMARK(BM_error)->Iterations(100);
+
+BENCHMARK_MAIN();
@@ -0,0 +1,299 @@
+"""
+Measures the overhead of pytest-cpp using the synthetic executables built by the
+SConscript in this directory ("scons -C tests benchmarks=1"), writing the results to
+a JSON file which can be compared with the results of another run:
+
+    python tests/benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+For each executable, measures:
+
+* the time to run all its tests directly, without pytest ("native_time");
+* the time and peak RSS of ``pytest --collect-only``, minus the time pytest takes to
+  start ("collect_time", "collect_max_rss");
+* the time and peak RSS of running its tests with pytest, for each ``cpp_batch_size``,
+  and the resulting overhead per test compared to running them directly;
+* the throughput of parsing the report of a run of all its tests.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Sequence
+
+import pytest
+
+from pytest_cpp.boost import BoostTestFacade
+from pytest_cpp.catch2 import Catch2Facade
+from pytest_cpp.catch2 import Catch2Version
+from pytest_cpp.google import GoogleTestFacade
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+FRAMEWORKS = ("gtest", "catch2", "boost")
+
+
+def get_report_args(framework: str, report: str) -> list[str]:
+    """Return the arguments which make executables of the given framework write a report."""
+    if framework == "gtest":
+        return [f"--gtest_output=xml:{report}"]
+    if framework == "catch2":
+        return ["--success", "--reporter=xml", f"--out={report}", "--durations", "yes"]
+    return [
+        "--output_format=XML",
+        "--log_level=test_suite",
+        f"--log_sink={report}",
+    ]
+
+
+def get_report_parser(framework: str) -> Callable[[Any], Sequence[Any]]:
+    """Return the function used by pytest-cpp to parse the reports of the given framework."""
+    if framework == "gtest":
+        return GoogleTestFacade()._parse_xml
+    if framework == "catch2":
+        facade = Catch2Facade(Catch2Version.V2)
+        return lambda f: facade._parse_xml(f, Catch2Version.V2)
+    return lambda f: BoostTestFacade()._parse_log_by_test_case(f)[0]
+
+
+def measure(args: Sequence[str], cwd: Path) -> tuple[float, int | None, int]:
+    """
+    Run the given command, returning the time it took, its peak RSS in bytes (if known)
+    and its return code.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if not hasattr(os, "wait4"):
+        returncode = process.wait()
+        return time.perf_counter() - start, None, returncode
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    # the process was reaped by wait4
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    # ru_maxrss is in bytes on macOS, and kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return elapsed, rusage.ru_maxrss * scale, process.returncode
+
+
+def measure_best(
+    args: Sequence[str], cwd: Path, repeat: int
+) -> tuple[float, int | None, int]:
+    """Like ``measure``, returning the fastest of ``repeat`` runs."""
+    return min((measure(args, cwd) for _ in range(repeat)), key=lambda x: x[0])
+
+
+def pytest_args(*args: str) -> list[str]:
+    return [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", *args]
+
+
+def benchmark_executable(
+    framework: str,
+    count: int,
+    executable: Path,
+    work_dir: Path,
+    baseline: float,
+    batch_sizes: Sequence[int],
+    max_unbatched: int,
+    repeat: int,
+) -> dict[str, Any]:
+    result: dict[str, Any] = {
+        "framework": framework,
+        "tests": count,
+        "executable": executable.name,
+    }
+
+    report = work_dir / f"{executable.name}.xml"
+    native_time, _, _ = measure_best(
+        [str(executable), *get_report_args(framework, str(report))], work_dir, repeat
+    )
+    result["native_time"] = native_time
+
+    parse = get_report_parser(framework)
+    parse_time = float("inf")
+    for _ in range(repeat):
+        with open(report, "rb") as f:
+            start = time.perf_counter()
+            parsed = parse(f)
+            parse_time = min(parse_time, time.perf_counter() - start)
+    report_size = report.stat().st_size
+    result["parse"] = {
+        "report_size": report_size,
+        "parsed_tests": len(parsed),
+        "time": parse_time,
+        "tests_per_second": len(parsed) / parse_time if parse_time else None,
+        "bytes_per_second": report_size / parse_time if parse_time else None,
+    }
+
+    collect_time, collect_rss, _ = measure_best(
+        pytest_args("--collect-only", str(executable)), work_dir, repeat
+    )
+    result["collect_time"] = max(collect_time - baseline, 0)
+    result["collect_max_rss"] = collect_rss
+
+    runs = []
+    for batch_size in batch_sizes:
+        if batch_size == 1 and count > max_unbatched:
+            continue
+        run_time, run_rss, returncode = measure_best(
+            pytest_args("-o", f"cpp_batch_size={batch_size}", str(executable)),
+            work_dir,
+            repeat,
+        )
+        runs.append(
+            {
+                "batch_size": batch_size,
+                "time": run_time,
+                "max_rss": run_rss,
+                "overhead_per_test": max(run_time - baseline - native_time, 0) / count,
+                "returncode": returncode,
+            }
+        )
+    result["runs"] = runs
+    return result
+
+
+def find_executables(
+    frameworks: Sequence[str], sizes: Sequence[int] | None
+) -> list[tuple[str, int, Path]]:
+    """Return the (framework, number of tests, path) of the executables which were built."""
+    executables = []
+    for framework in frameworks:
+        prefix = f"bench_{framework}_"
+        for path in BENCHMARKS_DIR.glob(prefix + "*"):
+            count = path.name[len(prefix) :]
+            if path.suffix == ".exe":
+                count = count[: -len(".exe")]
+            if not count.isdigit() or (sizes and int(count) not in sizes):
+                continue
+            executables.append((framework, int(count), path))
+    return sorted(executables, key=lambda x: (FRAMEWORKS.index(x[0]), x[1]))
+
+
+def compare(results: dict[str, Any], previous: dict[str, Any]) -> None:
+    """Print the ratio between the given results and the previous ones."""
+
+    def flatten(data: dict[str, Any]) -> dict[tuple[str, int, str], float]:
+        metrics = {}
+        for entry in data["results"]:
+            key = entry["framework"], entry["tests"]
+            metrics[(*key, "native_time")] = entry["native_time"]
+            metrics[(*key, "collect_time")] = entry["collect_time"]
+            metrics[(*key, "parse_time")] = entry["parse"]["time"]
+            for run in entry["runs"]:
+                name = f"overhead_per_test[batch_size={run['batch_size']}]"
+                metrics[(*key, name)] = run["overhead_per_test"]
+        return metrics
+
+    current_metrics = flatten(results)
+    previous_metrics = flatten(previous)
+    print(f"{'before':>12} {'after':>12} {'ratio':>7}  metric")
+    for key, value in current_metrics.items():
+        old = previous_metrics.get(key)
+        if old is None:
+            continue
+        ratio = f"{value / old:.2f}x" if old else "-"
+        framework, count, name = key
+        print(f"{old:12.6f} {value:12.6f} {ratio:>7}  {framework} ({count} tests) {name}")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--output", default="benchmarks.json", help="JSON file to write the results to"
+    )
+    parser.add_argument(
+        "--compare", metavar="JSON", help="results of a previous run to compare with"
+    )
+    parser.add_argument(
+        "--frameworks",
+        default=",".join(FRAMEWORKS),
+        help="comma separated frameworks to measure (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--sizes", help="comma separated numbers of tests to measure (default: all built)"
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        default="1,0",
+        help="comma separated values of cpp_batch_size to measure (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-unbatched",
+        type=int,
+        default=1000,
+        help="skip cpp_batch_size=1 for executables with more tests (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of times each measurement is taken, keeping the fastest "
+        "(default: %(default)s)",
+    )
+    options = parser.parse_args(argv)
+
+    frameworks = options.frameworks.split(",")
+    sizes = [int(x) for x in options.sizes.split(",")] if options.sizes else None
+    executables = find_executables(frameworks, sizes)
+    if not executables:
+        print("no benchmark executables found, build them with:", file=sys.stderr)
+        print("    scons -C tests benchmarks=1", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(temp_dir)
+        # time pytest takes to start and find nothing to run, subtracted from the measurements
+        baseline, baseline_rss, _ = measure_best(
+            pytest_args("--collect-only", str(work_dir)), work_dir, options.repeat
+        )
+        results = []
+        for framework, count, executable in executables:
+            print(f"{executable.name}...", file=sys.stderr)
+            results.append(
+                benchmark_executable(
+                    framework,
+                    count,
+                    executable,
+                    work_dir,
+                    baseline,
+                    [int(x) for x in options.batch_sizes.split(",")],
+                    options.max_unbatched,
+                    options.repeat,
+                )
+            )
+
+    data = {
+        "metadata": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "pytest": pytest.__version__,
+        },
+        "baseline": {"time": baseline, "max_rss": baseline_rss},
+        "results": results,
+    }
+    with open(options.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    print(f"results written to {options.output}", file=sys.stderr)
+
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as f:
+            compare(data, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+#define CATCH_CONFIG_MAIN
+#define CATCH_CONFIG_ENABLE_BENCHMARKING
+#include "catch.hpp"
+
+static unsigned int Fibonacci(unsigned int n) {
+    return n < 2 ? n : Fibonacci(n - 1) + Fibonacci(n - 2);
+}
+
+TEST_CASE( "Fibonacci" ) {
+    REQUIRE( Fibonacci(10) == 55 );
+
+    BENCHMARK( "Fibonacci 10" ) {
+        return Fibonacci(10);
+    };
+
+    SECTION( "larger" ) {
+        BENCHMARK( "Fibonacci 15" ) {
+            return Fibonacci(15);
+        };
+    }
+}
+
+TEST_CASE( "No benchmarks" ) {
+    REQUIRE( Fibonacci(1) == 1 );
+}
@@ -0,0 +1,32 @@
+#include <cstdlib>
+#include "gtest/gtest.h"
+
+namespace {
+
+TEST(CrashTest, test_success) {
+  EXPECT_EQ(2 * 3, 6);
+}
+
+TEST(CrashTest, test_failure) {
+  EXPECT_EQ(2 * 3, 5);
+}
+
+TEST(CrashTest, test_skipped) {
+  GTEST_SKIP() << "This is a skipped message";
+}
+
+TEST(CrashTest, test_crash) {
+  EXPECT_EQ(2 * 6, 15);
+  std::abort();
+}
+
+TEST(CrashTest, test_not_run) {
+  EXPECT_EQ(2 * 3, 6);
+}
+
+}  // namespace
+
+int main(int argc, char **argv) {
+  ::testing::InitGoogleTest(&argc, argv);
+  return RUN_ALL_TESTS();
+}
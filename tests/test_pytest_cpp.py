@@ -1,17 +1,48 @@
+import contextlib
+import json
+import os
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 from shutil import which
+from xml.etree import ElementTree
 
 import pytest
 
+import pytest_cpp.catch2
+import pytest_cpp.helpers
+import pytest_cpp.plugin
 from pytest_cpp import error
 from pytest_cpp.boost import BoostTestFacade
+from pytest_cpp.boost import is_exact_filter
+from pytest_cpp.boost import make_name_filter
+from pytest_cpp.boost import make_run_test_filters
+from pytest_cpp.boost import parse_list_content
+from pytest_cpp.cache import ResultCache
 from pytest_cpp.catch2 import Catch2Facade
+from pytest_cpp.catch2 import Catch2Version
 from pytest_cpp.error import CppFailureRepr
 from pytest_cpp.error import CppTestFailure
+from pytest_cpp.facade_abc import CppTestResult
 from pytest_cpp.google import GoogleTestFacade
+from pytest_cpp.google import GoogleTestResultStream
+from pytest_cpp.google import split_output
+from pytest_cpp.google_benchmark import GoogleBenchmarkFacade
+from pytest_cpp.google_benchmark import make_filter
+from pytest_cpp.helpers import describe_tests
+from pytest_cpp.helpers import iterparse_elements
 from pytest_cpp.helpers import make_cmdline
+from pytest_cpp.helpers import ReportSinks
+from pytest_cpp.helpers import run_process
+from pytest_cpp.helpers import split_filter
+from pytest_cpp.resources import is_process_alive
+from pytest_cpp.resources import parse_resources
+from pytest_cpp.resources import ResourceBudget
+from pytest_cpp.resources import Resources
+from pytest_cpp.resources import tracked_usage
 
 
 def assert_outcomes(result, expected_outcomes):
@@ -54,9 +85,9 @@ def dummy_failure():
                 "FooTest.test_skipped_no_msg",
             ],
         ),
-        (BoostTestFacade(), "boost_success", ["boost_success"]),
-        (BoostTestFacade(), "boost_error", ["boost_error"]),
-        (BoostTestFacade(), "boost_fixture_setup_error", ["boost_fixture_setup_error"]),
+        (BoostTestFacade(), "boost_success", ["test_success_1", "test_success_2"]),
+        (BoostTestFacade(), "boost_error", ["test_error_1", "test_error_2"]),
+        (BoostTestFacade(), "boost_fixture_setup_error", ["test_dummy"]),
         (
             Catch2Facade(),
             "catch2_success",
@@ -67,6 +98,15 @@ def dummy_failure():
             "catch2_success_v3",
             ["Factorials are computed", "Passed Sections"],
         ),
+        (
+            GoogleBenchmarkFacade(),
+            "benchmark",
+            [
+                "BM_memcpy/8/iterations:100",
+                "BM_memcpy/64/iterations:100",
+                "BM_error/iterations:100",
+            ],
+        ),
     ],
 )
 def test_list_tests(facade, name, expected, exes):
@@ -80,6 +120,7 @@ def test_list_tests(facade, name, expected, exes):
         (GoogleTestFacade(), "gtest", "boost_success"),
         (BoostTestFacade(), "boost_success", "gtest"),
         (Catch2Facade(), "catch2_success", "gtest"),
+        (GoogleBenchmarkFacade(), "benchmark", "gtest"),
     ],
 )
 def test_is_test_suite(facade, name, other_name, exes, tmp_path):
@@ -93,14 +134,108 @@ def test_is_test_suite(facade, name, other_name, exes, tmp_path):
     "facade, name, test_id",
     [
         (GoogleTestFacade(), "gtest", "FooTest.test_success"),
-        (BoostTestFacade(), "boost_success", "<unused>"),
+        (BoostTestFacade(), "boost_success", "test_success_1"),
         (Catch2Facade(), "catch2_success", "Factorials are computed"),
+        (GoogleBenchmarkFacade(), "benchmark", "BM_memcpy/8/iterations:100"),
     ],
 )
 def test_success(facade, name, test_id, exes):
     assert facade.run_test(exes.get(name), test_id)[0] is None
 
 
+@pytest.mark.parametrize(
+    "name, facade_class, catch_version",
+    [
+        ("gtest", GoogleTestFacade, None),
+        ("boost_success", BoostTestFacade, None),
+        ("catch2_success", Catch2Facade, Catch2Version.V2),
+        ("catch2_success_v3", Catch2Facade, Catch2Version.V3),
+        ("benchmark", GoogleBenchmarkFacade, None),
+    ],
+)
+def test_detect_facade(name, facade_class, catch_version, exes, mocker):
+    spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    facade = pytest_cpp.plugin.detect_facade(exes.get(name))
+    assert type(facade) is facade_class
+    assert getattr(facade, "catch_version", None) is catch_version
+    assert spy.call_count == 1
+
+
+def test_detect_facade_not_a_test_suite(exes, tmp_path, mocker):
+    spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    tmp_path.joinpath("foo.txt").touch()
+    assert pytest_cpp.plugin.detect_facade(str(tmp_path.joinpath("foo.txt"))) is None
+    assert spy.call_count == 1
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="ELF executables only")
+@pytest.mark.parametrize(
+    "name, facade_class, catch_version",
+    [
+        ("gtest", GoogleTestFacade, None),
+        ("boost_success", BoostTestFacade, None),
+        ("catch2_success", Catch2Facade, Catch2Version.V2),
+        ("catch2_success_v3", Catch2Facade, Catch2Version.V3),
+        ("benchmark", GoogleBenchmarkFacade, None),
+    ],
+)
+def test_detect_facade_statically(name, facade_class, catch_version, exes):
+    decided, facade = pytest_cpp.plugin.detect_facade_statically(exes.get(name))
+    assert decided
+    assert type(facade) is facade_class
+    assert getattr(facade, "catch_version", None) is catch_version
+    # same as detected with --help
+    expected = pytest_cpp.plugin.detect_facade(exes.get(name))
+    assert facade.get_cache_state() == expected.get_cache_state()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="ELF executables only")
+def test_detect_facade_statically_not_a_test_suite(tmp_path, mocker):
+    # an ELF executable without any markers
+    assert pytest_cpp.plugin.detect_facade_statically(which("true")) == (True, None)
+
+    # not an ELF executable
+    tmp_path.joinpath("foo.sh").write_text("#!/bin/sh\n")
+    assert pytest_cpp.plugin.detect_facade_statically(
+        str(tmp_path.joinpath("foo.sh"))
+    ) == (False, None)
+
+    # markers which are not conclusive
+    mocker.patch.object(
+        pytest_cpp.plugin, "find_markers", return_value={b"_ZN7testing"}
+    )
+    assert pytest_cpp.plugin.detect_facade_statically(which("true")) == (False, None)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="ELF executables only")
+def test_static_detection_option(testdir, exes, mocker):
+    spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    result = testdir.inline_run(
+        exes.get("gtest", "test_gtest"),
+        exes.get("catch2_success_v3", "test_catch2"),
+        "-o",
+        "cpp_static_detection=true",
+    )
+    result.assertoutcome(passed=3, failed=2, skipped=3)
+    assert spy.call_count == 0
+
+
+def test_catch2_probes_help_once(testdir, exes, mocker):
+    detect_spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    catch2_spy = mocker.spy(pytest_cpp.catch2, "get_help_output")
+    result = testdir.inline_run(exes.get("catch2_success", "test_catch2"))
+    result.assertoutcome(passed=2)
+    assert detect_spy.call_count == 1
+    assert catch2_spy.call_count == 0
+
+
+def test_catch2_cache_state():
+    facade = Catch2Facade(Catch2Version.V3)
+    restored = Catch2Facade.from_cache_state(facade.get_cache_state())
+    assert restored.catch_version is Catch2Version.V3
+    assert Catch2Facade.from_cache_state(None).catch_version is None
+
+
 def test_cmdline_builder_happy_flow():
     arg_string = make_cmdline(["wine"], "gtest", ["--help"])
     assert arg_string == ["wine", "gtest", "--help"]
@@ -118,9 +253,110 @@ def test_cmdline_builder_with_empty_args():
     assert arg_string == ["wine", "gtest"]
 
 
+def test_iterparse_elements(tmp_path, monkeypatch):
+    monkeypatch.setattr(pytest_cpp.helpers, "_CHUNK_SIZE", 16)
+    xml = tmp_path.joinpath("report.xml")
+    test_cases = "".join(
+        f'<testcase name="test_{i}"><passed/><failure>{i}</failure></testcase>'
+        for i in range(100)
+    )
+    xml.write_text(
+        f'<testsuites><testsuite name="Foo">{test_cases}<properties/></testsuite>'
+        "</testsuites>"
+    )
+    seen = []
+    for elem, ancestors in iterparse_elements(str(xml), {"testcase"}):
+        assert [x.tag for x in ancestors] == ["testsuites", "testsuite"]
+        # test cases are discarded once processed
+        assert len(ancestors[-1]) <= 2
+        seen.append((elem.attrib["name"], [x.tag for x in elem]))
+    assert len(seen) == 100
+    assert seen[0] == ("test_0", ["passed", "failure"])
+
+    def prune(elem):
+        return elem.tag == "passed"
+
+    with xml.open("rb") as f:
+        elements = list(iterparse_elements(f, {"testcase"}, prune=prune))
+    assert [x.tag for x in elements[0][0]] == ["failure"]
+
+    # several root elements
+    xml.write_text('<Exception line="1"/><TestLog><TestCase name="a"/></TestLog>')
+    elements = [
+        (x.tag, [a.tag for a in ancestors])
+        for x, ancestors in iterparse_elements(
+            str(xml), {"Exception", "TestCase"}, wrap=True
+        )
+    ]
+    assert elements == [("Exception", ["xml"]), ("TestCase", ["xml", "TestLog"])]
+
+
+@pytest.mark.skipif(
+    not pytest_cpp.helpers.can_use_report_pipes([]), reason="requires /dev/fd"
+)
+def test_report_sinks_pipes():
+    with ReportSinks(use_pipes=True) as sinks:
+        sink = sinks.add(
+            "report.xml", lambda f: [x.tag for x, _ in iterparse_elements(f, {"b"})]
+        )
+        bad_sink = sinks.add(
+            "bad.xml", lambda f: [x.tag for x, _ in iterparse_elements(f, {"b"})]
+        )
+        assert sink.path.startswith("/dev/fd/")
+        script = (
+            "import sys\n"
+            "open(sys.argv[1], 'w').write('<a>' + '<b/>' * 100000 + '</a>')\n"
+            "open(sys.argv[2], 'w').write('<a>' + 'x' * 100000)\n"
+        )
+        subprocess.check_call(
+            [sys.executable, "-c", script, sink.path, bad_sink.path],
+            pass_fds=sinks.pass_fds,
+        )
+        sinks.close()
+        assert sink.get_result() == ["b"] * 100000
+        # invalid reports are still read until their end
+        with pytest.raises(ElementTree.ParseError):
+            bad_sink.get_result()
+        assert bad_sink.get_text().endswith("x" * 1000)
+
+
+def test_can_use_report_pipes():
+    assert not pytest_cpp.helpers.can_use_report_pipes(["valgrind"])
+
+
+@pytest.mark.skipif(
+    not pytest_cpp.helpers.can_use_report_pipes([]), reason="requires /dev/fd"
+)
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_report_pipes(testdir, exes, mocker, batch_size):
+    files = [
+        exes.get("gtest", "test_gtest"),
+        exes.get("boost_failure", "test_boost_failure"),
+        exes.get("catch2_failure", "test_catch2_failure"),
+        exes.get("catch2_failure_v3", "test_catch2_failure_v3"),
+    ]
+    temp_dir = mocker.spy(tempfile, "TemporaryDirectory")
+    result = testdir.inline_run(
+        *files, "-o", "cpp_report_pipes=true", "-o", f"cpp_batch_size={batch_size}"
+    )
+    # the same outcomes as with files, but without creating any
+    assert_outcomes(
+        result,
+        [
+            ("FooTest.test_success", "passed"),
+            ("FooTest.test_failure", "failed"),
+            ("test_failure_1", "failed"),
+        ],
+    )
+    rep = result.matchreport("FooTest.test_failure", "pytest_runtest_logreport")
+    assert "Expected equality" in str(rep.longrepr)
+    assert result.countoutcomes() == [1, 3, 10]
+    assert temp_dir.call_count == 0
+
+
 def test_google_failure(exes):
     facade = GoogleTestFacade()
-    failures, _ = facade.run_test(exes.get("gtest"), "FooTest.test_failure")
+    failures, _, _ = facade.run_test(exes.get("gtest"), "FooTest.test_failure")
     assert len(failures) == 2
     colors = ("red", "bold")
     assert failures[0].get_lines() == [
@@ -142,7 +378,7 @@ def test_google_failure(exes):
 
 def test_google_error(exes):
     facade = GoogleTestFacade()
-    failures, _ = facade.run_test(exes.get("gtest"), "FooTest.test_error")
+    failures, _, _ = facade.run_test(exes.get("gtest"), "FooTest.test_error")
     assert len(failures) == 1
     colors = ("red", "bold")
     assert failures[0].get_lines() == [
@@ -181,10 +417,8 @@ def test_google_skipped_no_msg(exes):
 
 def test_boost_failure(exes):
     facade = BoostTestFacade()
-    failures, _ = facade.run_test(exes.get("boost_failure"), "<unused>")
-    assert len(failures) == 2
-
-    fail1, fail2 = failures
+    (fail1,), _, _ = facade.run_test(exes.get("boost_failure"), "test_failure_1")
+    (fail2,), _, _ = facade.run_test(exes.get("boost_failure"), "test_failure_2")
     colors = ("red", "bold")
     assert fail1.get_lines() == [("check 2 * 3 == 5 has failed", colors)]
     assert fail1.get_file_reference() == ("boost_failure.cpp", 9)
@@ -195,7 +429,7 @@ def test_boost_failure(exes):
 
 def test_boost_fatal_error(exes):
     facade = BoostTestFacade()
-    failures, _ = facade.run_test(exes.get("boost_fatal_error"), "<unused>")
+    failures, _, _ = facade.run_test(exes.get("boost_fatal_error"), "test_failure_1")
     assert len(failures) == 1
 
     (fail1,) = failures
@@ -206,10 +440,8 @@ def test_boost_fatal_error(exes):
 
 def test_boost_error(exes):
     facade = BoostTestFacade()
-    failures, _ = facade.run_test(exes.get("boost_error"), "<unused>")
-    assert len(failures) == 2
-
-    fail1, fail2 = failures
+    (fail1,), _, _ = facade.run_test(exes.get("boost_error"), "test_error_1")
+    (fail2,), _, _ = facade.run_test(exes.get("boost_error"), "test_error_2")
     colors = ("red", "bold")
     assert fail1.get_lines() == [("std::runtime_error: unexpected exception", colors)]
     assert fail1.get_file_reference() == ("unknown location", 0)
@@ -222,7 +454,9 @@ def test_boost_error(exes):
 
 def test_boost_fixture_setup_error(exes):
     facade = BoostTestFacade()
-    failures, _ = facade.run_test(exes.get("boost_fixture_setup_error"), "<unused>")
+    failures, _, _ = facade.run_test(
+        exes.get("boost_fixture_setup_error"), "test_dummy"
+    )
     assert len(failures) == 1
 
     fail1 = failures[0]
@@ -248,6 +482,502 @@ def test_google_run(testdir, exes):
     )
 
 
+@pytest.mark.parametrize("batch_size, expected_calls", [("0", 1), ("4", 2)])
+def test_google_run_batched(testdir, exes, mocker, batch_size, expected_calls):
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.inline_run(
+        "-v", exes.get("gtest", "test_gtest"), "-o", f"cpp_batch_size={batch_size}"
+    )
+    assert_outcomes(
+        result,
+        [
+            ("FooTest.test_success", "passed"),
+            ("FooTest.test_failure", "failed"),
+            ("FooTest.test_error", "failed"),
+            ("FooTest.DISABLED_test_disabled", "skipped"),
+            ("FooTest.test_skipped", "skipped"),
+            ("FooTest.test_skipped_no_msg", "skipped"),
+        ],
+    )
+    run_calls = [
+        c for c in spy.call_args_list if any("--gtest_output" in x for x in c.args[0])
+    ]
+    assert len(run_calls) == expected_calls
+    # a batch of all the tests runs them without selecting them
+    has_filter = [any("--gtest_filter" in x for x in c.args[0]) for c in run_calls]
+    assert has_filter == [batch_size != "0"] * expected_calls
+
+    rep = result.matchreport("FooTest.test_failure", "pytest_runtest_logreport")
+    assert "gtest.cpp:19" in str(rep.longrepr)
+    [(name, output)] = rep.sections
+    assert name == "Captured c++ call"
+    assert "[ RUN      ] FooTest.test_failure" in output
+    assert "FooTest.test_success" not in output
+
+
+def test_google_run_tests_long_filter(exes, mocker):
+    spy = mocker.spy(subprocess, "Popen")
+    facade = GoogleTestFacade()
+    exe = exes.get("gtest")
+    test_ids = facade.list_tests(exe)
+    # the filter selecting all these tests would be too long for a single argument
+    missing = [f"MissingTest.test_{i:04}_with_a_long_name" for i in range(3001)]
+    results, _, error = facade.run_tests(exe, [*missing, *test_ids])
+    assert error is None
+    assert sorted(results) == sorted(test_ids)
+    assert results["FooTest.test_failure"].failures
+    filters = [
+        x
+        for c in spy.call_args_list
+        for x in c.args[0]
+        if x.startswith("--gtest_filter")
+    ]
+    assert len(filters) > 1
+    assert all(len(x) <= 8 * 1024 + len("--gtest_filter=") for x in filters)
+
+    # all the tests of the executable run without selecting them
+    spy.reset_mock()
+    results, _, error = facade.run_tests(exe, test_ids, all_tests=True)
+    assert error is None
+    assert sorted(results) == sorted(test_ids)
+    [run_call] = spy.call_args_list
+    assert not any(x.startswith("--gtest_filter") for x in run_call.args[0])
+
+
+def test_split_filter():
+    assert split_filter([], ",") == []
+    assert split_filter(["a", "bb", "c", "dddd", "é"], ",", 4) == [
+        ["a", "bb"],
+        ["c"],
+        ["dddd"],
+        ["é"],
+    ]
+    assert split_filter(["a", "b"], ",") == [["a", "b"]]
+
+
+def test_google_run_batched_selection(testdir, exes, mocker):
+    spy = mocker.spy(GoogleTestFacade, "run_tests")
+    result = testdir.inline_run(
+        exes.get("gtest", "test_gtest"), "-k", "skipped", "-o", "cpp_batch_size=0"
+    )
+    assert_outcomes(
+        result,
+        [
+            ("FooTest.test_skipped", "skipped"),
+            ("FooTest.test_skipped_no_msg", "skipped"),
+        ],
+    )
+    assert spy.call_count == 1
+    assert spy.call_args.args[2] == [
+        "FooTest.test_skipped",
+        "FooTest.test_skipped_no_msg",
+    ]
+
+
+def test_last_failed(testdir, exes, mocker):
+    exes.get("gtest", "test_gtest")
+    exes.get("catch2_success", "test_catch2")
+    result = testdir.runpytest_inprocess()
+    result.assert_outcomes(passed=3, failed=2, skipped=3)
+
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.inline_run("--lf")
+    assert_outcomes(
+        result,
+        [
+            ("FooTest.test_failure", "failed"),
+            ("FooTest.test_error", "failed"),
+        ],
+    )
+    # the failed tests run in a single invocation, and test_catch2 is never executed
+    [run_call] = [
+        c for c in spy.call_args_list if any("--gtest_output" in x for x in c.args[0])
+    ]
+    assert "--gtest_filter=FooTest.test_failure:FooTest.test_error" in run_call.args[0]
+    assert not any("test_catch2" in c.args[0][0] for c in spy.call_args_list)
+
+
+def test_last_failed_other_path(testdir, exes):
+    testdir.mkdir("a")
+    testdir.mkdir("b")
+    testdir.makepyfile(**{"a/test_py": "def test_fail(): assert False"})
+    exes.get("catch2_success", "b/test_catch2")
+    result = testdir.runpytest_inprocess()
+    result.assert_outcomes(passed=2, failed=1)
+
+    # the executables are collected when the tests which failed are not selected
+    result = testdir.runpytest_inprocess("--lf", "b")
+    result.assert_outcomes(passed=2)
+
+
+def test_invalid_batch_size(testdir, exes):
+    result = testdir.runpytest(exes.get("gtest"), "-o", "cpp_batch_size=foo")
+    result.stderr.fnmatch_lines("*cpp_batch_size must be a non-negative integer*")
+
+
+def test_google_run_tests(exes):
+    facade = GoogleTestFacade()
+    results, output, error = facade.run_tests(
+        exes.get("gtest"),
+        ["FooTest.test_success", "FooTest.test_failure", "FooTest.test_skipped"],
+    )
+    assert error is None
+    assert sorted(results) == [
+        "FooTest.test_failure",
+        "FooTest.test_skipped",
+        "FooTest.test_success",
+    ]
+    success = results["FooTest.test_success"]
+    assert success.failures is None
+    assert success.skipped is None
+    assert "Just saying hi from gtest" in success.output
+
+    failure = results["FooTest.test_failure"]
+    assert [x.get_file_reference() for x in failure.failures] == [
+        ("gtest.cpp", 19),
+        ("gtest.cpp", 20),
+    ]
+
+    skipped = results["FooTest.test_skipped"]
+    assert skipped.failures is None
+    assert "This is a skipped message" in skipped.skipped
+    assert "1 FAILED TEST" in output
+
+
+@pytest.mark.parametrize("stream_results", [True, False])
+def test_google_run_tests_crash(exes, stream_results):
+    facade = GoogleTestFacade(stream_results=stream_results)
+    exe = exes.get("gtest_crash")
+    results, output, error = facade.run_tests(exe, facade.list_tests(exe))
+    assert error is not None
+    assert "Internal Error: calling" in error.get_lines()[0][0]
+    if not stream_results:
+        assert results == {}
+        return
+
+    assert sorted(results) == [
+        "CrashTest.test_crash",
+        "CrashTest.test_failure",
+        "CrashTest.test_skipped",
+        "CrashTest.test_success",
+    ]
+    assert results["CrashTest.test_success"].failures is None
+    assert results["CrashTest.test_success"].skipped is None
+
+    failure = results["CrashTest.test_failure"]
+    assert [x.get_file_reference() for x in failure.failures] == [
+        ("gtest_crash.cpp", 11)
+    ]
+    assert "[ RUN      ] CrashTest.test_failure" in failure.output
+
+    skipped = results["CrashTest.test_skipped"]
+    assert skipped.failures is None
+    assert "This is a skipped message" in skipped.skipped
+
+    crash = results["CrashTest.test_crash"]
+    assert [x.get_file_reference() for x in crash.failures] == [
+        ("gtest_crash.cpp", 19),
+        ("unknown file", 0),
+    ]
+
+
+def test_google_run_tests_invalid_report(exes, mocker):
+    mock_popen(mocker, return_code=0, stdout="crashed", stderr=None)
+    facade = GoogleTestFacade()
+    results, output, error = facade.run_tests(
+        exes.get("gtest"), ["FooTest.test_success", "FooTest.test_failure"]
+    )
+    assert results == {}
+    assert output == "crashed"
+    lines = error.get_lines()
+    assert "for 2 tests did not produce a valid report" in lines[0][0]
+    assert "crashed" in "\n".join(x for x, _ in lines)
+
+
+def test_describe_tests():
+    assert describe_tests(["FooTest.test_success"]) == "FooTest.test_success"
+    assert describe_tests(["a", "b", "c"]) == "3 tests"
+
+
+@pytest.mark.parametrize("stream_results, expected_calls", [(True, 2), (False, 7)])
+def test_google_run_batched_crash(
+    testdir, exes, mocker, stream_results, expected_calls
+):
+    mocker.patch.object(
+        pytest_cpp.plugin,
+        "detect_facade",
+        return_value=GoogleTestFacade(stream_results=stream_results),
+    )
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.inline_run(
+        "-v", exes.get("gtest_crash", "test_gtest_crash"), "-o", "cpp_batch_size=0"
+    )
+    # the tests which did not run are resumed after the crash, blaming the test which
+    # was running when results are streamed, or bisecting the tests otherwise
+    assert_outcomes(
+        result,
+        [
+            ("CrashTest.test_success", "passed"),
+            ("CrashTest.test_failure", "failed"),
+            ("CrashTest.test_skipped", "skipped"),
+            ("CrashTest.test_crash", "failed"),
+            ("CrashTest.test_not_run", "passed"),
+        ],
+    )
+    rep = result.matchreport("CrashTest.test_crash", "pytest_runtest_logreport")
+    assert "Internal Error: calling" in str(rep.longrepr)
+    if not stream_results:
+        # the test ran on its own
+        assert "for CrashTest.test_crash failed" in str(rep.longrepr)
+    run_calls = [
+        c for c in spy.call_args_list if any("--gtest_output" in x for x in c.args[0])
+    ]
+    assert len(run_calls) == expected_calls
+
+
+@pytest.mark.parametrize("stream_results", [True, False])
+def test_batch_fails_at_startup(testdir, exes, mocker, stream_results):
+    """Batches which fail the same way whatever tests they run are not bisected."""
+    mocker.patch.object(
+        pytest_cpp.plugin,
+        "detect_facade",
+        return_value=GoogleTestFacade(stream_results=stream_results),
+    )
+    testdir.makepyfile(harness="""
+        import sys
+        with open("runs.log", "a") as f:
+            f.write("run\\n")
+        print("error while loading shared libraries", flush=True)
+        sys.exit(127)
+        """)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_harness = {sys.executable} harness.py
+        cpp_batch_size = 0
+    """)
+    result = testdir.inline_run(exes.get("gtest_crash", "test_gtest_crash"))
+    assert result.countoutcomes() == [0, 0, 5]
+    rep = result.matchreport("CrashTest.test_not_run", "pytest_runtest_logreport")
+    assert "error while loading shared libraries" in str(rep.longrepr)
+    # the whole batch, and each of its halves
+    assert len(testdir.tmpdir.join("runs.log").readlines()) == 3
+
+
+def test_google_stream_state():
+    facade = GoogleTestFacade.from_help_output(
+        "  --gtest_list_tests\n  --gtest_stream_result_to=HOST:PORT\n"
+    )
+    assert facade is not None
+    assert facade.stream_results
+    assert GoogleTestFacade.from_cache_state(facade.get_cache_state()).stream_results
+    assert not GoogleTestFacade.from_help_output(
+        "  --gtest_list_tests\n"
+    ).stream_results
+    assert not GoogleTestFacade.from_cache_state(None).stream_results
+
+    markers = {b"--gtest_list_tests", b"--gtest_stream_result_to"}
+    facade = GoogleTestFacade.from_binary_markers(markers)
+    assert facade is not None
+    assert facade.stream_results
+    facade = GoogleTestFacade.from_binary_markers({b"libgtest"})
+    assert facade is not None
+    assert not facade.stream_results
+
+
+def test_google_run_tests_sharded(exes):
+    facade = GoogleTestFacade()
+    exe = exes.get("gtest")
+    test_ids = facade.list_tests(exe)
+    results_0, _, error_0 = facade.run_tests(exe, test_ids, shard=(0, 2))
+    results_1, _, error_1 = facade.run_tests(exe, test_ids, shard=(1, 2))
+    assert error_0 is None and error_1 is None
+    assert results_0 and results_1
+    assert not set(results_0) & set(results_1)
+    assert sorted([*results_0, *results_1]) == sorted(test_ids)
+
+
+def test_google_run_shards(testdir, exes, mocker):
+    spy = mocker.spy(GoogleTestFacade, "run_tests")
+    result = testdir.inline_run(exes.get("gtest", "test_gtest"), "--cpp-shards=3")
+    assert_outcomes(
+        result,
+        [
+            ("FooTest.test_success", "passed"),
+            ("FooTest.test_failure", "failed"),
+            ("FooTest.test_error", "failed"),
+            ("FooTest.DISABLED_test_disabled", "skipped"),
+            ("FooTest.test_skipped", "skipped"),
+            ("FooTest.test_skipped_no_msg", "skipped"),
+        ],
+    )
+    shards = sorted(c.kwargs["shard"] for c in spy.call_args_list)
+    assert shards == [(0, 3), (1, 3), (2, 3)]
+
+
+LOG_SCRIPT = """
+import subprocess
+import sys
+
+with open("runs.log", "a") as f:
+    f.write(" ".join(sys.argv[2:]) + "\\n")
+sys.exit(subprocess.call(sys.argv[1:]))
+"""
+
+
+@pytest.mark.parametrize(
+    "dist, batch_size, expected_runs",
+    [("load", "0", 6), ("load", "2", 6), ("loadfile", "0", 1), ("loadfile", "2", 3)],
+)
+def test_xdist_batches(testdir, exes, dist, batch_size, expected_runs):
+    pytest.importorskip("xdist")
+    testdir.makepyfile(log=LOG_SCRIPT)
+    exes.get("gtest", "test_gtest")
+    result = testdir.runpytest_subprocess(
+        "-n2",
+        f"--dist={dist}",
+        "-o",
+        f"cpp_batch_size={batch_size}",
+        "-o",
+        f"cpp_harness={sys.executable} log.py",
+    )
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    # each test runs once, in the worker it was given to
+    runs = testdir.tmpdir.join("runs.log").readlines()
+    assert len(runs) == expected_runs
+
+
+@pytest.mark.parametrize("batch_size", ["1", "2"])
+def test_cpp_jobs(testdir, exes, mocker, batch_size):
+    import threading
+
+    threads = set()
+    original_run_test = GoogleTestFacade.run_test
+    original_run_tests = GoogleTestFacade.run_tests
+
+    def run_test(self, *args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return original_run_test(self, *args, **kwargs)
+
+    def run_tests(self, *args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return original_run_tests(self, *args, **kwargs)
+
+    mocker.patch.object(GoogleTestFacade, "run_test", run_test)
+    mocker.patch.object(GoogleTestFacade, "run_tests", run_tests)
+    result = testdir.inline_run(
+        exes.get("gtest", "test_gtest"),
+        exes.get("boost_success", "test_boost_success"),
+        "--cpp-jobs=3",
+        "-o",
+        f"cpp_batch_size={batch_size}",
+    )
+    expected = [
+        ("FooTest.test_success", "passed"),
+        ("FooTest.test_failure", "failed"),
+        ("FooTest.test_error", "failed"),
+        ("FooTest.DISABLED_test_disabled", "skipped"),
+        ("FooTest.test_skipped", "skipped"),
+        ("FooTest.test_skipped_no_msg", "skipped"),
+        ("test_success_1", "passed"),
+        ("test_success_2", "passed"),
+    ]
+    assert_outcomes(result, expected)
+    reports = [
+        x.report.nodeid.split("::")[-1]
+        for x in result.getcalls("pytest_runtest_logreport")
+        if x.report.when == "call"
+    ]
+    assert reports == [x for x, _ in expected]
+    assert threads
+    assert all(x.startswith("pytest-cpp-run") for x in threads)
+
+
+def test_parallel_runner():
+    from pytest_cpp.runner import ParallelRunner
+
+    runner = ParallelRunner(jobs=1)
+    started = []
+
+    def work(key):
+        def fn():
+            started.append(key)
+            if key == "skipped":
+                pytest.skip("skipped work")
+            return key.upper()
+
+        return fn
+
+    keys = ["a", "b", "skipped", "c", "d", "e"]
+    for key in keys:
+        runner.add(key, work(key))
+    assert runner.run("a", work("a")) == "A"
+    runner.shutdown()
+    # only two works are started ahead of the first one
+    assert started[0] == "a"
+    assert set(started) <= {"a", "b", "skipped"}
+
+    runner = ParallelRunner(jobs=2)
+    for key in keys:
+        runner.add(key, work(key))
+    assert runner.run("a", work("a")) == "A"
+    assert runner.run("b", work("b")) == "B"
+    with pytest.raises(pytest.skip.Exception, match="skipped work"):
+        runner.run("skipped", work("skipped"))
+    # works not added or already consumed run in the calling thread
+    assert runner.run("b", work("b")) == "B"
+    assert runner.run("unknown", work("unknown")) == "UNKNOWN"
+    runner.shutdown()
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires sleep")
+def test_parallel_runner_shutdown():
+    from pytest_cpp.runner import ParallelRunner
+
+    runner = ParallelRunner(jobs=2)
+    returncodes = []
+    started = threading.Event()
+
+    def hang():
+        started.set()
+        # processes started once the runner was shut down are killed too
+        for _ in range(2):
+            returncodes.append(
+                run_process([sys.executable, "-c", HANG_SCRIPT]).returncode
+            )
+
+    runner.add("a", lambda: None)
+    runner.add("hang", hang)
+    runner.run("a", lambda: None)
+    assert started.wait(10)
+    start = time.perf_counter()
+    # the processes still running are killed instead of waiting for them
+    runner.shutdown()
+    assert time.perf_counter() - start < 10
+    assert returncodes == [-signal.SIGKILL, -signal.SIGKILL]
+
+
+def test_invalid_shards(testdir, exes):
+    result = testdir.runpytest(exes.get("gtest"), "--cpp-shards=0")
+    result.stderr.fnmatch_lines("*--cpp-shards must be at least 1*")
+
+
+def test_google_split_output():
+    output = (
+        "[==========] Running 2 tests from 1 test suite.\n"
+        "[ RUN      ] FooTest.a\n"
+        "hello\n"
+        "[       OK ] FooTest.a (0 ms)\n"
+        "[ RUN      ] FooTest.b\n"
+        "[  FAILED  ] FooTest.b (1 ms)\n"
+        "[ RUN      ] FooTest.c\n"
+        "[  FAILED  ] FooTest.b\n"
+    )
+    assert split_output(output) == {
+        "FooTest.a": "[ RUN      ] FooTest.a\nhello\n[       OK ] FooTest.a (0 ms)\n",
+        "FooTest.b": "[ RUN      ] FooTest.b\n[  FAILED  ] FooTest.b (1 ms)\n",
+    }
+
+
 def test_unknown_error(testdir, exes, mocker):
     mocker.patch.object(
         GoogleTestFacade, "run_test", side_effect=RuntimeError("unknown error")
@@ -258,74 +988,586 @@ def test_unknown_error(testdir, exes, mocker):
 
 
 def test_google_internal_errors(mocker, testdir, exes, tmp_path):
-    mocker.patch.object(GoogleTestFacade, "is_test_suite", return_value=True)
     mocker.patch.object(
-        GoogleTestFacade, "list_tests", return_value=["FooTest.test_success"]
+        pytest_cpp.plugin, "detect_facade", return_value=GoogleTestFacade()
     )
-    mocked = mocker.patch.object(
-        subprocess, "check_output", autospec=True, return_value=""
+    mocker.patch.object(
+        GoogleTestFacade, "list_tests", return_value=["FooTest.test_success"]
     )
+    mock_popen(mocker, return_code=100, stdout="", stderr=None)
+    result = testdir.inline_run("-v", exes.get("gtest", "test_gtest"))
+    rep = result.matchreport(exes.exe_name("test_gtest"), "pytest_runtest_logreport")
+    assert "Internal Error: calling" in str(rep.longrepr)
 
-    def raise_error(*args, **kwargs):
-        raise subprocess.CalledProcessError(returncode=100, cmd="")
+    mock_popen(mocker, return_code=0, stdout="", stderr=None)
+    xml_file = tmp_path.joinpath("cpp-report.xml")
+    xml_file.write_text("<empty/>")
+    temp_mock = mocker.patch.object(tempfile, "TemporaryDirectory")
+    temp_mock().__enter__.return_value = str(tmp_path)
 
-    mocked.side_effect = raise_error
     result = testdir.inline_run("-v", exes.get("gtest", "test_gtest"))
     rep = result.matchreport(exes.exe_name("test_gtest"), "pytest_runtest_logreport")
-    assert "Internal Error: calling" in str(rep.longrepr)
 
-    mocked.side_effect = None
-    xml_file = tmp_path.joinpath("cpp-report.xml")
-    xml_file.write_text("<empty/>")
-    temp_mock = mocker.patch.object(tempfile, "TemporaryDirectory")
-    temp_mock().__enter__.return_value = str(tmp_path)
+    assert "Internal Error: could not find test" in str(rep.longrepr)
+
+
+def test_google_internal_errors_batched(mocker, testdir, exes):
+    mocker.patch.object(
+        pytest_cpp.plugin, "detect_facade", return_value=GoogleTestFacade()
+    )
+    mocker.patch.object(
+        GoogleTestFacade,
+        "list_tests",
+        return_value=["FooTest.test_success", "FooTest.test_failure"],
+    )
+    mock_popen(mocker, return_code=100, stdout="crashed", stderr=None)
+    result = testdir.inline_run(
+        exes.get("gtest", "test_gtest"), "-o", "cpp_batch_size=0"
+    )
+    for test_id in ["FooTest.test_success", "FooTest.test_failure"]:
+        rep = result.matchreport(test_id, "pytest_runtest_logreport")
+        assert "Internal Error: calling" in str(rep.longrepr)
+        assert "returncode=100" in str(rep.longrepr)
+
+
+def test_boost_run(testdir, exes):
+    all_names = [
+        "boost_success",
+        "boost_error",
+        "boost_fixture_setup_error",
+        "boost_failure",
+    ]
+    all_files = [exes.get(n, "test_" + n) for n in all_names]
+    result = testdir.inline_run("-v", *all_files)
+    assert_outcomes(
+        result,
+        [
+            ("test_success_1", "passed"),
+            ("test_success_2", "passed"),
+            ("test_error_1", "failed"),
+            ("test_error_2", "failed"),
+            ("test_dummy", "failed"),
+            ("test_failure_1", "failed"),
+            ("test_failure_2", "failed"),
+        ],
+    )
+
+
+@pytest.mark.parametrize("batch_size, expected_calls", [("0", 4), ("1", 7)])
+def test_boost_run_batched(testdir, exes, mocker, batch_size, expected_calls):
+    all_names = [
+        "boost_success",
+        "boost_error",
+        "boost_fixture_setup_error",
+        "boost_failure",
+    ]
+    all_files = [exes.get(n, "test_" + n) for n in all_names]
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.inline_run("-v", *all_files, "-o", f"cpp_batch_size={batch_size}")
+    assert_outcomes(
+        result,
+        [
+            ("test_success_1", "passed"),
+            ("test_success_2", "passed"),
+            ("test_error_1", "failed"),
+            ("test_error_2", "failed"),
+            ("test_dummy", "failed"),
+            ("test_failure_1", "failed"),
+            ("test_failure_2", "failed"),
+        ],
+    )
+    run_calls = [
+        c
+        for c in spy.call_args_list
+        if any("--log_level=test_suite" in x for x in c.args[0])
+    ]
+    assert len(run_calls) == expected_calls
+    # batches of all the test cases of an executable run them without filters
+    has_filter = [any("--run_test" in x for x in c.args[0]) for c in run_calls]
+    assert has_filter == [batch_size != "0"] * expected_calls
+
+    rep = result.matchreport("test_error_2", "pytest_runtest_logreport")
+    assert "another unexpected exception" in str(rep.longrepr)
+    assert "std::runtime_error: unexpected exception" not in str(rep.longrepr)
+
+    rep = result.matchreport("test_dummy", "pytest_runtest_logreport")
+    assert "This is a global fixture init failure" in str(rep.longrepr)
+
+
+def test_boost_run_tests_nested(exes):
+    facade = BoostTestFacade()
+    exe = exes.get("acceptance/boosttest-samples/unit_test_example_04")
+    test_ids = facade.list_tests(exe)
+    assert test_ids == [
+        "my_suite1/my_test1",
+        "my_suite1/my_test2",
+        "my_test3",
+        "my_suite2/my_test4",
+        "my_suite2/internal_suite/my_test5",
+    ]
+    results, _, error = facade.run_tests(
+        exe, ["my_suite1/my_test2", "my_test3", "my_suite2/internal_suite/my_test5"]
+    )
+    assert error is None
+    assert sorted(results) == [
+        "my_suite1/my_test2",
+        "my_suite2/internal_suite/my_test5",
+        "my_test3",
+    ]
+    [failure] = results["my_suite1/my_test2"].failures
+    assert failure.get_file_reference()[1] == 29
+    assert results["my_test3"].failures is None
+    [failure] = results["my_suite2/internal_suite/my_test5"].failures
+    assert failure.get_file_reference()[1] == 66
+
+
+def test_boost_run_tests_long_filter(exes, mocker):
+    mocker.patch.object(pytest_cpp.helpers, "_MAX_FILTER_LENGTH", 40)
+    spy = mocker.spy(subprocess, "Popen")
+    facade = BoostTestFacade()
+    exe = exes.get("acceptance/boosttest-samples/unit_test_example_04")
+    test_ids = facade.list_tests(exe)
+    spy.reset_mock()
+    results, _, error = facade.run_tests(exe, test_ids)
+    assert error is None
+    assert sorted(results) == sorted(test_ids)
+    assert results["my_test3"].failures is None
+    assert results["my_suite1/my_test2"].failures
+    filters = [[x for x in c.args[0] if "--run_test" in x] for c in spy.call_args_list]
+    assert filters == [
+        ["--run_test=my_suite1/my_test1,my_test2"],
+        ["--run_test=my_test3", "--run_test=my_suite2/my_test4"],
+        ["--run_test=my_suite2/internal_suite/my_test5"],
+    ]
+
+    spy.reset_mock()
+    results, _, error = facade.run_tests(exe, test_ids, all_tests=True)
+    assert sorted(results) == sorted(test_ids)
+    [run_call] = spy.call_args_list
+    assert not any("--run_test" in x for x in run_call.args[0])
+
+
+def test_boost_from_binary_markers():
+    facade = BoostTestFacade.from_binary_markers(
+        {b"output_format", b"log_sink", b"list_content"}
+    )
+    assert facade is not None and facade.list_content
+    facade = BoostTestFacade.from_binary_markers({b"output_format", b"log_sink"})
+    assert facade is not None and not facade.list_content
+    # the parameters of the shared library are not known
+    markers = {b"libboost_unit_test_framework"}
+    assert BoostTestFacade.from_binary_markers(markers) is None
+
+
+def test_boost_parse_list_content():
+    output = (
+        "my_suite1*\n"
+        "    my_test1*\n"
+        "    my_test2\n"
+        "my_test3*\n"
+        "my_suite2\n"
+        "    internal_suite\n"
+        "        my_test5\n"
+        "my_suite3*\n"
+        "    internal_suite*\n"
+        "        my_test<int>*\n"
+    )
+    assert parse_list_content(output) == [
+        "my_suite1/my_test1",
+        "my_test3",
+        "my_suite3/internal_suite/my_test<int>",
+    ]
+
+
+def test_boost_run_test_filters():
+    assert make_run_test_filters(
+        ["my_test1", "my_suite/my_test2", "my_test3", "my_suite/sub/my_test4"]
+    ) == [
+        "--run_test=my_test1,my_test3",
+        "--run_test=my_suite/my_test2",
+        "--run_test=my_suite/sub/my_test4",
+    ]
+    # characters which are part of the syntax of filters can't be escaped
+    assert make_run_test_filters(
+        ["my_test<std::string>", "my_test<int, float>", "a:b/!test", "a:b/test,2"]
+    ) == [
+        "--run_test=my_test<std*,my_test<int*",
+        "--run_test=a*/*test,test*",
+    ]
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("my_test", "my_test"),
+        ("my_test<std::string>", "my_test<std*"),
+        ("my_test<int, float>", "my_test<int*"),
+        ("ns::my_test", "*my_test"),
+        ("a:test:b", "*test*"),
+        ("!test", "*test"),
+        ("@test*", "*test*"),
+        ("test+", "test*"),
+        (",", "*"),
+    ],
+)
+def test_boost_name_filter(name, expected):
+    assert make_name_filter(name) == expected
+    assert is_exact_filter(name) == (name == expected)
+
+
+def test_boost_run_test_special_chars(exes, mocker):
+    """Tests which are selected by patterns run through ``_run_tests``, splitting the log."""
+    run_tests = mocker.patch.object(
+        BoostTestFacade,
+        "_run_tests",
+        return_value=(
+            {"my_suite/ns::my_test": CppTestResult(duration=1.0)},
+            "output",
+            None,
+        ),
+    )
+    facade = BoostTestFacade()
+    assert facade.run_test("boost_test", "my_suite/ns::my_test") == (
+        None,
+        "output",
+        1.0,
+    )
+    assert run_tests.call_args.args[:3] == (
+        "boost_test",
+        ["my_suite/ns::my_test"],
+        ["--run_test=my_suite/*my_test"],
+    )
+
+
+def test_boost_without_list_content(exes):
+    facade = BoostTestFacade.from_help_output("--output_format\n--log_format\n")
+    assert facade is not None
+    assert not facade.list_content
+    assert not BoostTestFacade.from_cache_state(facade.get_cache_state()).list_content
+    assert BoostTestFacade.from_cache_state(None).list_content
+
+    exe = exes.get("boost_failure")
+    assert facade.list_tests(exe) == ["boost_failure"]
+    results, _, error = facade.run_tests(exe, ["boost_failure"])
+    assert error is None
+    assert len(results["boost_failure"].failures) == 2
+
+
+def mock_popen(mocker, return_code, stdout, stderr):
+    mocked_popen = mocker.MagicMock()
+    mocked_popen.__enter__ = mocked_popen
+    mocked_popen.communicate.return_value = stdout, stderr
+    mocked_popen.returncode = return_code
+    mocked_popen.poll.return_value = return_code
+    mocker.patch.object(subprocess, "Popen", return_value=mocked_popen)
+    # the mocked process can't be reaped with os.wait4
+    mocker.patch.object(pytest_cpp.helpers, "is_tracking_usage", return_value=False)
+    return mocked_popen
+
+
+def test_boost_internal_error(testdir, exes, mocker):
+    exe = exes.get("boost_success", "test_boost_success")
+    mock_popen(mocker, return_code=100, stderr=None, stdout=None)
+    mocker.patch.object(
+        pytest_cpp.plugin,
+        "detect_facade",
+        return_value=BoostTestFacade(list_content=False),
+    )
+    result = testdir.inline_run(exe)
+    rep = result.matchreport(
+        exes.exe_name("test_boost_success"), "pytest_runtest_logreport"
+    )
+    assert "Internal Error:" in str(rep.longrepr)
+
+
+def test_collect_cache(testdir, exes, mocker):
+    testdir.makeini("""
+        [pytest]
+        cpp_collect_cache = true
+    """)
+    exe = exes.get("gtest", "test_gtest")
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.runpytest_inprocess("--collect-only", exe)
+    result.stdout.fnmatch_lines(["*6 tests collected*"])
+    assert spy.call_count > 0
+
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess("--collect-only", exe)
+    result.stdout.fnmatch_lines(["*6 tests collected*"])
+    assert spy.call_count == 0
+
+    # replacing the executable invalidates its entry
+    exes.get("catch2_success", "test_gtest")
+    result = testdir.runpytest_inprocess("--collect-only", exe)
+    result.stdout.fnmatch_lines(["*2 tests collected*"])
+    assert spy.call_count > 0
+
+    # the catch2 version is cached along with the framework
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess(exe)
+    result.stdout.fnmatch_lines(["*2 passed*"])
+    assert not any("--help" in c.args[0] for c in spy.call_args_list)
+
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess("--collect-only", exe, "--cpp-cache-clear")
+    result.stdout.fnmatch_lines(["*2 tests collected*"])
+    assert spy.call_count > 0
+
+
+def test_result_cache(testdir, exes, mocker, monkeypatch):
+    testdir.makeini("""
+        [pytest]
+        cpp_result_cache = true
+        cpp_result_cache_dir = results
+        cpp_result_cache_env = GTEST_COLOR
+    """)
+    exes.get("gtest", "test_gtest")
+    result = testdir.runpytest_inprocess("-v")
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    result.stdout.fnmatch_lines(["*::test_success PASSED*"])
+    assert len(list(testdir.tmpdir.join("results").visit("*", lambda x: x.isfile())))
+
+    # the test which passed doesn't run again, the others do
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.runpytest_inprocess("-v")
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    result.stdout.fnmatch_lines(["*::test_success PASSED (cached)*"])
+    run_calls = [
+        c for c in spy.call_args_list if any("--gtest_output" in x for x in c.args[0])
+    ]
+    assert len(run_calls) == 5
+    assert not any(
+        "--gtest_filter=FooTest.test_success" in c.args[0] for c in run_calls
+    )
+
+    # tests run again when an environment variable in cpp_result_cache_env changes
+    monkeypatch.setenv("GTEST_COLOR", "no")
+    result = testdir.runpytest_inprocess("-v", "-o", "cpp_batch_size=0")
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    assert "(cached)" not in result.stdout.str()
+
+    # batches skip the tests which passed in a previous session
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess("-v", "-o", "cpp_batch_size=0")
+    result.stdout.fnmatch_lines(["*::test_success PASSED (cached)*"])
+    [run_call] = [
+        c for c in spy.call_args_list if any("--gtest_output" in x for x in c.args[0])
+    ]
+    assert "FooTest.test_success" not in " ".join(run_call.args[0])
+
+    # tests run again when the limits which can fail them change
+    result = testdir.runpytest_inprocess(
+        "-v", "-o", "cpp_batch_size=0", "-o", "cpp_max_rss=1G"
+    )
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    assert "(cached)" not in result.stdout.str()
+
+
+def test_result_cache_settings(tmp_path, exes):
+    exe = exes.get("gtest")
+    keys = {
+        ResultCache(tmp_path, {}, settings).get_key(exe, "FooTest.test_success")
+        for settings in [
+            None,
+            {"cpp_timeout": 1.0},
+            {"cpp_timeout": 2.0},
+            {"cpp_benchmark_baseline": "0123"},
+        ]
+    }
+    assert len(keys) == 4
+
+
+def test_resources(testdir, exes, mocker):
+    testdir.makeconftest("""
+        import pytest
+
+        def pytest_collection_modifyitems(items):
+            for item in items:
+                if item.name == "FooTest.test_failure":
+                    item.add_marker(pytest.mark.cpp_resources(cpus=4))
+    """)
+    testdir.makeini("""
+        [pytest]
+        cpp_resource_dir = resources
+        cpp_resource_budget = cpus=2 memory=8G
+        cpp_resources =
+            test_gtest::*.test_success cpus=2 memory=1G
+            test_gtest::FooTest.* cpus=1
+            test_boost* memory=512M
+    """)
+    exes.get("gtest", "test_gtest")
+    exes.get("boost_success", "test_boost")
+    spy = mocker.spy(ResourceBudget, "acquire")
+    result = testdir.runpytest_inprocess("--cpp-jobs=2")
+    result.assert_outcomes(passed=3, failed=2, skipped=3)
+    acquired = sorted(c.args[1] for c in spy.call_args_list)
+    assert acquired == sorted(
+        [
+            # the marker takes precedence over cpp_resources
+            Resources(4),
+            Resources(2, 1024**3),
+            Resources(0, 512 * 1024**2),
+            Resources(0, 512 * 1024**2),
+        ]
+        + [Resources(1)] * 4
+    )
+    # the resources of a batch are the largest of its tests
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess("-o", "cpp_batch_size=0", "test_gtest")
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    assert [c.args[1] for c in spy.call_args_list] == [Resources(4, 1024**3)]
+    # all resources were released
+    state = testdir.tmpdir.join("resources", "budget.json").read()
+    assert json.loads(state) == {}
+
+
+@pytest.mark.parametrize(
+    "option, expected",
+    [
+        ("cpp_resources=test_* cpus=foo", "*invalid cpp_resources line*"),
+        ("cpp_resources=test_* threads=2", "*invalid cpp_resources line*"),
+        ("cpp_resource_budget=memory=-1G", "*invalid cpp_resource_budget*"),
+    ],
+)
+def test_resources_usage_error(testdir, option, expected):
+    result = testdir.runpytest("-o", option)
+    result.stderr.fnmatch_lines([expected])
+
+
+def test_parse_resources():
+    assert parse_resources([]) == Resources()
+    assert parse_resources(["cpus=0.5", "memory=1.5K"]) == Resources(0.5, 1536)
+    assert parse_resources(["memory=2gb"]) == Resources(0, 2 * 1024**3)
+    assert parse_resources(["memory=100"], Resources(8, 0)) == Resources(8, 100)
+    with pytest.raises(ValueError):
+        parse_resources(["cpus"])
+    for arg in ["memory=inf", "memory=nan", "memory=-1K", "cpus=nan", "cpus=inf"]:
+        with pytest.raises(ValueError):
+            parse_resources([arg])
+
+
+def test_resource_budget(tmp_path):
+    import threading
+
+    budget = ResourceBudget(tmp_path, Resources(2, 1024))
+    # another session sharing the same budget
+    other = ResourceBudget(tmp_path, Resources(2, 1024))
+    assert budget.try_acquire(Resources(1, 512), "a")
+    assert not other.try_acquire(Resources(2), "b")
+    assert not other.try_acquire(Resources(1, 1000), "b")
+    assert other.try_acquire(Resources(1, 512), "b")
+    budget.release("a")
+    other.release("b")
+    # resources larger than the budget are acquired once no other test holds any
+    assert budget.try_acquire(Resources(100), "a")
+    assert not other.try_acquire(Resources(1), "b")
+    budget.release("a")
+
+    # resources held by processes which exited are reclaimed
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    tmp_path.joinpath("budget.json").write_text(
+        json.dumps({"dead": [process.pid, 2, 1024]})
+    )
+    assert budget.try_acquire(Resources(2, 1024), "a")
+    budget.release("a")
+
+    running = []
+    max_running = []
+
+    def work():
+        with budget.acquire(Resources(2)):
+            running.append(1)
+            max_running.append(len(running))
+            time.sleep(0.01)
+            running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_running == [1, 1, 1, 1]
+
+
+def test_is_process_alive():
+    assert is_process_alive(os.getpid())
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert is_process_alive(process.pid)
+    finally:
+        process.kill()
+        process.wait()
+    # the holders of resources which exited are reclaimed on all platforms
+    assert not is_process_alive(process.pid)
+
 
-    result = testdir.inline_run("-v", exes.get("gtest", "test_gtest"))
-    rep = result.matchreport(exes.exe_name("test_gtest"), "pytest_runtest_logreport")
+def test_collect_cache_non_test_executables(testdir, exes, mocker):
+    testdir.makeini("""
+        [pytest]
+        cpp_collect_cache = true
+    """)
+    exe = testdir.makefile("", test_script="#!/bin/sh\necho hello\n")
+    exe.chmod(0o755)
+    testdir.runpytest_inprocess("--collect-only", "-p", "no:python")
 
-    assert "Internal Error: could not find test" in str(rep.longrepr)
+    spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    result = testdir.runpytest_inprocess("--collect-only", "-p", "no:python")
+    result.stdout.fnmatch_lines(["*no tests collected*"])
+    assert spy.call_count == 0
 
 
-def test_boost_run(testdir, exes):
-    all_names = [
-        "boost_success",
-        "boost_error",
-        "boost_fixture_setup_error",
-        "boost_failure",
-    ]
-    all_files = [exes.get(n, "test_" + n) for n in all_names]
-    result = testdir.inline_run("-v", *all_files)
-    assert_outcomes(
-        result,
-        [
-            ("test_boost_success", "passed"),
-            ("test_boost_error", "failed"),
-            ("test_boost_fixture_setup_error", "failed"),
-            ("test_boost_failure", "failed"),
-        ],
+def test_collect_workers(testdir, exes, mocker):
+    testdir.mkdir("sub")
+    testdir.mkdir("ignored")
+    testdir.tmpdir.join("ignored", "conftest.py").write(
+        "collect_ignore = ['test_ignored']\n"
     )
+    exes.get("gtest", "test_gtest")
+    exes.get("catch2_success", "test_catch2")
+    exes.get("boost_success", "sub/test_boost")
+    exes.get("catch2_success_v3", "sub/test_catch2_v3")
+    exes.get("gtest", "ignored/test_ignored")
+    exes.get("boost_failure", "ignored/test_boost_failure")
+
+    result = testdir.runpytest_inprocess("--collect-only", "-q")
+    serial_lines = [x for x in result.outlines if "::" in x]
+    assert len(serial_lines) == 14
+
+    spy = mocker.spy(pytest_cpp.plugin, "get_help_output")
+    result = testdir.runpytest_inprocess(
+        "--collect-only", "-q", "-o", "cpp_collect_workers=4"
+    )
+    assert [x for x in result.outlines if "::" in x] == serial_lines
+    probed = sorted(os.path.basename(c.args[0]) for c in spy.call_args_list)
+    assert probed == [
+        "test_boost",
+        "test_boost_failure",
+        "test_catch2",
+        "test_catch2_v3",
+        "test_gtest",
+    ]
 
+    # only the executables given to pytest are prefetched
+    spy.reset_mock()
+    result = testdir.runpytest_inprocess(
+        "--collect-only", "-q", "-o", "cpp_collect_workers=4", "test_gtest", "sub"
+    )
+    assert len([x for x in result.outlines if "::" in x]) == 10
+    probed = sorted(os.path.basename(c.args[0]) for c in spy.call_args_list)
+    assert probed == ["test_boost", "test_catch2_v3", "test_gtest"]
 
-def mock_popen(mocker, return_code, stdout, stderr):
-    mocked_popen = mocker.MagicMock()
-    mocked_popen.__enter__ = mocked_popen
-    mocked_popen.communicate.return_value = stdout, stderr
-    mocked_popen.return_code = return_code
-    mocked_popen.poll.return_value = return_code
-    mocker.patch.object(subprocess, "Popen", return_value=mocked_popen)
-    return mocked_popen
 
+def test_read_build_id(exes, tmp_path):
+    from pytest_cpp.elf import read_build_id
 
-def test_boost_internal_error(testdir, exes, mocker):
-    exe = exes.get("boost_success", "test_boost_success")
-    mock_popen(mocker, return_code=100, stderr=None, stdout=None)
-    mocker.patch.object(BoostTestFacade, "is_test_suite", return_value=True)
-    mocker.patch.object(GoogleTestFacade, "is_test_suite", return_value=False)
-    result = testdir.inline_run(exe)
-    rep = result.matchreport(
-        exes.exe_name("test_boost_success"), "pytest_runtest_logreport"
-    )
-    assert "Internal Error:" in str(rep.longrepr)
+    build_id = read_build_id(exes.get("gtest"))
+    if sys.platform.startswith("linux"):
+        assert build_id is not None
+        assert len(bytes.fromhex(build_id)) > 0
+    tmp_path.joinpath("foo.txt").write_text("foo")
+    assert read_build_id(str(tmp_path.joinpath("foo.txt"))) is None
+    assert read_build_id(str(tmp_path.joinpath("invalid"))) is None
 
 
 def test_cpp_failure_repr(dummy_failure):
@@ -508,7 +1750,7 @@ def test_boost_cpp_harness_via_option(testdir, exes):
 def test_passing_files_directly_in_command_line(testdir, exes):
     f = exes.get("boost_success")
     result = testdir.runpytest(f)
-    result.stdout.fnmatch_lines(["*1 passed*"])
+    result.stdout.fnmatch_lines(["*2 passed*"])
 
 
 def test_race_condition_on_collect(tmp_path):
@@ -591,7 +1833,7 @@ def assert_catch2_failure(line, expected_line, expected_colors):
 def test_catch2_failure(exes):
     for suffix in ["", "_v3"]:
         facade = Catch2Facade()
-        failures, _ = facade.run_test(
+        failures, _, _ = facade.run_test(
             exes.get(f"catch2_failure{suffix}"), "Factorials are computed"
         )
         assert len(failures) == 1
@@ -605,13 +1847,13 @@ def test_catch2_failure(exes):
 
         assert fail1.get_file_reference() == (f"catch2_failure.cpp", 9)
 
-        failures, _ = facade.run_test(
+        failures, _, _ = facade.run_test(
             exes.get(f"catch2_failure{suffix}"), "Failed Sections"
         )
         assert len(failures) == 2
 
         # test exceptions
-        failures, _ = facade.run_test(exes.get(f"catch2_error{suffix}"), "Error")
+        failures, _, _ = facade.run_test(exes.get(f"catch2_error{suffix}"), "Error")
         [fail1] = failures
         assert_catch2_failure(fail1.get_lines()[0], "Error: ", colors)
         assert_catch2_failure(fail1.get_lines()[1], "a runtime error", colors)
@@ -635,6 +1877,728 @@ def test_catch2_special_chars(suffix, test_id, exes):
     assert facade.run_test(exe, test_id)[0] is None
 
 
+@pytest.mark.parametrize("suffix", ["", "_v3"])
+def test_catch2_run_batched(testdir, exes, mocker, suffix):
+    spy = mocker.spy(Catch2Facade, "run_tests")
+    result = testdir.inline_run(
+        exes.get(f"catch2_failure{suffix}", "test_catch2_failure"),
+        exes.get(f"catch2_special_chars{suffix}", "test_catch2_special_chars"),
+        "-o",
+        "cpp_batch_size=0",
+    )
+    assert_outcomes(
+        result,
+        [
+            ("Factorials are computed", "failed"),
+            ("Test fail macro", "failed"),
+            ("Failed Sections", "failed"),
+        ],
+    )
+    assert result.countoutcomes() == [6, 0, 3]
+    assert spy.call_count == 2
+
+    rep = result.matchreport("Test fail macro", "pytest_runtest_logreport")
+    assert "This is a fail" in str(rep.longrepr)
+    assert "Factorial(1) == 0" not in str(rep.longrepr)
+
+
+@pytest.mark.parametrize("batch_size", ["0", "1"])
+def test_catch2_uncaptured_output(testdir, exes, batch_size):
+    """
+    The output which Catch2 doesn't capture is given to the failed tests of a batch, and
+    to any test running on its own.
+    """
+    exes.get("catch2_failure", "test_catch2_failure")
+    exes.get("catch2_success", "test_catch2_success")
+    testdir.makepyfile(harness="""
+        import subprocess, sys
+        print("uncaptured output", flush=True)
+        sys.exit(subprocess.call(sys.argv[1:]))
+        """)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_harness = {sys.executable} harness.py
+        cpp_batch_size = {batch_size}
+    """)
+    result = testdir.inline_run()
+    assert result.countoutcomes() == [2, 0, 3]
+    for rep in result.getreports("pytest_runtest_logreport"):
+        if rep.when == "call":
+            output = dict(rep.sections).get("Captured c++ call", "")
+            expected = rep.failed or batch_size == "1"
+            assert ("uncaptured output" in output) == expected, rep.nodeid
+
+
+def test_catch2_batch_only():
+    facade = Catch2Facade(Catch2Version.V3)
+    assert not facade.batch_only
+    facade.benchmark_baseline = {}
+    assert facade.batch_only
+
+
+@pytest.mark.parametrize("suffix", ["", "_v3"])
+def test_catch2_run_tests_input_file(exes, mocker, suffix):
+    mocker.patch.object(pytest_cpp.catch2, "_MAX_TEST_SPEC_LENGTH", 0)
+    spy = mocker.spy(subprocess, "Popen")
+    facade = Catch2Facade()
+    exe = exes.get("catch2_special_chars" + suffix)
+    test_ids = facade.list_tests(exe)
+    assert len(test_ids) == 6
+    results, _, error = facade.run_tests(exe, test_ids)
+    assert error is None
+    assert sorted(results) == sorted(test_ids)
+    assert all(x.failures is None for x in results.values())
+    assert any("--input-file" in x for x in spy.call_args.args[0][1:])
+
+
+def test_catch2_run_tests_sharded(exes):
+    facade = Catch2Facade.from_help_output("--list-tests")
+    assert facade is not None and facade.supports_shards
+    assert not Catch2Facade(Catch2Version.V2).supports_shards
+
+    exe = exes.get("catch2_failure_v3")
+    test_ids = facade.list_tests(exe)
+    results_0, _, error_0 = facade.run_tests(exe, test_ids, shard=(0, 2))
+    results_1, _, error_1 = facade.run_tests(exe, test_ids, shard=(1, 2))
+    assert error_0 is None and error_1 is None
+    assert results_0 and results_1
+    assert not set(results_0) & set(results_1)
+    assert sorted([*results_0, *results_1]) == sorted(test_ids)
+
+
+def test_catch2_run_tests_invalid_report(exes, mocker):
+    mock_popen(mocker, return_code=0, stdout="crashed", stderr=None)
+    facade = Catch2Facade(Catch2Version.V3)
+    results, output, error = facade.run_tests(
+        exes.get("catch2_success_v3"), ["Passed Sections"]
+    )
+    assert results == {}
+    assert output == "crashed"
+    assert "did not produce a valid report" in error.get_lines()[0][0]
+
+
+@pytest.mark.parametrize(
+    "facade, name, test_id",
+    [
+        (GoogleTestFacade(), "gtest", "FooTest.test_failure"),
+        (BoostTestFacade(), "boost_failure", "test_failure_1"),
+        (BoostTestFacade(list_content=False), "boost_success", "boost_success"),
+        (Catch2Facade(Catch2Version.V2), "catch2_failure", "Factorials are computed"),
+        (Catch2Facade(Catch2Version.V3), "catch2_failure_v3", "Test fail macro"),
+    ],
+)
+def test_native_durations(exes, facade, name, test_id):
+    _, _, duration = facade.run_test(exes.get(name), test_id)
+    assert isinstance(duration, float) and duration >= 0
+    results, _, _ = facade.run_tests(exes.get(name), [test_id])
+    assert isinstance(results[test_id].duration, float)
+
+
+def test_google_stream_durations():
+    stream = GoogleTestResultStream()
+    stream.close()
+    for line in [
+        "event=TestCaseStart&name=FooTest",
+        "event=TestStart&name=test_success",
+        "event=TestEnd&passed=1&elapsed_time=12ms",
+    ]:
+        stream._handle_event(line)
+    assert stream.finished == {"FooTest.test_success": (True, [], 0.012)}
+
+
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_cpp_durations(testdir, exes, batch_size):
+    result = testdir.inline_run(
+        exes.get("gtest", "test_gtest"), "-o", f"cpp_batch_size={batch_size}"
+    )
+    rep = result.matchreport("FooTest.test_success", "pytest_runtest_logreport")
+    properties = dict(rep.user_properties)
+    assert properties["cpp_duration"] >= 0
+    assert properties["cpp_overhead"] > 0
+
+    result = testdir.runpytest(
+        exes.get("gtest", "test_gtest"),
+        exes.get("boost_success", "test_boost_success"),
+        "-o",
+        f"cpp_batch_size={batch_size}",
+        "--cpp-durations=2",
+    )
+    result.stdout.fnmatch_lines(
+        [
+            "*= slowest 2 C++ test durations =*",
+            "  C++ time   overhead  test",
+            "    *.???s     *.???s  test_*",
+            "    *.???s     *.???s  test_*",
+            "*= C++ durations per executable =*",
+            "  C++ time   overhead  executable",
+        ]
+    )
+    result.stdout.fnmatch_lines(["*s  test_gtest (* tests)"])
+    result.stdout.fnmatch_lines(["*s  test_boost_success (2 tests)"])
+
+
+# harness which uses 256M of memory before running the test executable
+ALLOCATE_SCRIPT = """
+import subprocess
+import sys
+
+data = b"x" * (256 * 1024 * 1024)
+sys.exit(subprocess.call(sys.argv[1:]))
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires os.wait4")
+@pytest.mark.parametrize("batch_size, shards", [(1, 1), (0, 1), (0, 2)])
+def test_cpp_usage(testdir, exes, batch_size, shards):
+    testdir.makepyfile(allocate=ALLOCATE_SCRIPT)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_batch_size = {batch_size}
+    """)
+    exes.get("gtest", "test_gtest")
+    result = testdir.inline_run(
+        "-k", "test_success or test_failure", f"--cpp-shards={shards}"
+    )
+    rep = result.matchreport("FooTest.test_success", "pytest_runtest_logreport")
+    properties = dict(rep.user_properties)
+    assert properties["cpp_user_time"] >= 0
+    assert properties["cpp_system_time"] >= 0
+    # peaks below the peak RSS of pytest are not known
+    assert properties.get("cpp_max_rss", 0) < 256 * 1024 * 1024
+
+    result = testdir.runpytest(
+        "-o",
+        f"cpp_harness={sys.executable} allocate.py",
+        "-k",
+        "test_success or test_failure",
+        "--cpp-usage=2",
+    )
+    result.stdout.fnmatch_lines(
+        [
+            "*= C++ tests with the highest peak RSS (top 2) =*",
+            "  peak RSS   CPU time  test",
+            "*M *.???s  test_gtest::FooTest.*",
+            "*M *.???s  test_gtest::FooTest.*",
+            "*= C++ tests with the highest CPU time (top 2) =*",
+        ]
+    )
+
+    result = testdir.runpytest(
+        "-o",
+        f"cpp_harness={sys.executable} allocate.py",
+        "-o",
+        "cpp_max_rss=128M",
+        "-k",
+        "test_success",
+    )
+    result.stdout.fnmatch_lines(
+        [
+            "*FooTest.test_success used 2??.?M of memory (peak RSS), "
+            "above cpp_max_rss of 128.0M",
+            "*1 failed*",
+        ]
+    )
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires RLIMIT_CPU")
+def test_cpp_max_cpu_time(testdir, exes):
+    testdir.makepyfile(spin="while True:\n    pass\n")
+    testdir.makeini(f"""
+        [pytest]
+        cpp_max_cpu_time = 0.5
+        cpp_timeout = 60
+        cpp_harness = {sys.executable} spin.py
+    """)
+    start = time.perf_counter()
+    result = testdir.runpytest(exes.get("gtest", "test_gtest"), "-k", "test_success")
+    result.stdout.fnmatch_lines(
+        [
+            "*FooTest.test_success used *s of CPU time, above cpp_max_cpu_time of 0.5s",
+            "*1 failed*",
+        ]
+    )
+    # killed by RLIMIT_CPU, before the timeout
+    assert time.perf_counter() - start < 30
+
+
+@pytest.mark.parametrize(
+    "option, expected",
+    [
+        ("cpp_max_rss=foo", "*cpp_max_rss must be a size like 512M or 4G*"),
+        ("cpp_max_rss=inf", "*cpp_max_rss must be a size like 512M or 4G*"),
+        ("cpp_max_cpu_time=-1", "*cpp_max_cpu_time must be a non-negative number*"),
+    ],
+)
+def test_cpp_usage_usage_error(testdir, option, expected):
+    result = testdir.runpytest("-o", option)
+    result.stderr.fnmatch_lines([expected])
+
+
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_cpp_output_capture_tail(testdir, exes, batch_size):
+    testdir.makeini(f"""
+        [pytest]
+        cpp_batch_size = {batch_size}
+        cpp_output_capture = tail
+        cpp_output_tail_size = 20
+        cpp_output_dir = logs
+    """)
+    exes.get("gtest", "test_gtest")
+    result = testdir.inline_run("-k", "test_success or test_failure")
+    rep = result.matchreport("FooTest.test_failure", "pytest_runtest_logreport")
+    [(name, output)] = rep.sections
+    assert name == "Captured c++ call"
+    log = testdir.tmpdir.join("logs", "test_gtest", "FooTest.test_failure.log")
+    full_output = log.read()
+    assert "[ RUN      ] FooTest.test_failure" in full_output
+    omitted = len(full_output) - 20
+    assert output == (
+        f"[{omitted} characters of output omitted, full output in {log}]\n"
+        + full_output[-20:]
+    )
+    assert testdir.tmpdir.join("logs", "test_gtest", "FooTest.test_success.log").check()
+
+
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_cpp_output_capture_failures_only(testdir, exes, batch_size):
+    testdir.makeini(f"""
+        [pytest]
+        cpp_batch_size = {batch_size}
+        cpp_output_capture = failures-only
+        cpp_output_tail_size = 0
+        cpp_output_dir = logs
+    """)
+    exes.get("gtest", "test_gtest")
+    result = testdir.inline_run("-k", "test_success or test_failure")
+    rep = result.matchreport("FooTest.test_success", "pytest_runtest_logreport")
+    assert rep.sections == []
+    rep = result.matchreport("FooTest.test_failure", "pytest_runtest_logreport")
+    [(name, output)] = rep.sections
+    assert "[ RUN      ] FooTest.test_failure" in output
+    # the output of the tests which passed is not written either
+    logs = testdir.tmpdir.join("logs", "test_gtest")
+    assert [x.basename for x in logs.listdir()] == ["FooTest.test_failure.log"]
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires os.wait4")
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_cpp_output_capture_failures_only_usage(testdir, exes, batch_size):
+    testdir.makepyfile(allocate=ALLOCATE_SCRIPT)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_batch_size = {batch_size}
+        cpp_output_capture = failures-only
+        cpp_harness = {sys.executable} allocate.py
+        cpp_max_rss = 128M
+    """)
+    exes.get("gtest", "test_gtest")
+    result = testdir.inline_run("-k", "test_success")
+    # the test failed after running, using too much memory
+    rep = result.matchreport("FooTest.test_success", "pytest_runtest_logreport")
+    assert rep.failed
+    [(name, output)] = rep.sections
+    assert "FooTest.test_success" in output
+
+
+def test_cpp_output_path(tmp_path):
+    path = pytest_cpp.plugin.get_output_path(tmp_path, tmp_path / "test_a", "a/b c")
+    assert path.parent == tmp_path / "test_a"
+    assert path.name.startswith("a_b_c-") and path.suffix == ".log"
+    assert path != pytest_cpp.plugin.get_output_path(
+        tmp_path, tmp_path / "test_a", "a_b_c"
+    )
+
+
+@pytest.mark.parametrize(
+    "option, expected",
+    [
+        ("cpp_output_capture=foo", "*cpp_output_capture must be one of*"),
+        ("cpp_output_tail_size=foo", "*cpp_output_tail_size must be a size like 64K*"),
+    ],
+)
+def test_cpp_output_capture_usage_error(testdir, option, expected):
+    result = testdir.runpytest("-o", option)
+    result.stderr.fnmatch_lines([expected])
+
+
+@pytest.mark.parametrize("batch_size", ["1", "0"])
+def test_google_benchmark_run(testdir, exes, mocker, batch_size):
+    spy = mocker.spy(subprocess, "Popen")
+    result = testdir.inline_run(
+        "-v",
+        exes.get("benchmark", "test_benchmark"),
+        "-o",
+        f"cpp_batch_size={batch_size}",
+    )
+    assert_outcomes(
+        result,
+        [
+            ("BM_memcpy/8/iterations:100", "passed"),
+            ("BM_memcpy/64/iterations:100", "passed"),
+            ("BM_error/iterations:100", "failed"),
+        ],
+    )
+    run_calls = [
+        c
+        for c in spy.call_args_list
+        if any("--benchmark_filter" in x for x in c.args[0])
+    ]
+    assert len(run_calls) == (3 if batch_size == "1" else 1)
+
+    rep = result.matchreport("BM_memcpy/64/iterations:100", "pytest_runtest_logreport")
+    properties = dict(rep.user_properties)
+    assert properties["iterations"] == 100
+    assert properties["time_unit"] == "ns"
+    assert properties["real_time"] > 0
+    assert properties["cpu_time"] > 0
+    assert properties["bytes"] == 64
+    assert properties["cpp_duration"] > 0
+
+    rep = result.matchreport("BM_error/iterations:100", "pytest_runtest_logreport")
+    assert "could not set up the benchmark" in str(rep.longrepr)
+
+
+def test_google_benchmark_baseline(testdir, exes):
+    exes.get("benchmark", "test_benchmark")
+    baseline = {
+        "benchmarks": [
+            {
+                "name": "BM_memcpy/8/iterations:100",
+                "run_name": "BM_memcpy/8/iterations:100",
+                "run_type": "iteration",
+                "iterations": 100,
+                "real_time": 1e-6,
+                "cpu_time": 1e-6,
+                "time_unit": "ns",
+            },
+            {
+                "name": "BM_memcpy/64/iterations:100",
+                "run_name": "BM_memcpy/64/iterations:100",
+                "run_type": "iteration",
+                "iterations": 100,
+                "real_time": 1.0,
+                "cpu_time": 1.0,
+                "time_unit": "s",
+            },
+        ]
+    }
+    testdir.makefile(".json", baseline=json.dumps(baseline))
+    testdir.makeini("""
+        [pytest]
+        cpp_benchmark_baseline = baseline.json
+        cpp_benchmark_threshold = 0.5
+    """)
+    result = testdir.inline_run("-v")
+    assert_outcomes(
+        result,
+        [
+            ("BM_memcpy/8/iterations:100", "failed"),
+            ("BM_memcpy/64/iterations:100", "passed"),
+            ("BM_error/iterations:100", "failed"),
+        ],
+    )
+    rep = result.matchreport("BM_memcpy/8/iterations:100", "pytest_runtest_logreport")
+    assert "BM_memcpy/8/iterations:100 is " in str(rep.longrepr)
+    assert "% slower than the baseline (real_time: " in str(rep.longrepr)
+    assert "baseline: 1e-06 ns), above the threshold of 50.0%" in str(rep.longrepr)
+
+
+@pytest.mark.parametrize(
+    "option, expected",
+    [
+        (
+            "cpp_benchmark_threshold=-1",
+            "*cpp_benchmark_threshold must be a non-negative*",
+        ),
+        ("cpp_benchmark_metric=foo", "*cpp_benchmark_metric must be one of*"),
+        (
+            "cpp_benchmark_baseline=missing.json",
+            "*could not read cpp_benchmark_baseline*",
+        ),
+    ],
+)
+def test_google_benchmark_usage_error(testdir, option, expected):
+    result = testdir.runpytest("-o", option)
+    result.stderr.fnmatch_lines([expected])
+
+
+def test_google_benchmark_filter():
+    assert make_filter(["BM_a/8", "BM_b<int>/min_time:0.1"]) == (
+        r"^(BM_a/8|BM_b<int>/min_time:0\.1)$"
+    )
+
+
+# keep the benchmarks of the Catch2 executables short
+CATCH2_BENCHMARK_ARGS = (
+    "--benchmark-samples 10 --benchmark-resamples 100 --benchmark-warmup-time 1"
+)
+
+
+@pytest.mark.parametrize("suffix", ["", "_v3"])
+def test_catch2_benchmark_run(testdir, exes, suffix):
+    exes.get(f"catch2_benchmark{suffix}", "test_catch2_benchmark")
+    testdir.makeini(f"""
+        [pytest]
+        cpp_arguments = {CATCH2_BENCHMARK_ARGS}
+        cpp_batch_size = 0
+    """)
+    result = testdir.inline_run("-v")
+    assert_outcomes(result, [("Fibonacci", "passed"), ("No benchmarks", "passed")])
+
+    rep = result.matchreport("Fibonacci", "pytest_runtest_logreport")
+    properties = dict(rep.user_properties)
+    for name in ("Fibonacci 10", "Fibonacci 15"):
+        assert properties[f"benchmark[{name}].samples"] == 10
+        assert properties[f"benchmark[{name}].iterations"] >= 1
+        assert properties[f"benchmark[{name}].mean"] > 0
+        assert properties[f"benchmark[{name}].std_deviation"] >= 0
+        assert (
+            properties[f"benchmark[{name}].mean_lower_bound"]
+            <= properties[f"benchmark[{name}].mean"]
+            <= properties[f"benchmark[{name}].mean_upper_bound"]
+        )
+
+    rep = result.matchreport("No benchmarks", "pytest_runtest_logreport")
+    assert not any(name.startswith("benchmark[") for name, _ in rep.user_properties)
+
+
+def test_catch2_benchmark_baseline(testdir, exes):
+    exes.get("catch2_benchmark", "test_catch2_benchmark")
+    testdir.makefile(
+        ".xml",
+        baseline="""
+        <Catch name="test_catch2_benchmark">
+          <Group name="test_catch2_benchmark">
+            <TestCase name="Fibonacci">
+              <BenchmarkResults name="Fibonacci 10" samples="10" iterations="1">
+                <mean value="0.001" lowerBound="0.001" upperBound="0.001" ci="0.95"/>
+              </BenchmarkResults>
+              <Section name="larger">
+                <BenchmarkResults name="Fibonacci 15" samples="10" iterations="1">
+                  <mean value="1e12" lowerBound="1e12" upperBound="1e12" ci="0.95"/>
+                </BenchmarkResults>
+              </Section>
+              <OverallResult success="true"/>
+            </TestCase>
+          </Group>
+        </Catch>
+        """,
+    )
+    testdir.makeini(f"""
+        [pytest]
+        cpp_arguments = {CATCH2_BENCHMARK_ARGS}
+        cpp_catch2_benchmark_baseline = baseline.xml
+        cpp_benchmark_threshold = 0.5
+    """)
+    result = testdir.inline_run("-v")
+    assert_outcomes(result, [("Fibonacci", "failed"), ("No benchmarks", "passed")])
+    rep = result.matchreport("Fibonacci", "pytest_runtest_logreport")
+    assert "benchmark Fibonacci 10 is " in str(rep.longrepr)
+    assert "% slower than the baseline (mean: " in str(rep.longrepr)
+    assert "baseline: 0.001 ns), above the threshold of 50.0%" in str(rep.longrepr)
+    assert "Fibonacci 15" not in str(rep.longrepr)
+
+
+def test_catch2_benchmark_usage_error(testdir):
+    result = testdir.runpytest("-o", "cpp_catch2_benchmark_baseline=missing.xml")
+    result.stderr.fnmatch_lines(["*could not read cpp_catch2_benchmark_baseline*"])
+
+
+@pytest.mark.parametrize("batch_size", [1, 0])
+def test_cpp_profile_overhead(testdir, exes, batch_size):
+    exes.get("gtest", "test_gtest")
+    result = testdir.runpytest_inprocess(
+        "--cpp-profile-overhead=overhead.json", "-o", f"cpp_batch_size={batch_size}"
+    )
+    result.assert_outcomes(passed=1, failed=2, skipped=3)
+    result.stdout.fnmatch_lines(
+        [
+            "*= pytest-cpp overhead =*",
+            "*total*calls*phase",
+            "*s *1  probe (*)",
+            "*s *1  list (*)",
+            "*s *  spawn (*)",
+            "*s *  run (*)",
+            "*s *  parse (*)",
+            "*s *  repr (*)",
+            "*- slowest executables per phase -*",
+            "probe:",
+            "*s  test_gtest",
+        ]
+    )
+
+    with open(testdir.tmpdir.join("overhead.json")) as f:
+        data = json.load(f)
+    assert list(data["phases"]) == ["probe", "list", "spawn", "run", "parse", "repr"]
+    assert all(x["calls"] > 0 for x in data["phases"].values())
+    assert data["phases"]["spawn"]["calls"] == (6 if batch_size == 1 else 1)
+    [repr_timing] = [
+        x
+        for x in data["timings"]
+        if x["phase"] == "repr" and x["test"] == "FooTest.test_failure"
+    ]
+    assert repr_timing["executable"].endswith("test_gtest")
+    assert repr_timing["total"] > 0
+
+
+HANG_SCRIPT = """
+import subprocess, sys, time
+print("started", subprocess.Popen(["sleep", "30"]).pid, flush=True)
+time.sleep(30)
+"""
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires sleep")
+@pytest.mark.parametrize("track_usage", [False, True])
+def test_run_process_timeout(track_usage):
+    with pytest.raises(subprocess.TimeoutExpired) as excinfo:
+        with tracked_usage() if track_usage else contextlib.nullcontext():
+            run_process([sys.executable, "-c", HANG_SCRIPT], timeout=1)
+    _, pid = excinfo.value.output.split()
+    # the whole process group is killed, including processes started by the executable
+    for _ in range(50):
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("process was not killed")
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires os.wait4")
+def test_run_process_usage(mocker):
+    spy = mocker.spy(subprocess, "Popen")
+    with tracked_usage(cpu_time_limit=10) as usages:
+        result = run_process([sys.executable, "-c", "print('hello'); exit(3)"])
+        assert (result.returncode, result.stdout) == (3, "hello\n")
+        script = "import os, signal; os.kill(os.getpid(), signal.SIGKILL)"
+        result = run_process([sys.executable, "-c", script])
+        assert result.returncode == -signal.SIGKILL
+    assert len(usages) == 2
+    assert all(x.cpu_time > 0 for x in usages)
+    # the limits are set without running code in the child process before it executes
+    assert all("preexec_fn" not in c.kwargs for c in spy.call_args_list)
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires os.wait4")
+def test_run_process_usage_unknown(mocker):
+    """Processes are still waited for when os.wait4 fails, with an unknown usage."""
+    mocker.patch.object(os, "wait4", side_effect=ChildProcessError)
+    with tracked_usage() as usages:
+        result = run_process([sys.executable, "-c", "print('hello'); exit(3)"])
+    assert (result.returncode, result.stdout) == (3, "hello\n")
+    assert usages == []
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires sleep")
+@pytest.mark.parametrize(
+    "facade, name, test_id",
+    [
+        (GoogleTestFacade(), "gtest", "FooTest.test_success"),
+        (BoostTestFacade(), "boost_success", "test_success_1"),
+        (
+            Catch2Facade(Catch2Version.V3),
+            "catch2_success_v3",
+            "Factorials are computed",
+        ),
+    ],
+)
+def test_run_test_timeout(exes, facade, name, test_id):
+    harness = [sys.executable, "-c", HANG_SCRIPT]
+    failures, output, _ = facade.run_test(
+        exes.get(name), test_id, harness=harness, timeout=1
+    )
+    assert output.startswith("started")
+    lines = "\n".join(x for x, _ in failures[0].get_lines())
+    assert "did not finish within 1 seconds and was killed" in lines
+    assert "started" in lines
+
+    results, output, error = facade.run_tests(
+        exes.get(name), [test_id], harness=harness, timeout=1
+    )
+    assert results == {}
+    assert output.startswith("started")
+    assert "did not finish within 1 seconds" in error.get_lines()[0][0]
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires sleep")
+def test_cpp_timeout(testdir, exes):
+    testdir.makepyfile(hang=HANG_SCRIPT)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_timeout = 1
+        cpp_harness = {sys.executable} hang.py
+    """)
+    result = testdir.runpytest(exes.get("gtest", "test_gtest"), "-k", "test_success")
+    result.stdout.fnmatch_lines(
+        [
+            "*Timeout: calling *test_gtest for FooTest.test_success did not finish within "
+            "1.0 seconds and was killed, output so far:",
+            "*started*",
+            "*1 failed*",
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "batch_timeout, expected",
+    [
+        ("0", 6.0),
+        ("3", 3.0),
+        ("10", 6.0),
+    ],
+)
+def test_cpp_timeout_batches(testdir, exes, mocker, batch_timeout, expected):
+    """cpp_timeout applies to each test of a batch, capped by cpp_batch_timeout."""
+    spy = mocker.spy(GoogleTestFacade, "run_tests")
+    testdir.inline_run(
+        exes.get("gtest", "test_gtest"),
+        "-k",
+        "skipped or test_success",
+        "-o",
+        "cpp_batch_size=0",
+        "-o",
+        "cpp_timeout=2",
+        "-o",
+        f"cpp_batch_timeout={batch_timeout}",
+    )
+    assert spy.call_count == 1
+    assert len(spy.call_args.args[2]) == 3
+    assert spy.call_args.kwargs["timeout"] == expected
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="requires sleep")
+@pytest.mark.parametrize("collect_workers", [0, 2])
+def test_cpp_collect_timeout(testdir, exes, collect_workers):
+    testdir.makepyfile(hang=HANG_SCRIPT)
+    testdir.makeini(f"""
+        [pytest]
+        cpp_collect_timeout = 1
+        cpp_harness_collect = {sys.executable} hang.py
+        cpp_collect_workers = {collect_workers}
+    """)
+    exes.get("gtest", "test_gtest")
+    exes.get("catch2_success", "test_catch2")
+    result = testdir.runpytest()
+    result.stdout.fnmatch_lines(
+        [
+            "*ERROR collecting test_catch2*",
+            "*hang.py *test_catch2 --help did not finish within 1.0 seconds "
+            "(cpp_collect_timeout) and was killed, output so far:",
+            "started *",
+            "*2 errors*",
+        ]
+    )
+
+
+def test_timeout_usage_error(testdir, exes):
+    result = testdir.runpytest(exes.get("gtest"), "-o", "cpp_timeout=foo")
+    result.stderr.fnmatch_lines("*cpp_timeout must be a non-negative number*")
+    result = testdir.runpytest(exes.get("gtest"), "-o", "cpp_batch_timeout=-1")
+    result.stderr.fnmatch_lines("*cpp_batch_timeout must be a non-negative number*")
+
+
 class TestError:
     def test_get_whitespace(self):
         assert error.get_left_whitespace("  foo") == "  "
@@ -664,3 +2628,35 @@ class TestError:
 
         invalid = str(tmp_path.joinpath("invalid"))
         assert error.get_code_context_around_line(invalid, 10) == []
+        assert error.get_code_context_around_line(str(f), 0) == []
+        assert error.get_code_context_around_line(str(f), 10) == []
+
+    def test_get_code_context_around_line_cache(self, tmp_path):
+        f = tmp_path.joinpath("generated.cpp")
+        f.write_bytes(b"".join(b"  line%d\r\n" % i for i in range(1, 10001)))
+        error._get_line_offsets.cache_clear()
+
+        for linenum in range(3, 10001):
+            assert error.get_code_context_around_line(str(f), linenum) == [
+                f"  line{linenum - 2}",
+                f"  line{linenum - 1}",
+                f"  line{linenum}",
+            ]
+        # the file was indexed only once
+        assert error._get_line_offsets.cache_info().misses == 1
+
+        # changed files are indexed again
+        f.write_text("changed1\nchanged2\n")
+        assert error.get_code_context_around_line(str(f), 2) == [
+            "changed1",
+            "changed2",
+        ]
+        assert error._get_line_offsets.cache_info().misses == 2
+
+    def test_code_context_only_for_terminal(self, tmp_path, mocker, dummy_failure):
+        spy = mocker.spy(error, "get_code_context_around_line")
+        dummy_failure.lines = [("error message", {"red"})]
+        dummy_failure.file_reference = str(tmp_path.joinpath("test.cpp")), 20
+        failure_repr = CppFailureRepr([dummy_failure])
+        str(failure_repr)
+        assert spy.call_count == 0